@@ -0,0 +1,66 @@
+import os
+import time
+import multiprocessing
+from BufferReader import BufferReader
+from Lexer import Lexer
+from FastLexer import FastLexer
+from Parser import tryParseWholeFileScope
+from ParseCache import parseCached, flatten, unflatten
+
+# Parses many files, in a pool of worker processes when jobs > 1. Results come
+# back in the order the files were given, one file failing doesn't stop the
+# rest, and only the pass/fail, error and timing travel back between processes
+# unless the ASTs are asked for - which travel flattened, so that their names
+# are looked up again in this process's SymbolTable.
+
+def findSources(paths):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (directory, subdirectories, files) in os.walk(path):
+                subdirectories.sort()
+                sources += [os.path.join(directory, file) for file in sorted(files) if file[-5:] == ".minx"]
+        else:
+            sources.append(path)
+    return sources
+
+def parseFile(path, fastLexer = True, keepAst = False, cacheDir = None):
+    start = time.time()
+    size = 0
+    expression = None
+    error = None
+    try:
+        size = os.path.getsize(path)
+        lexerClass = FastLexer if fastLexer else Lexer
+        if cacheDir != None:
+            expression = parseCached(path, cacheDir, lexerClass)
+        else:
+            expression = tryParseWholeFileScope(lexerClass(BufferReader(path)))
+    except Exception as e:
+        error = "{0}: {1}".format(type(e).__name__, e)
+    return (path, error, time.time() - start, size, expression if keepAst else None)
+
+# multiprocessing can only send one argument to a worker
+def parseFileArgs(args):
+    return parseFile(*args)
+
+def parseFileFlattened(args):
+    (path, error, elapsed, size, expression) = parseFile(*args)
+    return (path, error, elapsed, size, flatten(expression) if expression != None else None)
+
+def parseFiles(paths, jobs = 1, fastLexer = True, keepAst = False, cacheDir = None):
+    args = [(path, fastLexer, keepAst, cacheDir) for path in paths]
+    if jobs <= 1:
+        for arg in args:
+            yield parseFileArgs(arg)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # imap keeps the results in order, while later files are still being parsed
+        for (path, error, elapsed, size, flattened) in pool.imap(parseFileFlattened, args, chunksize = max(1, min(16, len(args) / (jobs * 4)))):
+            yield (path, error, elapsed, size, unflatten(flattened) if flattened != None else None)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
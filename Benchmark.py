@@ -0,0 +1,615 @@
+import sys
+import time
+import optparse
+import logging
+import os
+import json
+import tempfile
+import resource
+import multiprocessing
+import subprocess
+import threading
+import shutil
+from FileReader import FileReader
+from BufferReader import StringReader, BufferReader, StreamReader
+from Lexer import Lexer, TOKEN_FILEEND
+from FastLexer import FastLexer
+from TokenBuffer import TokenBuffer
+from Parser import tryParseWholeFileScope, iterWholeFileScope
+from Incremental import IncrementalParse
+from Generator import ProgramShape, generateProgram
+from Evaluator import compileProgram, force, member, compileMatcher, compileSequentialMatcher, symbol, Shape, Scope
+from TreeWalker import evaluateProgramWalking
+from Lowering import lower
+from Client import ParseClient
+from Parallel import parallelLex, parallelParse
+from Modules import ModuleLoader, RuleTrie, allowsLinear
+from TypeChecker import TypeChecker
+from Resolver import resolveNames
+from SymbolTable import symbolTable
+import random
+
+def infixChain(operands):
+    ops = ["+", "-", "*", "/", "^", "%", "++", "<="]
+    terms = ["x" + str(i) if i % 2 else str(i) for i in range(operands)]
+    chain = [terms[0]]
+    for i in range(1, operands):
+        chain.append(ops[i % len(ops)])
+        chain.append(terms[i])
+    return "result = " + " ".join(chain) + "\n"
+
+def testPrograms(copies):
+    testPath = "./test-valid-programs/"
+    sources = [open(testPath + path).read() for path in sorted(os.listdir(testPath)) if path[-5:] == ".minx"]
+    return "\n".join(sources * copies)
+
+def timeParse(source):
+    start = time.time()
+    tryParseWholeFileScope(FastLexer(StringReader(source)))
+    return time.time() - start
+
+def benchmarkInfixChains(sizes):
+    # the time per operand should stay flat as the chains get longer
+    for size in sizes:
+        elapsed = timeParse(infixChain(size))
+        print "infix chain of {0:>7} operands: {1:8.3f}s, {2:6.2f}us per operand".format(size, elapsed, elapsed * 1e6 / size)
+
+# bytes taken by the tuples, lists and strings of an AST, counting each node
+# once per reference (as if nothing were shared) and once per object. Strings
+# are counted once either way, as names were already shared string literals.
+def astSizes(expression):
+    treeSize = 0
+    sharedSize = 0
+    seen = set()
+    stack = [expression]
+    while len(stack) != 0:
+        item = stack.pop()
+        if isinstance(item, (tuple, list, str)):
+            size = sys.getsizeof(item)
+            isNew = id(item) not in seen
+            if isNew:
+                seen.add(id(item))
+                sharedSize += size
+            if isinstance(item, str):
+                treeSize += size if isNew else 0
+            else:
+                treeSize += size
+                stack.extend(item)
+    return (treeSize, sharedSize)
+
+def benchmarkMemory(copies):
+    source = testPrograms(copies)
+    expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+    (treeSize, sharedSize) = astSizes(expression)
+    print "AST of {0} source bytes: {1} bytes unshared, {2} bytes with interned nodes ({3:.0%})".format(len(source), treeSize, sharedSize, float(sharedSize) / treeSize)
+
+def benchmarkLowering(copies):
+    # arithmetic on constants folds away entirely; the rest still shrinks
+    arithmetic = "\n".join("value{0} = {0} * 2 + {0} ^ 2 - 3 / 4 % 5".format(i) for i in range(copies)) + "\n"
+    numbers = "numbers = [" + ", ".join(str(i) for i in range(copies)) + "]\n"
+    for (name, source) in [("test programs", testPrograms(copies)), ("infix chain", infixChain(copies)), ("arithmetic", arithmetic), ("list", numbers)]:
+        expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+        size = astSizes(expression)[1]
+        parts = []
+        for fold in [False, True]:
+            start = time.time()
+            loweredSize = astSizes(lower(expression, fold))[1]
+            parts.append("{0} {1:>9} bytes ({2:4.1f}x smaller, {3:.3f}s)".format("folded" if fold else "lowered", loweredSize, float(size) / loweredSize, time.time() - start))
+        print "{0:<13} AST {1:>9} bytes, {2}".format(name, size, ", ".join(parts))
+
+def benchmarkIncremental(copies):
+    # an edit in the middle of the file should only cost its own declaration
+    source = testPrograms(copies)
+    start = time.time()
+    incremental = IncrementalParse(source)
+    fullElapsed = time.time() - start
+
+    middle = incremental.starts[len(incremental.starts) / 2]
+    start = time.time()
+    incremental.edit(middle, middle, "edited = 1 + 2\n")
+    editElapsed = time.time() - start
+    print "edit of {0} source bytes: full parse {1:.3f}s, incremental {2:.4f}s reparsing {3} bytes".format(len(source), fullElapsed, editElapsed, incremental.reparsedRange[1] - incremental.reparsedRange[0])
+
+# generated programs that each stress one part of the front end
+def stageWorkloads(scale):
+    return [
+        ("nesting", ProgramShape(20 * scale, nesting = 50, infix = 0, listItems = 0, caseBranches = 0, interpolations = 0)),
+        ("infix", ProgramShape(20 * scale, nesting = 0, infix = 200, listItems = 0, caseBranches = 0, interpolations = 0)),
+        ("list", ProgramShape(20 * scale, nesting = 0, infix = 0, listItems = 200, caseBranches = 0, interpolations = 0)),
+        ("case", ProgramShape(20 * scale, nesting = 0, infix = 0, listItems = 0, caseBranches = 100, interpolations = 0)),
+        ("strings", ProgramShape(100 * scale, nesting = 0, infix = 0, listItems = 0, caseBranches = 0, interpolations = 20)),
+        ("mixed", ProgramShape(100 * scale))]
+
+def readAll(charSource):
+    chars = 0
+    while charSource.get() != None:
+        chars += 1
+    return chars
+
+def lexAll(tokenSource):
+    tokens = 0
+    while tokenSource.get()[0] != TOKEN_FILEEND:
+        tokens += 1
+    return tokens
+
+def countNodes(expression):
+    nodes = 0
+    stack = [expression]
+    while len(stack) != 0:
+        item = stack.pop()
+        if isinstance(item, (tuple, list)):
+            if hasattr(item, "_fields"):
+                nodes += 1
+            stack.extend(item)
+    return nodes
+
+# Each stage runs the whole pipeline up to it, reading the file from disk, so
+# the rates are end to end: characters per second through the reader, tokens
+# per second through the lexer and nodes per second through the parser.
+stages = [
+    ("read", lambda path: readAll(FileReader(path))),
+    ("lex", lambda path: lexAll(Lexer(FileReader(path)))),
+    ("parse", lambda path: countNodes(tryParseWholeFileScope(Lexer(FileReader(path))))),
+    ("fastlex", lambda path: lexAll(FastLexer(BufferReader(path)))),
+    ("fastparse", lambda path: countNodes(tryParseWholeFileScope(FastLexer(BufferReader(path)))))]
+
+# runs in its own process, so that the peak memory is the stage's own - as
+# the growth of the peak, since a forked process starts with this one's
+def runStage(args):
+    (stage, path, repeat) = args
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    run = dict(stages)[stage]
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        count = run(path)
+        elapsed = time.time() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return (count, best, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+
+def benchmarkStages(scale, seed, repeat):
+    units = {"read": "chars", "lex": "tokens", "fastlex": "tokens", "parse": "nodes", "fastparse": "nodes"}
+    timings = {}
+    print "{0:<8} {1:<10} {2:>10} {3:>10} {4:>9} {5:>14} {6:>12}".format("workload", "stage", "chars", "count", "seconds", "rate", "+peak KB")
+    for (name, shape) in stageWorkloads(scale):
+        source = generateProgram(shape, seed)
+        (handle, path) = tempfile.mkstemp(suffix = ".minx")
+        try:
+            with os.fdopen(handle, 'wb') as sourceFile:
+                sourceFile.write(source)
+            for (stage, run) in stages:
+                pool = multiprocessing.Pool(1)
+                try:
+                    (count, elapsed, peakKb) = pool.apply(runStage, [(stage, path, repeat)])
+                finally:
+                    pool.terminate()
+                    pool.join()
+                rate = "{0:.0f} {1}/s".format(count / elapsed, units[stage]) if elapsed > 0 else "-"
+                print "{0:<8} {1:<10} {2:>10} {3:>10} {4:>9.3f} {5:>14} {6:>12}".format(name, stage, len(source), count, elapsed, rate, peakKb)
+                timings[name + "/" + stage] = elapsed
+        finally:
+            os.remove(path)
+    return timings
+
+# the stages that take more than tolerance percent longer than in the baseline
+def findRegressions(timings, baseline, tolerance):
+    regressions = []
+    for key in sorted(timings):
+        if key in baseline and timings[key] > baseline[key] * (1 + tolerance / 100.0):
+            regressions.append((key, baseline[key], timings[key]))
+    return regressions
+
+def peakAfter(args):
+    (path, streaming) = args
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    names = len(symbolTable)
+    start = time.time()
+    if streaming:
+        declarations = 0
+        for declaration in iterWholeFileScope(Lexer(StreamReader(path))):
+            declarations += 1
+    else:
+        declarations = len(tryParseWholeFileScope(Lexer(BufferReader(path)))[1])
+    return (declarations, time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, len(symbolTable) - names)
+
+def benchmarkStreaming(scale, seed):
+    # a streamed parse's memory should not grow with the length of the file,
+    # a whole parse's should. It still grows with the names new to the
+    # SymbolTable, which keeps every one: generated programs of 500, 2000 and
+    # 8000 declarations (5000, 15000 and 31000 names) peaked at about +2MB,
+    # +8MB and +16MB streamed, against +6MB, +26MB and +90MB whole, but the
+    # first of them repeated 4 and 16 times, with no new names, stayed under
+    # +2MB streamed.
+    first = generateProgram(ProgramShape(500 * scale), seed)
+    programs = [("generated", first)]
+    programs += [("generated", generateProgram(ProgramShape(declarations * scale), seed)) for declarations in [2000, 8000]]
+    programs += [("repeated", first * repeats) for repeats in [4, 16]]
+    for (kind, source) in programs:
+        (handle, path) = tempfile.mkstemp(suffix = ".minx")
+        try:
+            with os.fdopen(handle, 'wb') as sourceFile:
+                sourceFile.write(source)
+            for streaming in [False, True]:
+                # a fresh process each time, so each peak is its own
+                pool = multiprocessing.Pool(1)
+                try:
+                    (count, elapsed, peakKb, names) = pool.apply(peakAfter, [(path, streaming)])
+                finally:
+                    pool.terminate()
+                    pool.join()
+                print "{0} {1:<9} {2:>8} bytes, {3:>6} declarations, {4:>6} new names: {5:8.3f}s, peak memory +{6} KB".format(
+                    "streamed" if streaming else "whole   ", kind, len(source), count, names, elapsed, peakKb)
+        finally:
+            os.remove(path)
+
+# the README's list indexing, and a sum, both recursing once per list item
+def recursiveProgram(length):
+    return """item = case list
+    | {{hd, tl}} : case index
+        | 0 : hd
+        | else : item ({{oldIndex = index}} as {{list = tl, index = oldIndex - 1}})
+    | else : `invalid_index
+sum = case list
+    | {{hd, tl}} : hd + (sum {{list = tl}})
+    | else : 0
+numbers = [{0}]
+last = item {{list = numbers, index = {1}}}
+total = sum {{list = numbers}}
+""".format(", ".join(str(i) for i in range(length)), length - 1)
+
+# each item of a list recursed along takes a handful of Python frames, and
+# past this many the C stack overflows however high the recursion limit is
+maxRecursionLength = 2000
+
+def benchmarkEvaluator(lengths, repeat):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 20 * min(max(lengths), maxRecursionLength)))
+    try:
+        for length in lengths:
+            if length > maxRecursionLength:
+                print "list of {0:>5} items: skipped, too deep to recurse along (at most {1})".format(length, maxRecursionLength)
+                continue
+            expression = tryParseWholeFileScope(FastLexer(StringReader(recursiveProgram(length))))
+            start = time.time()
+            code = compileProgram(expression)
+            print "resolving and compiling, {0:>5} items: {1:8.4f}s".format(length, time.time() - start)
+
+            timings = []
+            for (name, evaluate) in [("tree-walking", evaluateProgramWalking), ("compiled", lambda expression: code.value(None, None))]:
+                best = None
+                for i in range(repeat):
+                    start = time.time()
+                    scope = evaluate(expression)
+                    results = (force(member(scope, "last")), force(member(scope, "total")))
+                    elapsed = time.time() - start
+                    best = elapsed if best == None else min(best, elapsed)
+                if results != (length - 1, length * (length - 1) / 2):
+                    raise Exception("{0} evaluation gave {1}".format(name, results))
+                timings.append(best)
+                print "{0:<12} list of {1:>5} items: {2:8.4f}s, {3:9.0f} calls/s".format(name, length, best, 2 * length / best)
+            print "compiled is {0:.1f}x the speed of tree-walking".format(timings[0] / timings[1])
+    finally:
+        sys.setrecursionlimit(limit)
+
+# a list built by recursion and walked by the README's item and by a running
+# total, each recursing once per item through tail calls
+def tailCallProgram(length):
+    return """count = case n
+    | 0 : `empty_list
+    | else : {{hd = n, tl = count ({{m = n}} as {{n = m - 1}})}}
+item = case list
+    | {{hd, tl}} : case index
+        | 0 : hd
+        | else : item ({{oldIndex = index}} as {{list = tl, index = oldIndex - 1}})
+    | else : `invalid_index
+total = case list
+    | {{hd, tl}} : case sum
+        | s int : total ({{oldSum = s}} as {{list = tl, sum = oldSum + hd}})
+    | else : sum
+numbers = count {{n = {0}}}
+last = item {{list = numbers, index = {1}}}
+summed = total {{list = numbers, sum = 0}}
+""".format(length, length - 1)
+
+def benchmarkTailCalls(lengths):
+    # without trampolining each item takes Python frames, and long lists overflow the stack
+    for length in lengths:
+        expression = tryParseWholeFileScope(FastLexer(StringReader(tailCallProgram(length))))
+        for trampolined in [False, True]:
+            scope = compileProgram(expression, trampolined).value(None, None)
+            parts = []
+            try:
+                for (name, expected) in [("last", 1), ("summed", length * (length + 1) / 2)]:
+                    start = time.time()
+                    result = force(member(scope, name))
+                    elapsed = time.time() - start
+                    if result != expected:
+                        raise Exception("{0} gave {1}".format(name, result))
+                    parts.append("{0} {1:8.3f}s ({2:6.2f}us per item)".format(name, elapsed, elapsed * 1e6 / length))
+            except RuntimeError:
+                parts.append("overflowed the stack")
+            print "{0:<12} {1:>8} items: {2}".format("trampolined" if trampolined else "plain", length, ", ".join(parts))
+
+# a list literal as a configuration file might have, and the last item
+# fetched by the README's item
+def listLiteralProgram(length):
+    return """item = case list
+    | {{hd, tl}} : case index
+        | 0 : hd
+        | else : item ({{oldIndex = index}} as {{list = tl, index = oldIndex - 1}})
+    | else : `invalid_index
+numbers = [{0}]
+last = item {{list = numbers, index = {1}}}
+""".format(", ".join(str(i) for i in range(length)), length - 1)
+
+def benchmarkPackedLists(lengths, consLength):
+    # the {hd, tl} scopes lists desugar to are compiled and resolved by recursion
+    consLength = min(consLength, maxRecursionLength)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 20 * consLength))
+    try:
+        for length in lengths:
+            source = listLiteralProgram(length)
+            for packed in [False, True]:
+                if not packed and length > consLength:
+                    print "{0:<6} {1:>8} items: skipped, too deep to compile as {{hd, tl}} scopes".format("cons", length)
+                    continue
+                start = time.time()
+                expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+                if packed:
+                    expression = lower(expression, False)
+                parsed = time.time()
+                scope = compileProgram(expression, True).value(None, None)
+                compiled = time.time()
+                if force(member(scope, "last")) != length - 1:
+                    raise Exception("indexing a list of {0} gave {1}".format(length, force(member(scope, "last"))))
+                indexed = time.time()
+                print "{0:<6} {1:>8} items: AST {2:>10} bytes, parse {3:6.2f}us, compile {4:6.2f}us, index {5:6.2f}us per item".format(
+                    "packed" if packed else "cons", length, astSizes(expression)[1], (parsed - start) * 1e6 / length,
+                    (compiled - parsed) * 1e6 / length, (indexed - compiled) * 1e6 / length)
+    finally:
+        sys.setrecursionlimit(limit)
+
+def medianTime(run, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+    return sorted(timings)[len(timings) / 2]
+
+def benchmarkServer(repeat, clients):
+    # a build running the command line once per file, against one asking a server
+    testPath = "./test-valid-programs/"
+    paths = [testPath + path for path in sorted(os.listdir(testPath)) if path[-5:] == ".minx"]
+    socketDir = tempfile.mkdtemp()
+    socketPath = os.path.join(socketDir, "server")
+    server = subprocess.Popen([sys.executable, "Server.py", "--socket", socketPath])
+    try:
+        while not os.path.exists(socketPath):
+            time.sleep(0.01)
+        with open(os.devnull, 'w') as devnull:
+            run = lambda command: subprocess.check_call(command, stdout = devnull)
+            cold = medianTime(lambda: [run([sys.executable, "implementation.py", path]) for path in paths], repeat)
+            thin = medianTime(lambda: [run([sys.executable, "Client.py", "--socket", socketPath, path]) for path in paths], repeat)
+        client = ParseClient(socketPath)
+        # the source changes every time, so nothing is answered from the cache
+        sources = [open(path).read() for path in paths]
+        runs = [0]
+        def parseUncached():
+            runs[0] += 1
+            for source in sources:
+                client.request({"source": source + "\nrun{0} = 1\n".format(runs[0])})
+        uncached = medianTime(parseUncached, repeat)
+        cached = medianTime(lambda: [client.parse(path) for path in paths], repeat)
+        client.close()
+
+        print "{0} files, per file: cold command line {1:7.2f}ms, thin client {2:7.2f}ms, warm server {3:7.2f}ms, cached {4:7.3f}ms".format(
+            len(paths), cold * 1e3 / len(paths), thin * 1e3 / len(paths), uncached * 1e3 / len(paths), cached * 1e3 / len(paths))
+
+        # each client on its own connection, all at once
+        connections = [ParseClient(socketPath) for i in range(clients)]
+        def parseAll(connection):
+            for i in range(repeat):
+                for path in paths:
+                    connection.parse(path)
+        threads = [threading.Thread(target = parseAll, args = [connection]) for connection in connections]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        for connection in connections:
+            connection.close()
+        print "{0} clients at once: {1} requests in {2:.3f}s ({3:.0f} requests/s)".format(clients, clients * repeat * len(paths), elapsed, clients * repeat * len(paths) / elapsed)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(socketDir)
+
+def benchmarkParallel(scale, seed, repeat, jobCounts):
+    # one large file, lexed and parsed whole against in chunks
+    source = generateProgram(ProgramShape(2000 * scale), seed)
+    print "{0} source bytes on {1} cpus".format(len(source), multiprocessing.cpu_count())
+    lexSequential = medianTime(lambda: TokenBuffer(FastLexer(StringReader(source))), repeat)
+    parseSequential = medianTime(lambda: tryParseWholeFileScope(FastLexer(StringReader(source))), repeat)
+    print "sequential:      lex {0:.3f}s, parse {1:.3f}s".format(lexSequential, parseSequential)
+    for jobs in jobCounts:
+        lexParallel = medianTime(lambda: parallelLex(source, jobs), repeat)
+        parseParallel = medianTime(lambda: parallelParse(source, jobs), repeat)
+        print "{0:2} jobs:         lex {1:.3f}s ({2:.2f}x), parse {3:.3f}s ({4:.2f}x)".format(
+            jobs, lexParallel, lexSequential / lexParallel, parseParallel, parseSequential / parseParallel)
+
+def benchmarkRules(ruleCounts, names):
+    # checking names against many rules, with the trie and one rule at a time
+    generator = random.Random(0)
+    parts = ["part{0}".format(i) for i in range(20)]
+    randomName = lambda: [generator.choice(parts) for i in range(generator.randint(1, 5))]
+    checked = [randomName() for i in range(names)]
+    for count in ruleCounts:
+        rules = [(rank, (randomName(), generator.random() < 0.5), generator.random() < 0.5) for rank in range(count)]
+        start = time.time()
+        trie = RuleTrie(rules)
+        compileElapsed = time.time() - start
+        start = time.time()
+        for name in checked:
+            trie.allows(name)
+        trieElapsed = time.time() - start
+        start = time.time()
+        for name in checked:
+            allowsLinear(rules, name)
+        linearElapsed = time.time() - start
+        print "{0:5} rules: compiled in {1:.4f}s, {2} names checked by trie {3:.3f}s, one rule at a time {4:.3f}s ({5:.1f}x)".format(
+            count, compileElapsed, names, trieElapsed, linearElapsed, linearElapsed / trieElapsed)
+
+def benchmarkModules(count, jobCounts):
+    # a project of modules each using a few others, loaded cold and again unchanged
+    projectDir = tempfile.mkdtemp()
+    try:
+        generator = random.Random(0)
+        os.makedirs(os.path.join(projectDir, "Project"))
+        for i in range(count):
+            uses = " + ".join("Project.Module{0}.shared".format(generator.randrange(count)) for j in range(3))
+            with open(os.path.join(projectDir, "Project", "Module{0}.minx".format(i)), 'w') as moduleFile:
+                moduleFile.write("shared = {0}\n{1}".format(uses, generateProgram(ProgramShape(20), i)))
+        with open(os.path.join(projectDir, "main.minx"), 'w') as mainFile:
+            mainFile.write("main = Project.Module0.shared\n")
+        entry = os.path.join(projectDir, "main.minx")
+        for jobs in jobCounts:
+            loader = ModuleLoader(jobs)
+            start = time.time()
+            loaded = len(loader.load(entry).modules)
+            cold = time.time() - start
+            start = time.time()
+            loader.load(entry)
+            warm = time.time() - start
+            print "{0} modules with {1} jobs: cold load {2:.3f}s, unchanged {3:.3f}s ({4:.1f}x)".format(loaded, jobs, cold, warm, cold / warm)
+    finally:
+        shutil.rmtree(projectDir)
+
+# count wide scope types, each with a twin of the same structure that refers
+# to the other twins, and a value of each type checked against its twin
+def wideTypesProgram(count, width, seed):
+    generator = random.Random(seed)
+    lines = []
+    for i in range(count):
+        members = []
+        for j in range(width):
+            choice = generator.random()
+            if choice < 0.1 and i > 0:
+                members.append((j, generator.randrange(i)))
+            else:
+                members.append((j, "Int" if choice < 0.55 else "String"))
+        for (prefix, twin) in [("type", "type"), ("twin", "twin")]:
+            lines.append("{0}{1} = {{{2}}}".format(prefix, i, ", ".join("m{0} {1}".format(j, memberType if memberType.__class__ is str else twin + str(memberType)) for (j, memberType) in members)))
+        values = {"Int": "1", "String": '"s"'}
+        lines.append("value{0} type{0} = {{{1}}}".format(i, ", ".join("m{0} = {1}".format(j, values.get(memberType, "value{0}".format(memberType))) for (j, memberType) in members)))
+        lines.append("checked{0} twin{0} = value{0}".format(i))
+    return "\n".join(lines) + "\n"
+
+def benchmarkTypes(counts, width, seed):
+    for count in counts:
+        source = wideTypesProgram(count, width, seed)
+        expression = resolveNames(tryParseWholeFileScope(FastLexer(StringReader(source))))
+        checker = TypeChecker()
+        start = time.time()
+        checker.check(expression, None)
+        elapsed = time.time() - start
+        print "{0:5} types of {1} members ({2} bytes): checked in {3:.3f}s ({4:.2f}ms per type), {5} types interned, {6} comparisons, {7} errors".format(
+            2 * count, width, len(source), elapsed, elapsed * 1e3 / (2 * count), len(checker.types), checker.comparisons, len(checker.errors))
+
+# a case of arms symbols, or of arms scopes told apart by their kind, and a
+# subject for each arm
+def caseDispatch(arms, scopes):
+    branches = ["{{kind = `k{0}, value}}".format(i) if scopes else "`k{0}".format(i) for i in range(arms)]
+    source = "c = case `k0\n" + "".join("    | {0} : {1}\n".format(branch, i) for (i, branch) in enumerate(branches))
+    patterns = [(pattern, patternType) for (pattern, patternType, body) in resolveNames(tryParseWholeFileScope(FastLexer(StringReader(source))))[1][0][2][2]]
+    shape = Shape(["kind", "value"], ["kind", "value"], [None, None])
+    subjects = [Scope(shape, [symbol("`k{0}".format(i)), i], None, None) if scopes else symbol("`k{0}".format(i)) for i in range(arms)]
+    return (patterns, subjects)
+
+def benchmarkCases(armCounts, repeat):
+    for scopes in [False, True]:
+        for arms in armCounts:
+            (patterns, subjects) = caseDispatch(arms, scopes)
+            timings = []
+            for compile in [compileSequentialMatcher, compileMatcher]:
+                match = compile(patterns)
+                def run():
+                    for subject in subjects:
+                        match(subject, None, None)
+                run()
+                timings.append(medianTime(run, repeat))
+            print "{0:5} {1} arms: {2:.2f}us per match testing in turn, {3:.2f}us as a decision tree ({4:.1f}x)".format(
+                arms, "scope" if scopes else "symbol", timings[0] * 1e6 / arms, timings[1] * 1e6 / arms, timings[0] / timings[1])
+
+def Main():
+    oParser = optparse.OptionParser(usage='usage: %prog [options]\n')
+    oParser.add_option('-s', '--sizes', default="1000,10000,100000", help='comma separated infix chain sizes to benchmark')
+    oParser.add_option('-c', '--copies', default=500, type='int', help='copies of the test programs to parse for the memory, lowering and incremental benchmarks')
+    oParser.add_option('-b', '--benchmarks', default="infix,memory,lowering,incremental,stages,streaming,evaluator,tailcalls,lists,server,parallel,rules,modules,types,cases", help='comma separated benchmarks to run (infix, memory, lowering, incremental, stages, streaming, evaluator, tailcalls, lists, server, parallel, rules, modules, types, cases)')
+    oParser.add_option('--scale', default=1, type='int', help='size of the generated programs for the stages, streaming and parallel benchmarks')
+    oParser.add_option('--seed', default=0, type='int', help='random seed for the generated programs')
+    oParser.add_option('-r', '--repeat', default=3, type='int', help='runs of each stage, keeping the fastest')
+    oParser.add_option('--save-baseline', help='write the stage timings to this file')
+    oParser.add_option('--baseline', help='compare the stage timings with this file, failing if any stage regressed')
+    oParser.add_option('-e', '--list-lengths', default="100,200,400", help='comma separated list lengths for the evaluator benchmark')
+    oParser.add_option('-t', '--traversal-lengths', default="100,100000,1000000", help='comma separated list lengths for the tail call benchmark')
+    oParser.add_option('--literal-lengths', default="1000,10000,100000", help='comma separated list literal lengths for the packed list benchmark')
+    oParser.add_option('--cons-length', default=2000, type='int', help='longest list literal to compile as {hd, tl} scopes in the packed list benchmark (at most 2000)')
+    oParser.add_option('--clients', default=4, type='int', help='clients connected at once in the server benchmark')
+    oParser.add_option('-j', '--jobs', default="1,2,4", help='comma separated process counts for the parallel and modules benchmarks')
+    oParser.add_option('--rule-counts', default="10,100,1000", help='comma separated numbers of import rules for the rules benchmark')
+    oParser.add_option('--modules', default=200, type='int', help='modules in the generated project for the modules benchmark')
+    oParser.add_option('--type-counts', default="100,200,400,800", help='comma separated numbers of scope types for the types benchmark')
+    oParser.add_option('--type-width', default=50, type='int', help='members of each scope type in the types benchmark')
+    oParser.add_option('--case-arms', default="100,300,1000", help='comma separated numbers of arms of the cases in the cases benchmark')
+    oParser.add_option('--tolerance', default=10.0, type='float', help='percentage a stage may slow down by before it counts as a regression')
+    (options, args) = oParser.parse_args()
+
+    benchmarks = options.benchmarks.split(",")
+    if "infix" in benchmarks:
+        benchmarkInfixChains([int(size) for size in options.sizes.split(",")])
+    if "memory" in benchmarks:
+        benchmarkMemory(options.copies)
+    if "lowering" in benchmarks:
+        benchmarkLowering(options.copies)
+    if "incremental" in benchmarks:
+        benchmarkIncremental(options.copies)
+    if "streaming" in benchmarks:
+        benchmarkStreaming(options.scale, options.seed)
+    if "evaluator" in benchmarks:
+        benchmarkEvaluator([int(length) for length in options.list_lengths.split(",")], options.repeat)
+    if "tailcalls" in benchmarks:
+        benchmarkTailCalls([int(length) for length in options.traversal_lengths.split(",")])
+    if "lists" in benchmarks:
+        benchmarkPackedLists([int(length) for length in options.literal_lengths.split(",")], options.cons_length)
+    if "server" in benchmarks:
+        benchmarkServer(options.repeat, options.clients)
+    if "parallel" in benchmarks:
+        benchmarkParallel(options.scale, options.seed, options.repeat, [int(jobs) for jobs in options.jobs.split(",")])
+    if "rules" in benchmarks:
+        benchmarkRules([int(count) for count in options.rule_counts.split(",")], 20000)
+    if "modules" in benchmarks:
+        benchmarkModules(options.modules, [int(jobs) for jobs in options.jobs.split(",")])
+    if "types" in benchmarks:
+        benchmarkTypes([int(count) for count in options.type_counts.split(",")], options.type_width, options.seed)
+    if "cases" in benchmarks:
+        benchmarkCases([int(arms) for arms in options.case_arms.split(",")], options.repeat)
+    if "stages" in benchmarks:
+        timings = benchmarkStages(options.scale, options.seed, options.repeat)
+        if options.save_baseline != None:
+            with open(options.save_baseline, 'w') as baselineFile:
+                json.dump(timings, baselineFile, indent = 1, sort_keys = True)
+        if options.baseline != None:
+            with open(options.baseline) as baselineFile:
+                regressions = findRegressions(timings, json.load(baselineFile), options.tolerance)
+            for (key, before, after) in regressions:
+                print "REGRESSION {0}: {1:.3f}s -> {2:.3f}s ({3:+.0%})".format(key, before, after, after / before - 1)
+            if len(regressions) != 0:
+                sys.exit(1)
+            print "no stage regressed by more than {0}%".format(options.tolerance)
+
+if __name__ == '__main__':
+    Main()
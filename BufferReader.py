@@ -0,0 +1,236 @@
+import re
+import os
+import mmap
+from bisect import bisect_right
+
+# compiled "[chars]*" patterns for getFromString, keyed by the allowed characters
+runPatterns = {}
+
+def runPattern(chars):
+    pattern = runPatterns.get(chars)
+    if pattern == None:
+        pattern = re.compile("[" + re.escape(chars) + "]*")
+        runPatterns[chars] = pattern
+    return pattern
+
+lineBreakPattern = re.compile("\r\n|\r|\n")
+
+# a character source over an in-memory string - same interface as FileReader,
+# but scanning by index instead of reading and ungetting one char at a time.
+# Reading can be limited to buffer[start:end], keeping offsets into the whole
+# buffer.
+class StringReader:
+    def __init__(self, buffer, file = "<string>", start = 0, end = None):
+        self.file = file
+        self.buffer = buffer
+        self.length = len(buffer) if end == None else end
+        self.index = start
+        self.position = start - 1
+        self.lineBreaks = None
+
+    def get(self):
+        if self.index >= self.length:
+            return None
+        char = self.buffer[self.index]
+        self.index += 1
+        self.position = self.index - 1
+        return char
+
+    def getIf(self, test):
+        if self.index < self.length:
+            char = self.buffer[self.index]
+            if test(char):
+                self.index += 1
+                self.position = self.index - 1
+                return char
+
+    def isNextChar(self, testChar):
+        if self.index < self.length and self.buffer[self.index] == testChar:
+            self.index += 1
+            self.position = self.index - 1
+            return True
+        return False
+
+    def isAtEnd(self):
+        return self.index >= self.length
+
+    def getWhile(self, test):
+        start = self.index
+        end = start
+        while end < self.length and test(self.buffer[end]):
+            end += 1
+        return self.skipTo(start, end)
+
+    def getFromString(self, string):
+        start = self.index
+        if start >= self.length:
+            return ''
+        end = runPattern(string).match(self.buffer, start, self.length).end()
+        return self.skipTo(start, end)
+
+    def skipTo(self, start, end):
+        if end == start:
+            return ''
+        self.index = end
+        self.position = end - 1
+        return self.buffer[start:end]
+
+    def unget(self, char):
+        if char != None:
+            self.index -= 1
+            self.position = self.index - 1
+
+    def lineAndColNo(self):
+        return self.lineAndColNoAt(self.position)
+
+    def lineAndColNoAt(self, offset):
+        # the line break offsets are only indexed the first time a position is needed
+        if self.lineBreaks == None:
+            self.lineBreaks = [-1] + [match.end() - 1 for match in lineBreakPattern.finditer(self.buffer)]
+
+        lineNo = bisect_right(self.lineBreaks, offset) - 1
+        prevLineBreak = self.lineBreaks[lineNo]
+
+        # a "\r\n" pair counts as a single line break, positioned on the "\n"
+        # once we have read past the "\r"
+        if prevLineBreak != offset and 0 <= offset < self.length and self.buffer[offset] == '\r':
+            lineNo += 1
+            prevLineBreak = offset
+        return (lineNo + 1, offset - prevLineBreak)
+
+# reads the whole file up front (or maps it into memory) rather than one byte
+# per get()
+class BufferReader(StringReader):
+    def __init__(self, file, useMmap = False):
+        infile = open(file, 'rb')
+        try:
+            if useMmap and os.fstat(infile.fileno()).st_size > 0:
+                buffer = mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+            else:
+                buffer = infile.read()
+        finally:
+            infile.close()
+        StringReader.__init__(self, buffer, file)
+
+# reads the file a chunk at a time, only keeping the text from the last char
+# read onwards (all that can be ungot), so memory does not grow with the file.
+# Offsets are still into the whole file, but line numbers can only be worked
+# out from the start of the line the last char read is on.
+class StreamReader(StringReader):
+    def __init__(self, file, chunkSize = 65536):
+        StringReader.__init__(self, "", file)
+        self.infile = open(file, 'rb')
+        self.chunkSize = chunkSize
+        self.atEof = False
+        # file offset of buffer[0], and the line breaks already discarded
+        self.base = 0
+        self.linesBefore = 0
+        self.lastBreakBefore = -1
+
+    # reads on until count more chars are buffered, or the file ends
+    def fill(self, count):
+        while self.length - self.index < count and self.atEof == False:
+            keep = max(self.index - 1, 0)
+            # never split a "\r\n" pair between discarded and kept text
+            if keep > 0 and self.buffer[keep - 1] == '\r':
+                keep -= 1
+            self.discard(keep)
+
+            chunk = self.infile.read(self.chunkSize)
+            if not chunk:
+                self.atEof = True
+                self.infile.close()
+            self.buffer += chunk
+            self.length = len(self.buffer)
+
+    def discard(self, count):
+        if count == 0:
+            return
+        for match in lineBreakPattern.finditer(self.buffer, 0, count):
+            self.linesBefore += 1
+            self.lastBreakBefore = self.base + match.end() - 1
+        self.buffer = self.buffer[count:]
+        self.length = len(self.buffer)
+        self.base += count
+        self.index -= count
+
+    def get(self):
+        self.fill(1)
+        if self.index >= self.length:
+            return None
+        char = self.buffer[self.index]
+        self.index += 1
+        self.position = self.base + self.index - 1
+        return char
+
+    def getIf(self, test):
+        self.fill(1)
+        if self.index < self.length:
+            char = self.buffer[self.index]
+            if test(char):
+                self.index += 1
+                self.position = self.base + self.index - 1
+                return char
+
+    def isNextChar(self, testChar):
+        self.fill(1)
+        if self.index < self.length and self.buffer[self.index] == testChar:
+            self.index += 1
+            self.position = self.base + self.index - 1
+            return True
+        return False
+
+    def isAtEnd(self):
+        self.fill(1)
+        return self.index >= self.length
+
+    # runEnd(start) gives the end of the run in the buffer from start
+    def getRun(self, runEnd):
+        run = []
+        self.fill(1)
+        while True:
+            end = runEnd(self.index)
+            run.append(self.skipTo(self.index, end))
+            # a run up to the end of the buffer may carry on in the next chunk
+            if end < self.length or self.atEof:
+                return ''.join(run)
+            self.fill(1)
+
+    def getWhile(self, test):
+        def runEnd(start):
+            end = start
+            while end < self.length and test(self.buffer[end]):
+                end += 1
+            return end
+        return self.getRun(runEnd)
+
+    def getFromString(self, string):
+        pattern = runPattern(string)
+        return self.getRun(lambda start: pattern.match(self.buffer, start, self.length).end())
+
+    def skipTo(self, start, end):
+        if end == start:
+            return ''
+        self.index = end
+        self.position = self.base + end - 1
+        return self.buffer[start:end]
+
+    def unget(self, char):
+        if char != None:
+            self.index -= 1
+            self.position = self.base + self.index - 1
+
+    def lineAndColNoAt(self, offset):
+        if offset < self.lastBreakBefore:
+            raise Exception("line numbers before offset {0} have been discarded".format(self.lastBreakBefore))
+
+        breaks = [self.base + match.end() - 1 for match in lineBreakPattern.finditer(self.buffer)]
+        lineNo = bisect_right(breaks, offset)
+        prevLineBreak = breaks[lineNo - 1] if lineNo > 0 else self.lastBreakBefore
+        lineNo += self.linesBefore
+
+        index = offset - self.base
+        if prevLineBreak != offset and 0 <= index < self.length and self.buffer[index] == '\r':
+            lineNo += 1
+            prevLineBreak = offset
+        return (lineNo + 1, offset - prevLineBreak)
@@ -0,0 +1,146 @@
+from Parser import *
+from Resolver import resolveNames, patternKeys
+from Evaluator import Symbol, compileNode, patternLiteral, valuesEqual, literalClasses
+from TypeChecker import TypeChecker, UNKNOWN, LITERAL, SCOPE, UNION, REF
+
+# Reports on each case expression in a program what Evaluator.compileMatcher
+# makes of it - how many of its patterns are literals, looked up in a table,
+# and how many scope patterns, grouped by the members they need - along with
+# the branches that can never be taken, because an earlier pattern matches
+# everything they would, and whether the case is exhaustive. A case with an
+# else is; one without is if every alternative of its subject's type (see
+# TypeChecker.py) is matched by some pattern. Where the subject's type is not
+# known, neither is whether the case is exhaustive.
+
+class CaseReport:
+    def __init__(self, span, branches, literals, scopePatterns, scopeShapes, hasElse, unreachable, missing):
+        self.span = span
+        self.branches = branches
+        # distinct literal values, and scope patterns and the distinct sets of
+        # members they need
+        self.literals = literals
+        self.scopePatterns = scopePatterns
+        self.scopeShapes = scopeShapes
+        self.hasElse = hasElse
+        # indices of the branches that are never taken
+        self.unreachable = unreachable
+        # the subject's alternatives no pattern matches, shown, or None if not known
+        self.missing = missing
+
+    def exhaustive(self):
+        return self.hasElse or (self.missing != None and len(self.missing) == 0)
+
+    def describe(self):
+        parts = ["case of {0} branches: {1} literals in a jump table, {2} scope patterns needing {3} sets of members".format(
+            self.branches, self.literals, self.scopePatterns, self.scopeShapes)]
+        if self.hasElse:
+            parts.append("exhaustive (else)")
+        elif self.missing == None:
+            parts.append("exhaustiveness unknown (the subject's type is not known)")
+        elif len(self.missing) == 0:
+            parts.append("exhaustive")
+        else:
+            parts.append("not exhaustive, missing {0}".format(", ".join(self.missing)))
+        if len(self.unreachable) != 0:
+            parts.append("never taken: branch {0}".format(", ".join(str(index + 1) for index in self.unreachable)))
+        return "; ".join(parts)
+
+class CaseReporter(TypeChecker):
+    def __init__(self):
+        TypeChecker.__init__(self)
+        self.reports = []
+
+    # ("literal", value), ("type", type), ("scope", keys, {key: literal}, whether
+    # it compares any member with something other than a literal) or ("value",)
+    def describePattern(self, pattern, patternType, frame):
+        literal = patternLiteral(pattern, patternType)
+        if literal is not None:
+            return ("literal", literal)
+        if pattern[0] == PARSED_SCOPE:
+            literals = {}
+            compared = False
+            for (name, nameType, value) in pattern[1]:
+                if value != None:
+                    code = compileNode(value)
+                    if code.isConstant and code.constant.__class__ in literalClasses:
+                        literals[nameKey(name)] = code.constant
+                    else:
+                        compared = True
+            return ("scope", frozenset(patternKeys(pattern, patternType)), literals, compared)
+        if patternType != None:
+            return ("type", self.asType(patternType, frame))
+        return ("value",)
+
+    def literalValueType(self, value):
+        return self.builtins["string"] if value.__class__ is str else self.literalType(value)
+
+    # whether everything the pattern described by later matches, earlier does
+    def subsumes(self, earlier, later):
+        if earlier[0] == "literal" and later[0] == "literal":
+            return valuesEqual(earlier[1], later[1])
+        if earlier[0] == "type" and earlier[1] != self.unknown:
+            if later[0] == "literal":
+                return self.isSubtype(self.literalValueType(later[1]), earlier[1])
+            if later[0] == "type" and later[1] != self.unknown:
+                return self.isSubtype(later[1], earlier[1])
+        if earlier[0] == "scope" and later[0] == "scope" and not earlier[3]:
+            return earlier[1] <= later[1] and all(key in later[2] and valuesEqual(later[2][key], value) for (key, value) in earlier[2].items())
+        return False
+
+    # the subject's type, as alternatives that are not unions or references
+    def alternatives(self, type, seen):
+        structure = self.types[type]
+        if structure[0] == REF:
+            if type in seen:
+                return []
+            seen.add(type)
+            return self.alternatives(self.unfold(type), seen)
+        if structure[0] == UNION:
+            return [alternative for member in structure[1] for alternative in self.alternatives(member, seen)]
+        return [type]
+
+    def covers(self, description, alternative):
+        structure = self.types[alternative]
+        if description[0] == "literal" and structure[0] == LITERAL:
+            value = description[1]
+            if value.__class__ is Symbol:
+                return structure[1] == "symbol" and value.name.lower() == structure[2]
+            return structure[1] == "int" and value.__class__ in (int, long) and value == structure[2]
+        if description[0] == "type" and description[1] != self.unknown:
+            return self.isSubtype(alternative, description[1])
+        if description[0] == "scope" and structure[0] == SCOPE:
+            return len(description[2]) == 0 and not description[3] and description[1] <= frozenset(self.members[alternative])
+        return False
+
+    def report(self, node, frame):
+        descriptions = []
+        unreachable = []
+        for (index, (pattern, patternType, body)) in enumerate(node[2]):
+            description = self.describePattern(pattern, patternType, frame)
+            if any(self.subsumes(earlier, description) for earlier in descriptions):
+                unreachable.append(index)
+            descriptions.append(description)
+
+        missing = []
+        if node[3] == None:
+            for alternative in self.alternatives(self.typeOf(node[1], frame), set()):
+                if self.types[alternative][0] == UNKNOWN:
+                    missing = None
+                    break
+                if not any(self.covers(description, alternative) for description in descriptions):
+                    missing.append(self.showType(alternative))
+
+        literals = set(description[1] for description in descriptions if description[0] == "literal")
+        scopes = [description[1] for description in descriptions if description[0] == "scope"]
+        return CaseReport(node[-1], len(node[2]), len(literals), len(scopes), len(set(scopes)), node[3] != None, unreachable, missing)
+
+    def check(self, node, frame):
+        if node != None and node[0] == PARSED_CASE:
+            self.reports.append(self.report(node, frame))
+        TypeChecker.check(self, node, frame)
+
+# a CaseReport for each case in the program, in source order
+def caseReports(expression):
+    reporter = CaseReporter()
+    reporter.check(resolveNames(expression), None)
+    return sorted(reporter.reports, key = lambda report: report.span)
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import socket
+import optparse
+
+# A thin client for Server.py: prints the AST of each file given, just as
+# implementation.py would, but parsed by the server on the socket. It imports
+# nothing of the parser, so it starts as fast as Python can.
+
+class ParseClient:
+    def __init__(self, socketPath):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(socketPath)
+        self.replies = self.connection.makefile('rb')
+        self.nextId = 0
+
+    def request(self, request):
+        self.nextId += 1
+        request["id"] = self.nextId
+        self.connection.sendall(json.dumps(request) + "\n")
+        reply = json.loads(self.replies.readline())
+        if reply.get("id") != request["id"]:
+            raise Exception("reply {0} is not to request {1}".format(reply.get("id"), request["id"]))
+        return reply
+
+    def parse(self, path, stackSafe = False):
+        return self.request({"path": os.path.abspath(path), "stackSafe": stackSafe})
+
+    def close(self):
+        self.replies.close()
+        self.connection.close()
+
+def Main():
+    oParser = optparse.OptionParser(usage='usage: %prog [options] minx-source-files...\n')
+    oParser.add_option('-s', '--socket', help='the Unix socket the server listens on')
+    oParser.add_option('--stack-safe', action='store_true', default=False, help='parse without recursion, for sources nested too deeply for the call stack')
+    (options, args) = oParser.parse_args()
+    if options.socket == None or len(args) == 0:
+        oParser.print_help()
+        return 2
+
+    client = ParseClient(options.socket)
+    failures = 0
+    try:
+        for path in args:
+            reply = client.parse(path, options.stack_safe)
+            if "error" in reply:
+                failures += 1
+                print >> sys.stderr, "{0}: {1}".format(path, reply["error"])
+            else:
+                print reply["ast"]
+    finally:
+        client.close()
+    return 1 if failures != 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,919 @@
+import re
+from Parser import *
+from Resolver import resolveNames, scopeLayout, patternKeys, operatorParts, RESOLVED_NAME
+from TailCalls import markTailCalls, TAIL_APPLICATION
+
+# Evaluates parsed programs by compiling every node once into a Python closure,
+# so that running a program never looks at the AST again. Each compiled node is
+# a Code with two closures: value(frame, arguments) gives the node's value, and
+# callee(frame, arguments, argument) gives the result of applying the node to
+# an argument scope.
+#
+# A runtime Scope keeps its members in a list of slots, laid out by a Shape
+# shared by every scope made from the same scope literal. Names declared in an
+# enclosing scope are resolved before compiling (see Resolver.py), to how many
+# scopes out they are and which slot, so looking one up never searches by
+# name. Members are lazy: a slot holds a Thunk until it is first forced.
+#
+# Names that no enclosing scope declares are a function's unmet dependencies.
+# They are looked up by name in the argument scopes of the applications being
+# evaluated (arguments is a linked list of (scope, rest) pairs, innermost
+# first). Applying a scope to an argument makes a new scope with the same
+# members, taking the argument's value for any it has and using the scope's own
+# values as defaults; applying anything else evaluates it with the argument's
+# members available as unmet dependencies. A declaration that cannot be
+# evaluated where it is declared for want of such names gets them from where it
+# is used.
+#
+# An infix operator is applied to {lhs, rhs} made from its operands, rather
+# than through the scope it desugars to. Operators not declared anywhere in
+# scope are the built in ones below, and are evaluated directly. Programs
+# lowered by Lowering.py are compiled the same way, except that their lists
+# are packed into ListViews rather than made of {hd, tl} scopes.
+#
+# Compiled with trampolined set, calls in tail position (see TailCalls.py) do
+# not call the function they apply: they give a TailCall saying what to call,
+# which whatever needs the value - a thunk being forced, or an application or
+# operator not in tail position - then runs, and so on until it gets a value.
+# Recursion through tail calls then runs in constant stack space, however many
+# times it recurses. Anything a callee gives may be a TailCall, but only a
+# TailApplication's value, or a case or declaration's with one in tail
+# position, may be.
+
+class EvaluationError(Exception):
+    pass
+
+class UnboundName(EvaluationError):
+    def __init__(self, name):
+        EvaluationError.__init__(self, "{0} is not declared, and was not passed in".format(name))
+        self.name = name
+
+# values are Python ints and strs, Symbols, Scopes, ListViews, Unions and Builtins
+
+class Symbol(object):
+    __slots__ = ["name"]
+    def __init__(self, name):
+        self.name = name
+
+symbols = {}
+
+def symbol(name):
+    key = name.lower()
+    if key not in symbols:
+        symbols[key] = Symbol(name)
+    return symbols[key]
+
+trueSymbol = symbol("`true")
+falseSymbol = symbol("`false")
+emptyList = symbol(emptyListName[1])
+
+class Shape(object):
+    __slots__ = ["names", "layout", "template", "lazy"]
+    def __init__(self, names, keys, codes):
+        # names as written, for showing. A later declaration of the same name
+        # hides an earlier one, and hidden slots have the key None.
+        self.names = names
+        self.layout = dict((keys[i], i) for i in range(len(keys)) if keys[i] != None)
+        # constants go straight into a new scope's slots, the rest are thunks
+        self.template = [code.constant if code != None and code.isConstant else None for code in codes]
+        self.lazy = [(i, codes[i]) for i in range(len(codes)) if codes[i] != None and codes[i].isConstant == False]
+
+class Scope(object):
+    __slots__ = ["shape", "slots", "parent", "arguments"]
+    def __init__(self, shape, slots, parent, arguments):
+        self.shape = shape
+        self.slots = slots
+        self.parent = parent
+        self.arguments = arguments
+
+listShape = Shape(["hd", "tl"], ["hd", "tl"], [None, None])
+
+# A list made from a lowered list literal, as the items from offset on of one
+# Python list, instead of {hd, tl} scopes ending in `empty_list. It behaves
+# just as those scopes would: it has the members hd and tl, matches {hd, tl}
+# and can be applied or passed as a scope. Its tl is another view of the same
+# items from one further on, made when it is asked for, so getting it takes
+# constant time and copies nothing.
+class ListView(object):
+    __slots__ = ["items", "offset"]
+    def __init__(self, items, offset):
+        self.items = items
+        self.offset = offset
+
+    def head(self):
+        return self.items[self.offset]
+
+    def tail(self):
+        if self.offset + 1 == len(self.items):
+            return emptyList
+        return ListView(self.items, self.offset + 1)
+
+    # the {hd, tl} scope it stands for
+    def asScope(self):
+        return Scope(listShape, [self.items[self.offset], self.tail()], None, None)
+
+    # as the same scope would be, two views of the same place are equal
+    def __eq__(self, other):
+        return other.__class__ is ListView and other.items is self.items and other.offset == self.offset
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self.items), self.offset))
+
+NOT_STARTED = 0
+RUNNING = 1
+DONE = 2
+NEEDS_ARGUMENTS = 3
+
+class TailCall(object):
+    __slots__ = ["callee", "frame", "arguments", "argument"]
+    def __init__(self, callee, frame, arguments, argument):
+        self.callee = callee
+        self.frame = frame
+        self.arguments = arguments
+        self.argument = argument
+
+# runs tail calls until there is a value
+def settle(value):
+    while value.__class__ is TailCall:
+        value = value.callee(value.frame, value.arguments, value.argument)
+    return value
+
+class Thunk(object):
+    __slots__ = ["code", "frame", "arguments", "state", "result"]
+    def __init__(self, code, frame, arguments):
+        self.code = code
+        self.frame = frame
+        self.arguments = arguments
+        self.state = NOT_STARTED
+        self.result = None
+
+    def force(self):
+        if self.state == DONE:
+            return self.result
+        if self.state == RUNNING:
+            raise EvaluationError("value depends on itself")
+        state = self.state
+        self.state = RUNNING
+        try:
+            result = self.code.value(self.frame, self.arguments)
+            while result.__class__ is TailCall:
+                result = result.callee(result.frame, result.arguments, result.argument)
+            if result.__class__ is Thunk:
+                result = result.force()
+        except:
+            self.state = state
+            raise
+        self.state = DONE
+        self.result = result
+        return result
+
+    # whether this can only be evaluated with names passed in from elsewhere
+    def needsArguments(self):
+        if self.state == NOT_STARTED:
+            try:
+                self.force()
+            except UnboundName:
+                self.state = NEEDS_ARGUMENTS
+        return self.state == NEEDS_ARGUMENTS
+
+class Union(object):
+    __slots__ = ["alternatives"]
+    def __init__(self, alternatives):
+        self.alternatives = alternatives
+
+class BuiltinType(object):
+    def __init__(self, name, classes):
+        self.name = name
+        self.classes = classes
+
+class Builtin(object):
+    def __init__(self, name, binary, unary = None):
+        self.name = name
+        self.binary = binary
+        self.unary = unary
+
+    def apply(self, argument):
+        rhs = force(member(argument, "rhs"))
+        lhsSlot = argument.shape.layout.get("lhs")
+        if (lhsSlot == None or argument.slots[lhsSlot] is None) and self.unary != None:
+            return self.unary(rhs)
+        return self.binary(force(member(argument, "lhs")), rhs)
+
+def force(value):
+    return value.force() if value.__class__ is Thunk else value
+
+def member(scope, key):
+    slot = scope.shape.layout.get(key)
+    if slot == None:
+        raise EvaluationError("no member {0} in {1}".format(key, show(scope)))
+    value = scope.slots[slot]
+    if value is None:
+        raise EvaluationError("member {0} has no value".format(scope.shape.names[slot]))
+    return value
+
+def lookupArgument(arguments, key, name):
+    while arguments is not None:
+        (scope, arguments) = arguments
+        slot = scope.shape.layout.get(key)
+        if slot is not None:
+            value = scope.slots[slot]
+            if value is not None:
+                return value
+    raise UnboundName(name)
+
+# what a name declared in an enclosing scope evaluates to, from where it is used
+def fromDeclaration(value, arguments):
+    if arguments is not None and value.__class__ is Thunk and value.arguments is not arguments and value.needsArguments():
+        return Thunk(value.code, value.frame, arguments)
+    return value
+
+def instantiate(prototype, argument):
+    shape = prototype.shape
+    arguments = (argument, prototype.arguments)
+    slots = list(prototype.slots)
+    scope = Scope(shape, slots, prototype.parent, arguments)
+    # the prototype's own members are evaluated again in the new scope, so
+    # that they see the argument's; members it was given are kept as they are
+    for i in xrange(len(slots)):
+        value = slots[i]
+        if value.__class__ is Thunk and value.frame is prototype:
+            slots[i] = Thunk(value.code, scope, arguments)
+    argumentLayout = argument.shape.layout
+    argumentSlots = argument.slots
+    for (key, i) in shape.layout.iteritems():
+        given = argumentLayout.get(key)
+        if given is not None and argumentSlots[given] is not None:
+            slots[i] = argumentSlots[given]
+    return scope
+
+def applyTo(function, argument):
+    cls = function.__class__
+    if cls is Thunk:
+        return function.code.callee(function.frame, function.arguments, argument)
+    if cls is Scope:
+        return instantiate(function, argument)
+    if cls is ListView:
+        return instantiate(function.asScope(), argument)
+    if cls is Builtin:
+        return function.apply(argument)
+    raise EvaluationError("cannot apply {0}".format(show(function)))
+
+def asArgument(value):
+    value = force(value)
+    if value.__class__ is ListView:
+        return value.asScope()
+    if value.__class__ is not Scope:
+        raise EvaluationError("only a scope can be passed to a function, not {0}".format(show(value)))
+    return value
+
+numberClasses = (int, long)
+
+def valuesEqual(first, second):
+    if first.__class__ in numberClasses:
+        return second.__class__ in numberClasses and first == second
+    return first.__class__ is second.__class__ and first == second
+
+def matchesType(value, valueType):
+    valueType = force(valueType)
+    cls = valueType.__class__
+    if cls is BuiltinType:
+        return isinstance(value, valueType.classes)
+    if cls is Union:
+        return any(matchesType(value, alternative) for alternative in valueType.alternatives)
+    if cls is Scope:
+        # structural: any scope with all the type's members
+        if value.__class__ is ListView:
+            value = value.asScope()
+        if value.__class__ is not Scope:
+            return False
+        layout = value.shape.layout
+        return all(key in layout for key in valueType.shape.layout)
+    return valuesEqual(value, valueType)
+
+def numbers(name, function):
+    def checked(lhs, rhs):
+        if lhs.__class__ not in numberClasses or rhs.__class__ not in numberClasses:
+            raise EvaluationError("{0} expects numbers, not {1} and {2}".format(name, show(lhs), show(rhs)))
+        return function(lhs, rhs)
+    return checked
+
+def comparison(name, function):
+    def checked(lhs, rhs):
+        if not ((lhs.__class__ in numberClasses and rhs.__class__ in numberClasses) or (lhs.__class__ is str and rhs.__class__ is str)):
+            raise EvaluationError("{0} expects two numbers or two strings, not {1} and {2}".format(name, show(lhs), show(rhs)))
+        return trueSymbol if function(lhs, rhs) else falseSymbol
+    return checked
+
+def add(lhs, rhs):
+    if lhs.__class__ is str and rhs.__class__ is str:
+        return lhs + rhs
+    return numbers("+", lambda lhs, rhs: lhs + rhs)(lhs, rhs)
+
+def divide(lhs, rhs):
+    if rhs == 0:
+        raise EvaluationError("division by zero")
+    return lhs // rhs
+
+def remainder(lhs, rhs):
+    if rhs == 0:
+        raise EvaluationError("division by zero")
+    return lhs % rhs
+
+def power(lhs, rhs):
+    if rhs < 0:
+        raise EvaluationError("negative powers are not whole numbers")
+    return lhs ** rhs
+
+def negate(rhs):
+    if rhs.__class__ not in numberClasses:
+        raise EvaluationError("- expects a number, not {0}".format(show(rhs)))
+    return -rhs
+
+builtinOperators = dict((builtin.name, builtin) for builtin in [
+    Builtin("+", add),
+    Builtin("-", numbers("-", lambda lhs, rhs: lhs - rhs), negate),
+    Builtin("*", numbers("*", lambda lhs, rhs: lhs * rhs)),
+    Builtin("/", numbers("/", divide)),
+    Builtin("%", numbers("%", remainder)),
+    Builtin("^", numbers("^", power)),
+    Builtin("<", comparison("<", lambda lhs, rhs: lhs < rhs)),
+    Builtin(">", comparison(">", lambda lhs, rhs: lhs > rhs)),
+    Builtin("<=", comparison("<=", lambda lhs, rhs: lhs <= rhs)),
+    Builtin(">=", comparison(">=", lambda lhs, rhs: lhs >= rhs)),
+    Builtin("==", lambda lhs, rhs: trueSymbol if valuesEqual(lhs, rhs) else falseSymbol)])
+
+builtinTypes = dict((builtinType.name, builtinType) for builtinType in [
+    BuiltinType("int", numberClasses),
+    BuiltinType("string", (str,)),
+    BuiltinType("symbol", (Symbol,))])
+
+# the value of a name that is a literal: a number or a `symbol
+def literalValue(name):
+    if name.isdigit():
+        return int(name)
+    if name[0] == "`":
+        return symbol(name)
+    return None
+
+escapePattern = re.compile(r"\\(.)", re.DOTALL)
+
+def unescape(chunk):
+    return escapePattern.sub(r"\1", chunk)
+
+def formatValue(value):
+    cls = value.__class__
+    if cls is str:
+        return value
+    if cls is Symbol:
+        return value.name
+    return show(value)
+
+maxShowDepth = 50
+maxShowItems = 1000
+
+def show(value, depth = 0):
+    value = force(value)
+    cls = value.__class__
+    if cls is str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("{", "\\{") + '"'
+    if cls is Symbol:
+        return value.name
+    if cls is Builtin:
+        return "(" + value.name + ")"
+    if cls is BuiltinType:
+        return value.name
+    if cls is Union:
+        return " | ".join(show(alternative, depth + 1) for alternative in value.alternatives)
+    if cls is not Scope and cls is not ListView:
+        return str(value)
+
+    if depth > maxShowDepth:
+        return "{...}"
+    items = listItems(value)
+    if items != None:
+        return "[" + ", ".join(showMember(item, depth + 1) for item in items) + "]"
+    parts = []
+    layout = value.shape.layout
+    for (i, name) in enumerate(value.shape.names):
+        if layout.get(name.lower() if name != None else None) != i:
+            continue
+        if value.slots[i] is None:
+            parts.append(name)
+        else:
+            parts.append(name + " = " + showMember(value.slots[i], depth + 1))
+    return "{" + ", ".join(parts) + "}"
+
+def showMember(value, depth):
+    try:
+        return show(value, depth)
+    except UnboundName as e:
+        return "<function of {0}>".format(e.name)
+
+# the items of a list made of {hd, tl} scopes (or ListViews) ending in
+# `empty_list, or None if the scope is not one - without recursing, as lists
+# can be long
+def listItems(scope):
+    items = []
+    while scope is not emptyList:
+        if len(items) >= maxShowItems:
+            return items[:maxShowItems] + ["..."]
+        if scope.__class__ is ListView:
+            end = min(len(scope.items), scope.offset + maxShowItems - len(items))
+            items.extend(scope.items[scope.offset:end])
+            scope = emptyList if end == len(scope.items) else ListView(scope.items, end)
+        elif scope.__class__ is Scope and len(scope.shape.layout) == 2 and "hd" in scope.shape.layout and "tl" in scope.shape.layout:
+            (head, tail) = (scope.slots[scope.shape.layout["hd"]], scope.slots[scope.shape.layout["tl"]])
+            if head is None or tail is None:
+                return None
+            items.append(head)
+            scope = force(tail)
+        else:
+            return None
+    return items if len(items) != 0 else None
+
+class Code(object):
+    __slots__ = ["value", "callee", "isConstant", "constant"]
+    def __init__(self, value, callee, isConstant = False, constant = None):
+        self.value = value
+        self.callee = callee
+        self.isConstant = isConstant
+        self.constant = constant
+
+def constantCode(constant):
+    return Code(lambda frame, arguments: constant, lambda frame, arguments, argument: applyTo(constant, argument), True, constant)
+
+def failingCode(message):
+    def fail(*args):
+        raise EvaluationError(message)
+    return Code(fail, fail)
+
+# anything that is not a scope or a reference to one is applied by evaluating
+# it with the argument's members passed in
+def bodyCode(value):
+    return Code(value, lambda frame, arguments, argument: value(frame, (argument, arguments)))
+
+def referenceCode(value):
+    return Code(value, lambda frame, arguments, argument: applyTo(value(frame, arguments), argument))
+
+def compileNode(node):
+    return compilers[node[0]](node)
+
+def compileName(node):
+    name = node[1]
+    literal = literalValue(name)
+    if literal != None:
+        return constantCode(literal)
+
+    key = nameKey(node)
+    (depth, slot) = (node[2], node[3])
+    if depth == None:
+        if key in builtinOperators:
+            return constantCode(builtinOperators[key])
+        if key in builtinTypes:
+            return constantCode(builtinTypes[key])
+        return referenceCode(lambda frame, arguments: lookupArgument(arguments, key, name))
+
+    def slotOf(frame):
+        for i in xrange(depth):
+            frame = frame.parent
+        value = frame.slots[slot]
+        if value is None:
+            raise EvaluationError("{0} has no value".format(name))
+        return value
+    if depth == 0:
+        def slotOf(frame):
+            value = frame.slots[slot]
+            if value is None:
+                raise EvaluationError("{0} has no value".format(name))
+            return value
+    elif depth == 1:
+        def slotOf(frame):
+            value = frame.parent.slots[slot]
+            if value is None:
+                raise EvaluationError("{0} has no value".format(name))
+            return value
+
+    # fromDeclaration(), inline
+    def nameValue(frame, arguments):
+        value = slotOf(frame)
+        if arguments is not None and value.__class__ is Thunk and value.arguments is not arguments and value.needsArguments():
+            return Thunk(value.code, value.frame, arguments)
+        return value
+
+    # applying a declaration applies what it was declared as, not its value here
+    return Code(nameValue, lambda frame, arguments, argument: applyTo(slotOf(frame), argument))
+
+def compileScopeLiteral(node):
+    (names, keys, values) = scopeLayout(node[1])
+    codes = []
+    for (hidden, value) in values:
+        if hidden != None:
+            codes.append(compileMemberOf(hidden, value))
+        else:
+            codes.append(compileNode(value) if value != None else None)
+    shape = Shape(names, keys, codes)
+
+    template = shape.template
+    lazy = shape.lazy
+    def scopeValue(frame, arguments):
+        scope = Scope(shape, list(template), frame, arguments)
+        slots = scope.slots
+        for (i, code) in lazy:
+            slots[i] = Thunk(code, scope, arguments)
+        return scope
+    return Code(scopeValue, lambda frame, arguments, argument: instantiate(scopeValue(frame, arguments), argument))
+
+def compileMemberOf(hidden, key):
+    return bodyCode(lambda frame, arguments: member(asArgument(frame.slots[hidden]), key))
+
+def compileMemberAccess(node):
+    parts = operatorParts(node)
+    if parts != None:
+        return compileOperator(parts)
+
+    target = compileNode(node[1])
+    targetValue = target.value
+    key = nameKey(node[2])
+    name = node[2][1]
+    # the shape last seen here, and the slot of the member in it
+    cache = [None, None]
+    def memberValue(frame, arguments):
+        scope = targetValue(frame, arguments)
+        if scope.__class__ is Thunk:
+            scope = scope.force()
+        if scope.__class__ is ListView:
+            if key == "hd":
+                return scope.items[scope.offset]
+            if key == "tl":
+                return scope.tail()
+            scope = scope.asScope()
+        if scope.__class__ is not Scope:
+            raise EvaluationError("cannot get member {0} of {1}".format(name, show(scope)))
+        if scope.shape is not cache[0]:
+            if key not in scope.shape.layout:
+                raise EvaluationError("no member {0} in {1}".format(name, show(scope)))
+            cache[0] = scope.shape
+            cache[1] = scope.shape.layout[key]
+        value = scope.slots[cache[1]]
+        if value is None:
+            raise EvaluationError("member {0} has no value".format(name))
+        return value
+    return referenceCode(memberValue)
+
+operandNames = ["lhs", "rhs"]
+
+def compileOperator(parts):
+    (operator, left, right) = parts
+    key = nameKey(operator)
+    if left == None and right == None:
+        return compileName(operator)
+    if key in builtinOperators and operator[2] == None:
+        return compileBuiltinOperator(builtinOperators[key], left, right)
+
+    # applied to {lhs, rhs}, with the operands evaluated where the operator is
+    operatorCallee = compileNode(operator).callee
+    shape = Shape(operandNames, operandNames, [compileNode(operand) if operand != None else None for operand in [left, right]])
+    template = shape.template
+    lazy = shape.lazy
+    def operatorValue(frame, arguments):
+        slots = list(template)
+        for (i, code) in lazy:
+            slots[i] = Thunk(code, frame, arguments)
+        return settle(operatorCallee(frame, arguments, Scope(shape, slots, frame, arguments)))
+    return bodyCode(operatorValue)
+
+# infix operators that are built in, rather than declared in the program, are
+# evaluated directly
+def compileBuiltinOperator(builtin, left, right):
+    if right == None or (left == None and builtin.unary == None):
+        return failingCode("{0} is missing an operand".format(builtin.name))
+    rhsValue = compileNode(right).value
+    if left == None:
+        unary = builtin.unary
+        return bodyCode(lambda frame, arguments: unary(force(rhsValue(frame, arguments))))
+    lhsValue = compileNode(left).value
+    binary = builtin.binary
+    def operatorValue(frame, arguments):
+        lhs = lhsValue(frame, arguments)
+        if lhs.__class__ is Thunk:
+            lhs = lhs.force()
+        rhs = rhsValue(frame, arguments)
+        if rhs.__class__ is Thunk:
+            rhs = rhs.force()
+        return binary(lhs, rhs)
+    return bodyCode(operatorValue)
+
+def compileApplication(node):
+    functionCallee = compileNode(node[1]).callee
+    argumentValue = compileNode(node[2]).value
+    def applicationValue(frame, arguments):
+        argument = argumentValue(frame, arguments)
+        if argument.__class__ is not Scope:
+            argument = asArgument(argument)
+        result = functionCallee(frame, arguments, argument)
+        while result.__class__ is TailCall:
+            result = result.callee(result.frame, result.arguments, result.argument)
+        return result
+    return bodyCode(applicationValue)
+
+# a call in tail position is left for whatever needs its value to make
+def compileTailApplication(node):
+    functionCallee = compileNode(node[1]).callee
+    argumentValue = compileNode(node[2]).value
+    def applicationValue(frame, arguments):
+        argument = argumentValue(frame, arguments)
+        if argument.__class__ is not Scope:
+            argument = asArgument(argument)
+        return TailCall(functionCallee, frame, arguments, argument)
+    return bodyCode(applicationValue)
+
+# a lowered list is packed into a ListView, with the items evaluated where
+# the list is
+def compileList(node):
+    itemCodes = [compileNode(item) for item in node[1]]
+    if all(code.isConstant for code in itemCodes):
+        items = [code.constant for code in itemCodes]
+        return referenceCode(lambda frame, arguments: ListView(list(items), 0))
+    def listValue(frame, arguments):
+        return ListView([code.constant if code.isConstant else Thunk(code, frame, arguments) for code in itemCodes], 0)
+    return referenceCode(listValue)
+
+def compileString(node):
+    chunks = [unescape(chunk) for chunk in node[1]]
+    if len(node[2]) == 0:
+        return constantCode(chunks[0])
+    nameValues = [compileNode(name).value for name in node[2]]
+    pieces = zip(nameValues, chunks[1:])
+    first = chunks[0]
+    def stringValue(frame, arguments):
+        parts = [first]
+        for (nameValue, chunk) in pieces:
+            parts.append(formatValue(force(nameValue(frame, arguments))))
+            parts.append(chunk)
+        return "".join(parts)
+    return bodyCode(stringValue)
+
+def compileDollar(node):
+    return Code(lambda frame, arguments: frame, lambda frame, arguments, argument: instantiate(frame, argument))
+
+def compileUnion(node):
+    alternativeValues = [compileNode(alternative).value for alternative in node[1]]
+    return bodyCode(lambda frame, arguments: Union([alternativeValue(frame, arguments) for alternativeValue in alternativeValues]))
+
+def compileMeta(node):
+    return failingCode("meta expressions cannot be evaluated")
+
+def compileCase(node):
+    subjectValue = compileNode(node[1]).value
+    match = compileMatcher([(pattern, patternType) for (pattern, patternType, body) in node[2]])
+    bodies = [compileNode(body).value for (pattern, patternType, body) in node[2]]
+    elseValue = compileNode(node[3]).value if node[3] != None else None
+
+    def caseValue(frame, arguments):
+        subject = subjectValue(frame, arguments)
+        if subject.__class__ is Thunk:
+            subject = subject.force()
+        found = match(subject, frame, arguments)
+        if found is not None:
+            return bodies[found[0]](found[1], arguments)
+        if elseValue is not None:
+            return elseValue(frame, arguments)
+        # nothing matched, so the case is what it started with
+        return subject
+    return bodyCode(caseValue)
+
+literalClasses = (int, long, str, Symbol)
+
+# the value of a pattern that is a literal - a number, `symbol or string - or None
+def patternLiteral(pattern, patternType):
+    if patternType != None or pattern[0] == PARSED_SCOPE:
+        return None
+    code = compileNode(pattern)
+    if code.isConstant and code.constant.__class__ in literalClasses:
+        return code.constant
+    return None
+
+# A case's patterns, compiled into a decision tree: match(subject, frame,
+# arguments) gives (the index of the first pattern the subject matches, the
+# frame to evaluate its body in), or None, just as testing each pattern in
+# turn does (see compileSequentialMatcher).
+#
+# Literal patterns are looked up in a table of the first pattern for each
+# value. Only the other patterns before the one found there - "i int" and
+# names declared elsewhere - are tested; scope patterns cannot match a
+# literal. A scope is only tested against the scope patterns whose members it
+# has, worked out once for each shape of scope matched: its plan. Where
+# patterns in a row first compare the same member with a literal, as in
+#
+#   | {kind = `circle, radius} : ...
+#   | {kind = `square, side} : ...
+#
+# the member is looked at once, and looked up in a table of those patterns by
+# its value.
+def compileMatcher(patterns):
+    literals = {}
+    scopePatterns = []
+    others = []
+    for (index, (pattern, patternType)) in enumerate(patterns):
+        literal = patternLiteral(pattern, patternType)
+        if literal is not None:
+            literals.setdefault(literal, index)
+        elif pattern[0] == PARSED_SCOPE:
+            keys = patternKeys(pattern, patternType)
+            shape = Shape([name[1] for (name, nameType, value) in pattern[1]], keys, [None] * len(keys))
+            expected = [compileNode(value) if value != None else None for (name, nameType, value) in pattern[1]]
+            scopePatterns.append((index, keys, shape, expected))
+        else:
+            others.append((index, compilePattern(pattern, patternType)))
+
+    # shape => [step(subject, slots, frame, arguments) giving what match does, or None]
+    plans = {}
+    def planFor(subjectShape):
+        layout = subjectShape.layout
+        # (index, step, (slot, literal, member) for the member it compares first, or None)
+        entries = [(index, otherStep(index, otherMatch), None) for (index, otherMatch) in others]
+        for (index, keys, shape, expected) in scopePatterns:
+            indexes = [layout.get(key) for key in keys]
+            if None in indexes:
+                continue
+            compared = [i for i in range(len(expected)) if expected[i] != None]
+            switch = None
+            if len(compared) != 0 and expected[compared[0]].isConstant and expected[compared[0]].constant.__class__ in literalClasses:
+                switch = (indexes[compared[0]], expected[compared[0]].constant, (index, indexes, shape, expected, compared[0]))
+            entries.append((index, scopeStep(index, indexes, shape, expected, None), switch))
+        entries.sort(key = lambda entry: entry[0])
+
+        steps = []
+        i = 0
+        while i < len(entries):
+            j = i + 1
+            while entries[i][2] != None and j < len(entries) and entries[j][2] != None and entries[j][2][0] == entries[i][2][0]:
+                j += 1
+            if j - i == 1:
+                steps.append(entries[i][1])
+            else:
+                table = {}
+                for (index, step, (slot, literal, pattern)) in entries[i:j]:
+                    table.setdefault(literal, []).append(scopeStep(*pattern))
+                steps.append(switchStep(entries[i][2][0], table))
+            i = j
+        return steps
+
+    def match(subject, frame, arguments):
+        cls = subject.__class__
+        if cls is Scope:
+            (shape, slots) = (subject.shape, subject.slots)
+        elif cls is ListView:
+            (shape, slots) = (listShape, [subject.items[subject.offset], subject.tail()])
+        else:
+            first = literals.get(subject)
+            for (index, otherMatch) in others:
+                if first is not None and index > first:
+                    break
+                bound = otherMatch(subject, frame, arguments)
+                if bound is not None:
+                    return (index, bound)
+            return (first, frame) if first is not None else None
+
+        steps = plans.get(shape)
+        if steps is None:
+            steps = plans[shape] = planFor(shape)
+        for step in steps:
+            found = step(subject, slots, frame, arguments)
+            if found is not None:
+                return found
+        return None
+    return match
+
+# any other pattern's step in a plan
+def otherStep(index, otherMatch):
+    def step(subject, slots, frame, arguments):
+        bound = otherMatch(subject, frame, arguments)
+        return (index, bound) if bound is not None else None
+    return step
+
+# a scope pattern's step in a plan, given the slots of its members in the
+# shape planned for, not comparing the member skip
+def scopeStep(index, indexes, shape, expected, skip):
+    expectedValues = [(i, expected[i].value) for i in range(len(expected)) if expected[i] != None and i != skip]
+    def step(subject, slots, frame, arguments):
+        bound = [slots[i] for i in indexes]
+        for value in bound:
+            if value is None:
+                return None
+        for (i, expectedValue) in expectedValues:
+            if valuesEqual(force(bound[i]), force(expectedValue(frame, arguments))) == False:
+                return None
+        return (index, Scope(shape, bound, frame, arguments))
+    return step
+
+# scope patterns in a row comparing the member in slot first, looked up by its value
+def switchStep(slot, table):
+    def step(subject, slots, frame, arguments):
+        value = slots[slot]
+        if value is None:
+            return None
+        for scopeMatch in table.get(force(value), ()):
+            found = scopeMatch(subject, slots, frame, arguments)
+            if found is not None:
+                return found
+        return None
+    return step
+
+# what compileMatcher gives, testing each pattern in turn
+def compileSequentialMatcher(patterns):
+    matches = [compilePattern(pattern, patternType) for (pattern, patternType) in patterns]
+    def match(subject, frame, arguments):
+        for (index, patternMatch) in enumerate(matches):
+            bound = patternMatch(subject, frame, arguments)
+            if bound is not None:
+                return (index, bound)
+        return None
+    return match
+
+def compilePattern(pattern, patternType):
+    if pattern[0] == PARSED_SCOPE:
+        # {hd, tl} matches any scope with those members, binding them
+        keys = patternKeys(pattern, patternType)
+        shape = Shape([name[1] for (name, nameType, value) in pattern[1]], keys, [None] * len(keys))
+        expected = [compileNode(value).value if value != None else None for (name, nameType, value) in pattern[1]]
+        # each shape matched here, with the slots of the pattern's members in it
+        slotsByShape = {}
+        def matchScope(subject, frame, arguments):
+            if subject.__class__ is ListView:
+                (subjectShape, slots) = (listShape, [subject.items[subject.offset], subject.tail()])
+            elif subject.__class__ is Scope:
+                (subjectShape, slots) = (subject.shape, subject.slots)
+            else:
+                return None
+            if subjectShape not in slotsByShape:
+                layout = subjectShape.layout
+                slotsByShape[subjectShape] = [layout[key] for key in keys] if all(key in layout for key in keys) else None
+            indexes = slotsByShape[subjectShape]
+            if indexes is None:
+                return None
+            bound = [slots[i] for i in indexes]
+            for i in range(len(bound)):
+                if bound[i] is None:
+                    return None
+                if expected[i] is not None and valuesEqual(force(bound[i]), force(expected[i](frame, arguments))) == False:
+                    return None
+            return Scope(shape, bound, frame, arguments)
+        return matchScope
+
+    if patternType != None:
+        # "i int" matches any value of the type, binding it to i
+        typeValue = compileNode(patternType).value
+        shape = Shape([pattern[1]], patternKeys(pattern, patternType), [None])
+        def matchType(subject, frame, arguments):
+            if matchesType(subject, typeValue(frame, arguments)):
+                return Scope(shape, [subject], frame, arguments)
+            return None
+        return matchType
+
+    # a name on its own matches its value
+    patternValue = compileNode(pattern).value
+    def matchValue(subject, frame, arguments):
+        return frame if valuesEqual(subject, force(patternValue(frame, arguments))) else None
+    return matchValue
+
+compilers = {
+    PARSED_STRING : compileString,
+    PARSED_CASE : compileCase,
+    RESOLVED_NAME : compileName,
+    PARSED_DOLLAR : compileDollar,
+    PARSED_SCOPE : compileScopeLiteral,
+    PARSED_UNION_TYPE : compileUnion,
+    PARSED_APPLICATION : compileApplication,
+    PARSED_MEMBER_ACCESS : compileMemberAccess,
+    PARSED_META : compileMeta,
+    LOWERED_OPERATOR : lambda node: compileOperator(node[1:4]),
+    LOWERED_LIST : compileList,
+    TAIL_APPLICATION : compileTailApplication}
+
+def compileProgram(expression, trampolined = False):
+    expression = resolveNames(expression)
+    if trampolined:
+        expression = markTailCalls(expression)
+    return compileNode(expression)
+
+def evaluateProgram(expression, trampolined = False):
+    return compileProgram(expression, trampolined).value(None, None)
+
+# each top-level member, shown, or the error evaluating it
+def showMembers(scope):
+    shown = []
+    layout = scope.shape.layout
+    for (i, name) in enumerate(scope.shape.names):
+        if name == None or layout.get(name.lower()) != i:
+            continue
+        try:
+            shown.append((name, showMember(scope.slots[i], 0) if scope.slots[i] is not None else None))
+        except EvaluationError as e:
+            shown.append((name, "<error: {0}>".format(e)))
+        except RuntimeError as e:
+            shown.append((name, "<error: {0}>".format(e)))
+    return shown
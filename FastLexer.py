@@ -0,0 +1,211 @@
+import re
+import string
+from Lexer import *
+
+# A drop-in replacement for Lexer that emits exactly the same token stream,
+# but scans the whole source buffer by index: the first character of each token
+# picks its capturer from a precomputed table, and runs of characters are
+# matched with compiled patterns rather than tested one at a time.
+# The char source must be buffer-backed (StringReader or BufferReader).
+
+symbolTokens = {
+    "{" : TOKEN_OPEN_BRACE,
+    "}" : TOKEN_CLOSE_BRACE,
+    "[" : TOKEN_OPEN_BRACKET,
+    "]" : TOKEN_CLOSE_BRACKET,
+    "(" : TOKEN_OPEN_PARENTHESES,
+    ")" : TOKEN_CLOSE_PARENTHESES,
+    "$" : TOKEN_DOLLAR,
+    "," : TOKEN_COMMA,
+    "'" : TOKEN_SINGLEQUOTE,
+    "@" : TOKEN_AT
+}
+
+keywordTokens = {
+    "case" : TOKEN_CASE,
+    "else" : TOKEN_ELSE,
+    "as" : TOKEN_AS}
+
+reservedInfixTokens = {
+    "=" : TOKEN_EQUALS,
+    "|" : TOKEN_PIPE,
+    ":" : TOKEN_COLON}
+
+nameChars = "_?.`" + string.ascii_letters + string.digits
+infixChars = "^*/%+-:><=&|"
+whitespaceChars = ''.join(map(chr, [0,9,12,32]))
+
+CHAR_SYMBOL = 0
+CHAR_NAME = 1
+CHAR_INFIX = 2
+CHAR_QUOTE = 3
+
+charKinds = {"\"" : CHAR_QUOTE}
+for char in symbolTokens:
+    charKinds[char] = CHAR_SYMBOL
+for char in nameChars:
+    charKinds[char] = CHAR_NAME
+for char in infixChars:
+    charKinds[char] = CHAR_INFIX
+
+# characters that can start a comment, a newline or more whitespace
+layoutChars = frozenset("#\r\n" + whitespaceChars)
+
+whitespacePattern = re.compile("[" + re.escape(whitespaceChars) + "]*")
+commentPattern = re.compile("[^\r\n]*")
+newLinesPattern = re.compile("[\r\n]*")
+namePattern = re.compile("[" + re.escape(nameChars) + "]+")
+infixPattern = re.compile("[" + re.escape(infixChars) + "]+")
+stringCharsPattern = re.compile("[^\"\\\\{]*")
+
+class FastLexer(Lexer):
+    def __init__(self, charSource):
+        self.charSource = charSource
+        self.buffer = charSource.buffer
+        self.length = charSource.length
+        self.index = charSource.index
+        self.indentStack = ['']
+        self.ungetted = []
+        self.captureIndent()
+        self.ungetted = [(TOKEN_FILESTART, (0, 0))]
+        self.lastSpan = (0, 0)
+        self.previousSpan = (0, 0)
+        self.memo = None
+
+    def next(self):
+        if len(self.ungetted) != 0:
+            return self.ungetted.pop()
+
+        index = self.index
+        if index >= self.length:
+            return (TOKEN_FILEEND, (index, index))
+
+        if self.buffer[index] in layoutChars:
+            token = self.captureIndent()
+            if token != None:
+                return token
+            index = self.index
+
+        kind = charKinds.get(self.buffer[index])
+        if kind == CHAR_SYMBOL:
+            self.index = index + 1
+            return (symbolTokens[self.buffer[index]], (index, index + 1))
+        elif kind == CHAR_NAME:
+            return self.captureRun(namePattern, keywordTokens, TOKEN_NAME)
+        elif kind == CHAR_INFIX:
+            return self.captureRun(infixPattern, reservedInfixTokens, TOKEN_INFIX)
+        elif kind == CHAR_QUOTE:
+            return self.captureString()
+
+        self.error("unrecognised token")
+
+    def offset(self):
+        return self.index
+
+    def spanFrom(self, start):
+        return (start, self.index)
+
+    def captureIndent(self):
+        buffer = self.buffer
+        start = self.index
+        index = whitespacePattern.match(buffer, start, self.length).end()
+
+        indent = None
+        while True:
+            foundComment = index < self.length and buffer[index] == "#"
+            if foundComment:
+                index = commentPattern.match(buffer, index + 1, self.length).end()
+            afterNewLines = newLinesPattern.match(buffer, index, self.length).end()
+            if afterNewLines == index and foundComment == False:
+                break
+            whitespace = whitespacePattern.match(buffer, afterNewLines, self.length)
+            indent = whitespace.group()
+            index = whitespace.end()
+        self.index = index
+
+        if index >= self.length:
+            # ignore the indent - just unget outstanding unindents and eof.
+            span = (index, index)
+            self.queue((TOKEN_FILEEND, span))
+            self.queueFurtherUnindents('', span)
+            return self.ungetted.pop()
+
+        if indent != None:
+            span = (start, index)
+            lastIndent = self.indentStack[-1]
+            diff = self.compareIndents(lastIndent, indent)
+            if diff > 0:
+                self.indentStack.append(indent)
+                return (TOKEN_INDENT, span)
+            elif diff == 0:
+                return (TOKEN_NEWLINE, span)
+            else:
+                self.indentStack.pop()
+                self.queue((TOKEN_NEWLINE, span))
+                self.queueFurtherUnindents(indent, span)
+                return (TOKEN_UNINDENT, span)
+
+    def captureRun(self, pattern, patterns, tokenType):
+        start = self.index
+        end = pattern.match(self.buffer, start, self.length).end()
+        match = self.buffer[start:end]
+
+        reservedToken = patterns.get(match.lower())
+        if reservedToken != None:
+            self.index = end
+            return (reservedToken, (start, end))
+
+        hasSideEffects = end < self.length and self.buffer[end] == '~'
+        if hasSideEffects:
+            end += 1
+        isMutable = end < self.length and self.buffer[end] == '!'
+        if isMutable:
+            end += 1
+        self.index = end
+        (match, nameId) = internName(match)
+        return (tokenType, match, hasSideEffects, isMutable, nameId, (start, end))
+
+    def captureString(self):
+        buffer = self.buffer
+        start = self.index
+        index = start + 1
+        chunkStart = index
+        chunks = []
+        names = []
+        while True:
+            index = stringCharsPattern.match(buffer, index, self.length).end()
+            if index >= self.length:
+                self.index = index
+                self.error("expected closing quote (\") for string")
+
+            char = buffer[index]
+            if char == "\"":
+                break
+            elif char == "\\":
+                # escaped characters are kept as they are, backslash included
+                index = min(index + 2, self.length)
+            else:
+                chunks.append(buffer[chunkStart:index])
+                self.index = index + 1
+                kind = charKinds.get(buffer[self.index]) if self.index < self.length else None
+                name = None
+                if kind == CHAR_NAME:
+                    name = self.captureRun(namePattern, keywordTokens, TOKEN_NAME)
+                elif kind == CHAR_INFIX:
+                    name = self.captureRun(infixPattern, reservedInfixTokens, TOKEN_INFIX)
+
+                if name == None or (name[0] != TOKEN_NAME and name[0] != TOKEN_INFIX):
+                    self.error("expected name in braces within string. If you just wanted a brace, escape it like this: \"\\{\"")
+                names.append(name)
+                if self.index >= self.length or buffer[self.index] != "}":
+                    self.error("expected end brace after name in braces within string. If you just wanted a brace, escape it like this: \"\\{\"")
+                index = self.index + 1
+                chunkStart = index
+
+        chunks.append(buffer[chunkStart:index])
+        self.index = index + 1
+        return (TOKEN_STRING, chunks, names, (start, self.index))
+
+    def error(self, msg):
+        self.charSource.position = self.index - 1
+        Lexer.error(self, msg)
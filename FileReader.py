@@ -2,6 +2,7 @@ import string
 import optparse
 import logging
 import os
+from bisect import bisect_right
 
 
 class FileReader:
@@ -10,7 +11,9 @@ class FileReader:
         self.infile = open(file, 'rb')
         self.ungetted = []
         self.position = -1
-        self.lineBreaks = [(0, -1, "\r\n")]
+        # offsets of each line break read so far - a "\r\n" pair is recorded at the "\n"
+        self.lineBreaks = [-1]
+        self.lastBreakChar = "\r\n"
 
     def get(self):
         if len(self.ungetted) != 0:
@@ -26,11 +29,12 @@ class FileReader:
 
     def recordLineBreak(self, char):
         if (char == '\r' or char == '\n'):
-            lastBreak = self.lineBreaks[-1]
-            if lastBreak[1] == self.position - 1 and lastBreak[2] == '\r' and char == '\n':
-                self.lineBreaks[-1] = (lastBreak[0], self.position, '\r\n')
+            if self.lineBreaks[-1] == self.position - 1 and self.lastBreakChar == '\r' and char == '\n':
+                self.lineBreaks[-1] = self.position
+                self.lastBreakChar = '\r\n'
             else:
-                self.lineBreaks.append((lastBreak[0] + 1, self.position, char)) 
+                self.lineBreaks.append(self.position)
+                self.lastBreakChar = char
 
     def getIf(self, test):
         char = self.get()
@@ -63,11 +67,10 @@ class FileReader:
         self.position -= 1
         self.ungetted.append(char)
 
-    def previousLineBreak(self):
-        for br in reversed(self.lineBreaks):
-            if br[1] <= self.position:
-                return br
-
     def lineAndColNo(self):
-        prevLineBreak = self.previousLineBreak()
-        return (prevLineBreak[0] + 1, self.position - prevLineBreak[1])
+        return self.lineAndColNoAt(self.position)
+
+    # only valid for offsets that have already been read
+    def lineAndColNoAt(self, offset):
+        lineNo = bisect_right(self.lineBreaks, offset) - 1
+        return (lineNo + 1, offset - self.lineBreaks[lineNo])
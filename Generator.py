@@ -0,0 +1,98 @@
+import random
+import optparse
+
+# Generates valid Minx programs for benchmarking, scaled along each axis
+# separately: every declaration is one of the shapes below, and a shape whose
+# size is 0 is left out. The same seed always gives the same program.
+
+class ProgramShape:
+    def __init__(self, declarations = 100, nesting = 8, infix = 16, listItems = 16, caseBranches = 8, interpolations = 4):
+        self.declarations = declarations
+        self.nesting = nesting
+        self.infix = infix
+        self.listItems = listItems
+        self.caseBranches = caseBranches
+        self.interpolations = interpolations
+
+infixOperators = ["+", "-", "*", "/", "^", "%", "++", "<=", "&", ">"]
+words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+
+def generateName(rng, prefix = ""):
+    return prefix + rng.choice(words) + str(rng.randint(0, 999))
+
+def generateOperand(rng):
+    return str(rng.randint(0, 9999)) if rng.random() < 0.5 else generateName(rng)
+
+def generateNested(rng, depth, indent):
+    # deeply nested implicit scopes, one indentation level each
+    lines = []
+    for level in range(1, depth):
+        lines.append("{0}{1} =".format(indent * level, generateName(rng, "n")))
+    lines.append("{0}leaf = {1}".format(indent * max(depth, 1), generateOperand(rng)))
+    return "\n".join(lines)
+
+def generateInfix(rng, operands):
+    chain = [generateOperand(rng)]
+    for i in range(1, operands):
+        chain.append(rng.choice(infixOperators))
+        chain.append(generateOperand(rng))
+    return " ".join(chain)
+
+def generateList(rng, items):
+    return "[" + ", ".join(generateOperand(rng) for i in range(items)) + "]"
+
+def generateCase(rng, branches, indent):
+    lines = ["case " + generateName(rng)]
+    for i in range(branches):
+        if i % 4 == 3:
+            lines.append("{0}| {{hd, tl}} : hd".format(indent))
+        else:
+            lines.append("{0}| `symbol{1} : {2}".format(indent, i, generateOperand(rng)))
+    lines.append("{0}| else : `unmatched".format(indent))
+    return "\n".join(lines)
+
+def generateString(rng, interpolations):
+    chunks = []
+    for i in range(interpolations):
+        chunks.append("{0} {1} {{{2}}}".format(rng.choice(words), rng.choice(words), generateName(rng)))
+    chunks.append(rng.choice(words) + " \\\"quoted\\\"")
+    return "\"" + " ".join(chunks) + "\""
+
+def generateProgram(shape, seed = 0):
+    rng = random.Random(seed)
+    indent = "    "
+    generators = []
+    if shape.nesting > 0:
+        generators.append(lambda: "\n" + generateNested(rng, shape.nesting, indent))
+    if shape.infix > 0:
+        generators.append(lambda: " " + generateInfix(rng, shape.infix))
+    if shape.listItems > 0:
+        generators.append(lambda: " " + generateList(rng, shape.listItems))
+    if shape.caseBranches > 0:
+        generators.append(lambda: " " + generateCase(rng, shape.caseBranches, indent))
+    if shape.interpolations > 0:
+        generators.append(lambda: " " + generateString(rng, shape.interpolations))
+    if len(generators) == 0:
+        raise Exception("every axis of the program shape is 0")
+
+    declarations = []
+    for i in range(shape.declarations):
+        declarations.append("d{0} ={1}\n".format(i, generators[i % len(generators)]()))
+    return "".join(declarations)
+
+def Main():
+    oParser = optparse.OptionParser(usage='usage: %prog [options]\n')
+    oParser.add_option('-s', '--seed', default=0, type='int', help='random seed')
+    oParser.add_option('-d', '--declarations', default=100, type='int', help='top-level declarations')
+    oParser.add_option('-n', '--nesting', default=8, type='int', help='depth of nested implicit scopes (0 for none)')
+    oParser.add_option('-i', '--infix', default=16, type='int', help='operands in each infix chain (0 for none)')
+    oParser.add_option('-l', '--list-items', default=16, type='int', help='items in each list literal (0 for none)')
+    oParser.add_option('-c', '--case-branches', default=8, type='int', help='branches in each case statement (0 for none)')
+    oParser.add_option('-p', '--interpolations', default=4, type='int', help='names interpolated into each string (0 for none)')
+    (options, args) = oParser.parse_args()
+
+    shape = ProgramShape(options.declarations, options.nesting, options.infix, options.list_items, options.case_branches, options.interpolations)
+    print generateProgram(shape, options.seed),
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,110 @@
+from bisect import bisect_left, bisect_right
+from BufferReader import StringReader
+from FastLexer import FastLexer
+from Parser import *
+
+# Keeps the parse of a source text up to date as it is edited, re-lexing and
+# re-parsing only the top-level declarations an edit touches.
+#
+# Each top-level declaration starts at column 0, where the lexer is always back
+# at the outermost indentation, so the text from one declaration to the next
+# can be parsed on its own. The declarations either side of an edit are
+# reparsed too, as an edit at the edge of a declaration can join it to (or
+# split it from) its neighbour, e.g. by indenting the next line. If an edit
+# leaves a string running on into later declarations, everything after it is
+# reparsed.
+#
+# Declarations that are reused keep the spans they were parsed with: add
+# shifts[i] to get offsets into the current source (or see absoluteExpression).
+class IncrementalParse:
+    def __init__(self, source, file = "<string>"):
+        self.file = file
+        self.parseAll(source)
+
+    def parseAll(self, source):
+        self.source = source
+        self.expression = None
+        self.reparsedRange = (0, len(source))
+        expression = tryParseWholeFileScope(FastLexer(StringReader(source, self.file)))
+        self.declarations = list(expression[1])
+        self.starts = self.segmentStarts(self.declarations, 0)
+        self.shifts = [0] * len(self.declarations)
+        # declarations can only be reparsed separately if they start at column 0
+        self.columnZero = all(source[start - 1] in "\r\n" for start in self.starts[1:])
+        self.expression = ParsedScope(PARSED_SCOPE, self.declarations, (0, len(source)))
+        return self.expression
+
+    def segmentStarts(self, declarations, firstStart):
+        return [firstStart] + [spanOf(declaration[0])[0] for declaration in declarations[1:]]
+
+    # replace source[start:end] with text
+    def edit(self, start, end, text):
+        source = self.source[:start] + text + self.source[end:]
+        if self.expression == None or self.columnZero == False or len(self.declarations) == 0:
+            return self.parseAll(source)
+
+        # the declarations whose text touches the edit, including at either edge
+        first = max(bisect_left(self.starts, start) - 1, 0)
+        last = bisect_right(self.starts, end) - 1
+        delta = len(text) - (end - start)
+        regionStart = self.starts[first]
+        regionEnd = self.starts[last + 1] + delta if last + 1 < len(self.starts) else len(source)
+
+        try:
+            reparsed = self.parseRegion(source, regionStart, regionEnd)
+        except Exception:
+            if regionEnd == len(source):
+                self.source = source
+                self.expression = None
+                raise
+            # the edit may have opened a string that runs into the declarations after it
+            last = len(self.declarations) - 1
+            regionEnd = len(source)
+            try:
+                reparsed = self.parseRegion(source, regionStart, regionEnd)
+            except Exception:
+                self.source = source
+                self.expression = None
+                raise
+
+        # a new list, as the scope last returned holds the old one
+        self.declarations = self.declarations[:first] + reparsed + self.declarations[last + 1:]
+        self.starts[first:last + 1] = self.segmentStarts(reparsed, regionStart) if len(reparsed) != 0 else []
+        self.shifts[first:last + 1] = [0] * len(reparsed)
+        for i in range(first + len(reparsed), len(self.declarations)):
+            self.starts[i] += delta
+            self.shifts[i] += delta
+        if len(self.starts) != 0:
+            self.starts[0] = 0
+
+        self.source = source
+        self.reparsedRange = (regionStart, regionEnd)
+        if any(source[start - 1] not in "\r\n" for start in self.starts[max(first, 1):first + len(reparsed)]):
+            return self.parseAll(source)
+
+        self.expression = ParsedScope(PARSED_SCOPE, self.declarations, (0, len(source)))
+        return self.expression
+
+    def parseRegion(self, source, regionStart, regionEnd):
+        return tryParseWholeFileScope(FastLexer(StringReader(source, self.file, regionStart, regionEnd)))[1]
+
+    # the whole-file scope with every span relative to the current source
+    def absoluteExpression(self):
+        declarations = [shiftSpans(self.declarations[i], self.shifts[i]) for i in range(len(self.declarations))]
+        return ParsedScope(PARSED_SCOPE, declarations, (0, len(self.source)))
+
+def shiftSpans(node, delta):
+    if delta == 0 or node == None:
+        return node
+    if isinstance(node, list):
+        return [shiftSpans(item, delta) for item in node]
+    if isinstance(node, tuple):
+        if hasattr(node, "_fields"):
+            span = spanOf(node)
+            # nodes without a span are synthesised - nothing inside them has one either
+            if span == None:
+                return node
+            items = [shiftSpans(item, delta) for item in node[:-1]]
+            return type(node)(*(items + [(span[0] + delta, span[1] + delta)]))
+        return tuple(shiftSpans(item, delta) for item in node)
+    return node
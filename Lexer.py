@@ -3,6 +3,7 @@ import string
 import optparse
 import logging
 import os
+from SymbolTable import internName
 
 TOKEN_OPEN_BRACE = 0
 TOKEN_CLOSE_BRACE = 1
@@ -33,19 +34,36 @@ TOKEN_NEWLINE = 21
 TOKEN_FILESTART = 22
 TOKEN_FILEEND = 23
 
+# every token ends with its (start, end) source offsets, e.g.
+# (TOKEN_NAME, match, hasSideEffects, isMutable, nameId, span), where match
+# is shared by every name spelt the same and nameId is the name's id in
+# SymbolTable.py
+
 class Lexer():
     def __init__(self, charSource):
         self.charSource = charSource
         self.indentStack = ['']
         self.captureIndent()
-        self.ungetted = [(TOKEN_FILESTART,)]
+        self.ungetted = [(TOKEN_FILESTART, (0, 0))]
+        # spans of the last token got, and the one before it, so that an unget
+        # of the last token can be undone
+        self.lastSpan = (0, 0)
+        self.previousSpan = (0, 0)
+        # packrat memoization needs an indexable token stream - see TokenBuffer
+        self.memo = None
 
     def get(self):
+        token = self.next()
+        self.previousSpan = self.lastSpan
+        self.lastSpan = token[-1]
+        return token
+
+    def next(self):
         if len(self.ungetted) != 0:
             return self.ungetted.pop()
 
         if self.charSource.isAtEnd():
-            return (TOKEN_FILEEND,)
+            return (TOKEN_FILEEND, self.spanFrom(self.offset()))
 
         for capturer in [self.captureIndent, self.captureSymbol, self.captureName, self.captureInfix, self.captureString]:
             token = capturer()
@@ -66,9 +84,23 @@ class Lexer():
         return self.getIfOfType(tokenType) != None
 
     def unget(self, token):
+        self.lastSpan = self.previousSpan
         self.ungetted.append(token)
 
+    def queue(self, token):
+        self.ungetted.append(token)
+
+    def offset(self):
+        return self.charSource.position + 1
+
+    def spanFrom(self, start):
+        return (start, self.charSource.position + 1)
+
+    def lineAndColNoAt(self, offset):
+        return self.charSource.lineAndColNoAt(offset)
+
     def captureIndent(self):
+        start = self.offset()
         self.captureWhitespace()
 
         indent = None
@@ -77,44 +109,47 @@ class Lexer():
 
         if self.charSource.isAtEnd():
             # ignore the indent - just unget outstanding unindents and eof.
-            self.unget((TOKEN_FILEEND,))
-            self.queueFurtherUnindents('')
+            span = self.spanFrom(self.offset())
+            self.queue((TOKEN_FILEEND, span))
+            self.queueFurtherUnindents('', span)
             return self.ungetted.pop()
 
         if indent != None:
+            span = self.spanFrom(start)
             lastIndent = self.indentStack[-1]
             diff = self.compareIndents(lastIndent, indent)
             if diff > 0:
                 self.indentStack.append(indent)
-                return (TOKEN_INDENT,)
+                return (TOKEN_INDENT, span)
             elif diff == 0:
-                return (TOKEN_NEWLINE,)
+                return (TOKEN_NEWLINE, span)
             else:
                 # an unindent is strictly speaking one or more unindents, then 
                 # a newline at the old indentation level
                 self.indentStack.pop()
-                self.unget((TOKEN_NEWLINE,))
-                self.queueFurtherUnindents(indent)
-                return (TOKEN_UNINDENT,)
+                self.queue((TOKEN_NEWLINE, span))
+                self.queueFurtherUnindents(indent, span)
+                return (TOKEN_UNINDENT, span)
 
     def compareIndents(self, lastIndent, newIndent):
-        n1 = len(lastIndent)
-        n2 = len(newIndent)
-        for i in range(min(n1, n2)):
-            if lastIndent[i] != newIndent[i]:
-                self.error("whitespace is inconsistent with previous line - indentation cannot be guessed")
-        return n2 - n1
-
-    def queueFurtherUnindents(self, indent):
-        lastIndent = self.indentStack[-1]
-        diff = self.compareIndents(lastIndent, indent)
+        # the shorter indent must be the start of the longer one
+        if lastIndent.startswith(newIndent) == False and newIndent.startswith(lastIndent) == False:
+            self.error("whitespace is inconsistent with previous line - indentation cannot be guessed")
+        return len(newIndent) - len(lastIndent)
+
+    def queueFurtherUnindents(self, indent, span):
+        # multiple unindents - store on the ungetted queue, one for each
+        # indentation level closed, without recursing once per level
+        unindents = 0
+        diff = self.compareIndents(self.indentStack[-1], indent)
+        while diff < 0:
+            self.indentStack.pop()
+            unindents += 1
+            diff = self.compareIndents(self.indentStack[-1], indent)
         if diff > 0:
             self.error("cannot unindent to new indentation")
-        elif diff < 0:
-            # multiple unindents - store on the ungetted queue
-            self.indentStack.pop()
-            self.queueFurtherUnindents(indent)
-            self.unget((TOKEN_UNINDENT,)) 
+        for i in range(unindents):
+            self.queue((TOKEN_UNINDENT, span))
 
     def skipCommentsAndNewLines(self):
         foundComment = self.charSource.isNextChar("#")
@@ -140,10 +175,11 @@ class Lexer():
             "@" : TOKEN_AT
         }
         
+        start = self.offset()
         char = self.charSource.getIf(lambda c: c in singleSymbols)
         if char != None:
-            logging.debug("found symbol: {0}".format(char))
-            return (singleSymbols[char],)
+            logging.debug("found symbol: %s", char)
+            return (singleSymbols[char], self.spanFrom(start))
 
     def captureName(self):
         namesMap = {
@@ -162,17 +198,20 @@ class Lexer():
         return self.captureChars("^*/%+-:><=&|", infixMap, TOKEN_INFIX)
 
     def captureChars(self, validChars, patterns, tokenType):
+        start = self.offset()
         match = self.charSource.getFromString(validChars)
 
         lowerMatch = match.lower()
         if lowerMatch in patterns:
-            return (patterns[lowerMatch],)
+            return (patterns[lowerMatch], self.spanFrom(start))
         if len(match) > 0:
             hasSideEffects = self.charSource.isNextChar('~')
             isMutable = self.charSource.isNextChar('!')
-            return (tokenType, match, hasSideEffects, isMutable)
+            (match, nameId) = internName(match)
+            return (tokenType, match, hasSideEffects, isMutable, nameId, self.spanFrom(start))
 
     def captureString(self):
+        start = self.offset()
         if self.charSource.isNextChar("\""):
             currentChunk = []
             chunks = []
@@ -197,7 +236,7 @@ class Lexer():
                 lastCharWasBackslash = (lastCharWasBackslash == False) and char == "\\"
                 char = self.charSource.get()
             chunks.append(''.join(currentChunk))
-            return (TOKEN_STRING, chunks, names)
+            return (TOKEN_STRING, chunks, names, self.spanFrom(start))
 
     def error(self, msg):
         lineAndColNo = self.charSource.lineAndColNo()
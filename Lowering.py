@@ -0,0 +1,195 @@
+from Parser import *
+from Resolver import scopeLayout, patternKeys, operatorParts
+from Evaluator import EvaluationError, Symbol, builtinOperators, literalValue
+
+# An optional pass over a parsed program that replaces the scopes infix
+# operators and lists desugar to with compact nodes: x op y becomes a
+# LoweredOperator and [a, b] a LoweredList. Operators whose operands are
+# constants, and that no enclosing scope declares, are evaluated here (folded)
+# into the constant they give. expand() turns the compact nodes back into the
+# desugarings the parser makes, so anything that only understands those can
+# still use a lowered program; without folding, expand(lower(e)) == e.
+#
+# As with operators, a list's items are evaluated where the list is written
+# rather than in the scope it desugars to, so $ in an item is the enclosing
+# scope.
+
+minusName = intern(makeName("-", True, None))
+
+# folded numbers are kept to ones short enough to be worth writing out
+maxFoldedDigits = 40
+maxFoldedPower = 256
+
+# [a, b] desugars to {!0 = a, !1 = b, !result = {hd = !0, tl = {hd = !1, tl = `empty_list}}}@!result,
+# which gives its items, or None if node is not a list
+def listParts(node):
+    if node[2] != resultName or node[1][0] != PARSED_SCOPE:
+        return None
+    declarations = node[1][1]
+    if len(declarations) < 2 or declarations[-1][0] != resultName:
+        return None
+    items = []
+    for i in range(len(declarations) - 1):
+        (name, nameType, item) = declarations[i]
+        if name != syntheticName("!" + str(i)) or nameType != None:
+            return None
+        items.append(item)
+
+    tail = declarations[-1][2]
+    for i in range(len(items)):
+        if tail == None or tail[0] != PARSED_SCOPE or len(tail[1]) != 2:
+            return None
+        (head, (tl, tlType, tail)) = tail[1]
+        if head != (syntheticName("hd"), None, syntheticName("!" + str(i))) or tl != syntheticName("tl") or tlType != None:
+            return None
+    return items if tail == emptyListName else None
+
+class Lowerer:
+    def __init__(self, fold):
+        self.fold = fold
+        # key => how many enclosing scopes declare it
+        self.declared = {}
+
+    def enter(self, keys):
+        for key in keys:
+            if key != None:
+                self.declared[key] = self.declared.get(key, 0) + 1
+
+    def leave(self, keys):
+        for key in keys:
+            if key != None:
+                self.declared[key] -= 1
+
+    def isBuiltin(self, operator):
+        key = nameKey(operator)
+        return key in builtinOperators and self.declared.get(key, 0) == 0
+
+    # the value of a node folding can use, or None
+    def constantOf(self, node):
+        if node == None:
+            return None
+        if node[0] == PARSED_NAME:
+            return literalValue(node[1])
+        if node[0] == LOWERED_OPERATOR and node[2] == None and node[1][1] == "-" and self.isBuiltin(node[1]):
+            value = self.constantOf(node[3])
+            if value.__class__ in (int, long):
+                return -value
+        return None
+
+    def constantNode(self, value, span):
+        if value.__class__ is Symbol:
+            return makeName(value.name, False, span)
+        if value.__class__ not in (int, long) or len(str(abs(value))) > maxFoldedDigits:
+            return None
+        if value < 0:
+            return LoweredOperator(LOWERED_OPERATOR, minusName, None, makeName(str(-value), False, None), span)
+        return makeName(str(value), False, span)
+
+    # op applied to constant operands, as a constant node, or None if it
+    # cannot be folded
+    def folded(self, operator, left, right, span):
+        if not self.isBuiltin(operator) or right == None:
+            return None
+        builtin = builtinOperators[nameKey(operator)]
+        rhs = self.constantOf(right)
+        if rhs == None:
+            return None
+        try:
+            if left == None:
+                if builtin.unary == None:
+                    return None
+                return self.constantNode(builtin.unary(rhs), span)
+            lhs = self.constantOf(left)
+            if lhs == None:
+                return None
+            if builtin.name == "^" and rhs.__class__ in (int, long) and rhs > maxFoldedPower and lhs not in (-1, 0, 1):
+                return None
+            return self.constantNode(builtin.binary(lhs, rhs), span)
+        except EvaluationError:
+            # left for the evaluator to report
+            return None
+
+    def lower(self, node):
+        if node == None:
+            return None
+        kind = node[0]
+        if kind == PARSED_MEMBER_ACCESS:
+            parts = operatorParts(node)
+            if parts != None:
+                (operator, left, right) = parts
+                left = self.lower(left)
+                right = self.lower(right)
+                if self.fold:
+                    constant = self.folded(operator, left, right, node[-1])
+                    if constant != None:
+                        return constant
+                return LoweredOperator(LOWERED_OPERATOR, operator, left, right, node[-1])
+            items = listParts(node)
+            if items != None:
+                return LoweredList(LOWERED_LIST, [self.lower(item) for item in items], node[-1])
+            return ParsedMemberAccess(PARSED_MEMBER_ACCESS, self.lower(node[1]), node[2], node[-1])
+
+        elif kind == PARSED_SCOPE:
+            keys = scopeLayout(node[1])[1]
+            self.enter(keys)
+            declarations = [(declaration, self.lower(declarationType), self.lower(value)) for (declaration, declarationType, value) in node[1]]
+            self.leave(keys)
+            return ParsedScope(PARSED_SCOPE, declarations, node[-1])
+
+        elif kind == PARSED_CASE:
+            branches = []
+            for (pattern, patternType, body) in node[2]:
+                if pattern[0] == PARSED_SCOPE:
+                    pattern = ParsedScope(PARSED_SCOPE, [(name, self.lower(nameType), self.lower(value)) for (name, nameType, value) in pattern[1]], pattern[-1])
+                patternType = self.lower(patternType)
+                keys = patternKeys(pattern, patternType)
+                if keys != None:
+                    self.enter(keys)
+                branches.append((pattern, patternType, self.lower(body)))
+                if keys != None:
+                    self.leave(keys)
+            return ParsedCase(PARSED_CASE, self.lower(node[1]), branches, self.lower(node[3]), node[-1])
+
+        elif kind == PARSED_UNION_TYPE:
+            return ParsedUnionType(PARSED_UNION_TYPE, [self.lower(expression) for expression in node[1]], node[-1])
+
+        elif kind == PARSED_APPLICATION:
+            return ParsedApplication(PARSED_APPLICATION, self.lower(node[1]), self.lower(node[2]), node[-1])
+
+        elif kind == PARSED_META:
+            return ParsedMeta(PARSED_META, self.lower(node[1]), node[-1])
+
+        # names, strings (whose names are only ever names) and $
+        return node
+
+def lower(expression, fold = True):
+    return Lowerer(fold).lower(expression)
+
+# the program as the parser would have made it, with the operators and lists
+# desugared again
+def expand(node):
+    if node == None:
+        return None
+    kind = node[0]
+    if kind == LOWERED_OPERATOR:
+        return desugarOperator(node[1], expand(node[2]), expand(node[3]), node[-1])
+    elif kind == LOWERED_LIST:
+        return desugarList([expand(item) for item in node[1]], node[-1])
+    elif kind == PARSED_MEMBER_ACCESS:
+        return ParsedMemberAccess(PARSED_MEMBER_ACCESS, expand(node[1]), node[2], node[-1])
+    elif kind == PARSED_SCOPE:
+        return ParsedScope(PARSED_SCOPE, [(declaration, expand(declarationType), expand(value)) for (declaration, declarationType, value) in node[1]], node[-1])
+    elif kind == PARSED_CASE:
+        branches = []
+        for (pattern, patternType, body) in node[2]:
+            if pattern[0] == PARSED_SCOPE:
+                pattern = ParsedScope(PARSED_SCOPE, [(name, expand(nameType), expand(value)) for (name, nameType, value) in pattern[1]], pattern[-1])
+            branches.append((pattern, expand(patternType), expand(body)))
+        return ParsedCase(PARSED_CASE, expand(node[1]), branches, expand(node[3]), node[-1])
+    elif kind == PARSED_UNION_TYPE:
+        return ParsedUnionType(PARSED_UNION_TYPE, [expand(expression) for expression in node[1]], node[-1])
+    elif kind == PARSED_APPLICATION:
+        return ParsedApplication(PARSED_APPLICATION, expand(node[1]), expand(node[2]), node[-1])
+    elif kind == PARSED_META:
+        return ParsedMeta(PARSED_META, expand(node[1]), node[-1])
+    return node
@@ -0,0 +1,339 @@
+import os
+from Parser import *
+from Batch import findSources, parseFiles
+import Evaluator
+
+# Loads a program made of many source files. A file's module name is its path
+# from the entry file's directory, or from a library's, with the directories
+# joined by "." and without ".minx", so MyApp/UI/View.minx is MyApp.UI.View.
+# A name such as MyApp.UI.View.render (names may contain ".") refers to the
+# module with the longest matching name, which is loaded in turn; the modules
+# and the references between them make the program's dependency graph.
+#
+# Which names a module may refer to is set by the entry file's import and
+# exclude declarations:
+#
+#   import = [{library = "Standard", rules = [{import = "*"}, {exclude = "System.Uri"}]}]
+#   exclude = [{namespaces = ["*"], rules = [{exclude = "*"}]}, {namespaces = ["MyApp.UI.*"], rules = [{import = "*"}]}]
+#
+# import makes the modules in a library's directory available, limited by its
+# rules. exclude's rules apply to the modules its namespaces match. A pattern
+# "A.B" matches A.B and every name under it, "A.B.*" only the names under it,
+# and "*" every name; where several rules match a name, the last one wins -
+# so rules must be written from less to more specific, and it is an error to
+# follow a pattern with one that matches everything it does and more.
+#
+# The rules are compiled into a trie of name parts, so checking a name takes
+# one step per part, however many rules there are. Modules are parsed a wave
+# at a time - each wave the modules first referred to by the last - with the
+# modules in a wave parsed in separate processes. Parsed modules are kept by
+# the loader, keyed by file size and modification time, so loading again only
+# parses the files that changed since.
+#
+# Like the language, module names and patterns are case insensitive.
+
+class ModuleError(Exception):
+    pass
+
+# (parts, below): "A.B" is (["a", "b"], False), "A.B.*" (["a", "b"], True)
+def parsePattern(pattern):
+    parts = pattern.lower().split(".")
+    below = parts[-1] == "*"
+    if below:
+        parts.pop()
+    if "" in parts or any("*" in part for part in parts):
+        raise ModuleError("unsupported pattern {0}: only a final .* (or * on its own) can be a wildcard".format(pattern))
+    return (parts, below)
+
+# whether everything the pattern second matches, first does too
+def covers(first, second):
+    ((parts, below), (otherParts, otherBelow)) = (first, second)
+    if otherParts[:len(parts)] != parts:
+        return False
+    return not below or len(otherParts) > len(parts) or otherBelow
+
+def patternMatches(pattern, parts):
+    (patternParts, below) = pattern
+    return parts[:len(patternParts)] == patternParts and (not below or len(parts) > len(patternParts))
+
+class NamespaceTrie(object):
+    __slots__ = ["children", "exact", "below"]
+    def __init__(self):
+        self.children = {}
+        # the values of patterns ending here, and of those ending here with .*
+        self.exact = []
+        self.below = []
+
+    def add(self, pattern, value):
+        (parts, below) = pattern
+        node = self
+        for part in parts:
+            child = node.children.get(part)
+            if child == None:
+                child = node.children[part] = NamespaceTrie()
+            node = child
+        (node.below if below else node.exact).append(value)
+
+    # the values of every pattern matching the name's parts
+    def matches(self, parts):
+        found = []
+        node = self
+        for part in parts:
+            found.extend(node.below)
+            node = node.children.get(part)
+            if node == None:
+                return found
+            found.extend(node.exact)
+        return found
+
+    # (values, parts used) of the longest exact pattern the name starts with
+    def longestPrefix(self, parts):
+        (values, used) = ([], 0)
+        node = self
+        for (i, part) in enumerate(parts):
+            node = node.children.get(part)
+            if node == None:
+                break
+            if len(node.exact) != 0:
+                (values, used) = (node.exact, i + 1)
+        return (values, used)
+
+# Ordered rules: (pattern, allowed) with a rank; a name is allowed by the
+# highest ranked rule matching it, or by default if none does.
+class RuleTrie(object):
+    __slots__ = ["trie", "default"]
+    def __init__(self, rankedRules, default = True):
+        self.trie = NamespaceTrie()
+        self.default = default
+        for (rank, pattern, allowed) in rankedRules:
+            self.trie.add(pattern, (rank, allowed))
+
+    def allows(self, parts):
+        matched = self.trie.matches(parts)
+        return max(matched)[1] if len(matched) != 0 else self.default
+
+# the same answer as RuleTrie.allows, testing every rule in turn
+def allowsLinear(rankedRules, parts, default = True):
+    best = None
+    for (rank, pattern, allowed) in rankedRules:
+        if patternMatches(pattern, parts) and (best == None or rank > best[0]):
+            best = (rank, allowed)
+    return best[1] if best != None else default
+
+# every later pattern must be at least as specific as every earlier one
+def checkOrder(patterns, what):
+    for i in range(len(patterns)):
+        for j in range(i):
+            if covers(patterns[i][1], patterns[j][1]) and patterns[i][1] != patterns[j][1]:
+                raise ModuleError("{0} pattern {1} follows the more specific {2}, which it hides".format(what, patterns[i][0], patterns[j][0]))
+
+# the rules of a {import = pattern} or {exclude = pattern} list
+def readRules(value):
+    rules = []
+    for rule in listValues(value, "rules"):
+        keys = rule.shape.layout.keys() if rule.__class__ is Evaluator.Scope else []
+        if len(keys) != 1 or keys[0] not in ("import", "exclude"):
+            raise ModuleError("a rule must be {import = pattern} or {exclude = pattern}")
+        pattern = stringValue(Evaluator.member(rule, keys[0]), "a rule's pattern")
+        rules.append((pattern, parsePattern(pattern), keys[0] == "import"))
+    checkOrder(rules, "rule")
+    return [(parsed, allowed) for (pattern, parsed, allowed) in rules]
+
+def listValues(value, what):
+    values = []
+    value = Evaluator.force(value)
+    while value is not Evaluator.emptyList:
+        if value.__class__ is Evaluator.ListView:
+            value = value.asScope()
+        if value.__class__ is not Evaluator.Scope or "hd" not in value.shape.layout or "tl" not in value.shape.layout:
+            raise ModuleError("{0} must be a list".format(what))
+        values.append(Evaluator.force(Evaluator.member(value, "hd")))
+        value = Evaluator.force(Evaluator.member(value, "tl"))
+    return values
+
+def stringValue(value, what):
+    value = Evaluator.force(value)
+    if value.__class__ is not str:
+        raise ModuleError("{0} must be a string".format(what))
+    return value
+
+def scopeMember(scope, key, what):
+    if scope.__class__ is not Evaluator.Scope or key not in scope.shape.layout:
+        raise ModuleError("{0} needs a {1}".format(what, key))
+    return Evaluator.member(scope, key)
+
+# The rules declared by the entry file: the libraries it imports, as
+# (directory, RuleTrie), and the exclude blocks, as (namespace patterns, rules)
+class ImportRules:
+    def __init__(self, expression, directory):
+        self.libraries = []
+        self.blocks = []
+        # namespace pattern => indices of the blocks it is in
+        self.blockTrie = NamespaceTrie()
+        # the blocks that apply to a module => the RuleTrie they make
+        self.tries = {}
+        declared = set(nameKey(name) for (name, nameType, value) in expression[1] if name[0] == PARSED_NAME)
+        if not declared & set(["import", "exclude"]):
+            return
+        try:
+            program = Evaluator.evaluateProgram(expression)
+            if "import" in declared:
+                for library in listValues(Evaluator.member(program, "import"), "import"):
+                    path = stringValue(scopeMember(library, "library", "an import"), "a library")
+                    rules = readRules(scopeMember(library, "rules", "an import")) if "rules" in library.shape.layout else []
+                    self.libraries.append((os.path.join(directory, path), RuleTrie([(rank, pattern, allowed) for (rank, (pattern, allowed)) in enumerate(rules)])))
+            if "exclude" in declared:
+                namespaces = []
+                for block in listValues(Evaluator.member(program, "exclude"), "exclude"):
+                    patterns = [stringValue(pattern, "a namespace") for pattern in listValues(scopeMember(block, "namespaces", "an exclude"), "namespaces")]
+                    namespaces.extend((pattern, parsePattern(pattern)) for pattern in patterns)
+                    for (pattern, parsed) in namespaces[len(namespaces) - len(patterns):]:
+                        self.blockTrie.add(parsed, len(self.blocks))
+                    self.blocks.append(readRules(scopeMember(block, "rules", "an exclude")))
+                checkOrder(namespaces, "namespace")
+        except Evaluator.EvaluationError as e:
+            raise ModuleError("cannot read the import rules: {0}".format(e))
+
+    # whether the module named by parts may refer to the name target
+    def allows(self, parts, target):
+        blocks = tuple(sorted(set(self.blockTrie.matches(parts))))
+        if len(blocks) == 0:
+            return True
+        trie = self.tries.get(blocks)
+        if trie == None:
+            # a later block outranks an earlier one, and a later rule in a block an earlier one
+            trie = self.tries[blocks] = RuleTrie([((block, rank), pattern, allowed) for block in blocks for (rank, (pattern, allowed)) in enumerate(self.blocks[block])])
+        return trie.allows(target)
+
+class Module:
+    def __init__(self, name, path, expression, library):
+        self.name = name
+        self.path = path
+        self.expression = expression
+        # the library's rules, or None for the program's own modules
+        self.library = library
+        # module name => a name referring to it
+        self.dependencies = {}
+
+class LoadedProgram:
+    def __init__(self, entry, modules):
+        self.entry = entry
+        # lower case module name => Module
+        self.modules = modules
+
+    # the modules, each after the ones it depends on, unless they depend on it too
+    def order(self):
+        ordered = []
+        visited = set()
+        for key in sorted(self.modules):
+            stack = [(key, iter(sorted(self.modules[key].dependencies)))] if key not in visited else []
+            visited.add(key)
+            while len(stack) != 0:
+                (current, dependencies) = stack[-1]
+                for dependency in dependencies:
+                    if dependency not in visited:
+                        visited.add(dependency)
+                        stack.append((dependency, iter(sorted(self.modules[dependency].dependencies))))
+                        break
+                else:
+                    stack.pop()
+                    ordered.append(self.modules[current])
+        return ordered
+
+    def dependents(self, key):
+        return sorted(other for (other, module) in self.modules.items() if key in module.dependencies)
+
+def moduleName(directory, path):
+    return ".".join(os.path.splitext(os.path.relpath(path, directory))[0].split(os.sep))
+
+# the dotted names a parsed module uses
+def dottedNames(expression):
+    names = []
+    stack = [expression]
+    while len(stack) != 0:
+        item = stack.pop()
+        if item.__class__ is ParsedName:
+            if "." in item[1]:
+                names.append(item[1])
+        elif item.__class__ is list or isinstance(item, tuple):
+            stack.extend(item)
+    return names
+
+class ModuleLoader:
+    def __init__(self, jobs = 1):
+        self.jobs = jobs
+        # path => ((size, modification time), (expression, dotted names it uses))
+        self.parsed = {}
+        self.hits = 0
+        self.misses = 0
+
+    # the parses of the files and the dotted names in them, from the cache or
+    # in a pool of jobs processes
+    def parseAll(self, paths):
+        expressions = {}
+        missing = []
+        for path in paths:
+            info = os.stat(path)
+            stamp = (info.st_size, info.st_mtime)
+            cached = self.parsed.get(path)
+            if cached != None and cached[0] == stamp:
+                self.hits += 1
+                expressions[path] = cached[1]
+            else:
+                missing.append((path, stamp))
+        self.misses += len(missing)
+        results = parseFiles([path for (path, stamp) in missing], min(self.jobs, len(missing)), keepAst = True)
+        for ((path, stamp), (parsedPath, error, elapsed, size, expression)) in zip(missing, results):
+            if error != None:
+                raise ModuleError("{0}: {1}".format(path, error))
+            self.parsed[path] = (stamp, (expression, dottedNames(expression)))
+            expressions[path] = self.parsed[path][1]
+        return expressions
+
+    def load(self, entryPath):
+        directory = os.path.dirname(os.path.abspath(entryPath))
+        entryPath = os.path.join(directory, os.path.basename(entryPath))
+        (entryExpression, entryNames) = self.parseAll([entryPath])[entryPath]
+        rules = ImportRules(entryExpression, directory)
+
+        # every module that could be loaded, by name
+        index = NamespaceTrie()
+        roots = [(directory, None)] + rules.libraries
+        for (root, library) in roots:
+            if not os.path.isdir(root):
+                raise ModuleError("library {0} is not a directory".format(root))
+            for path in findSources([root]):
+                name = moduleName(root, path)
+                index.add((name.lower().split("."), False), (name, path, library))
+
+        entry = moduleName(directory, entryPath)
+        modules = {entry.lower(): Module(entry, entryPath, entryExpression, None)}
+        names = {entryPath: entryNames}
+        wave = [modules[entry.lower()]]
+        while len(wave) != 0:
+            found = []
+            for module in wave:
+                key = module.name.lower()
+                parts = key.split(".")
+                for name in names[module.path]:
+                    target = name.lower().split(".")
+                    (values, used) = index.longestPrefix(target)
+                    if len(values) == 0:
+                        continue
+                    if len(values) > 1:
+                        raise ModuleError("{0} could be any of {1}".format(name, ", ".join(sorted(path for (other, path, library) in values))))
+                    (dependency, path, library) = values[0]
+                    if not rules.allows(parts, target) or (library != None and not library.allows(target)):
+                        raise ModuleError("{0}: {1} is excluded from {2} by the import rules".format(module.path, name, module.name))
+                    dependencyKey = dependency.lower()
+                    if dependencyKey == key:
+                        continue
+                    if dependencyKey not in modules:
+                        modules[dependencyKey] = Module(dependency, path, None, library)
+                        found.append(modules[dependencyKey])
+                    module.dependencies.setdefault(dependencyKey, name)
+            parsed = self.parseAll([module.path for module in found])
+            for module in found:
+                (module.expression, names[module.path]) = parsed[module.path]
+            wave = found
+        return LoadedProgram(entry.lower(), modules)
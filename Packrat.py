@@ -0,0 +1,46 @@
+from types import GeneratorType
+import Parser
+
+# Remembers the result of every parser tried at every token index, so that an
+# alternative retried at the same position is answered from the cache. Needs
+# a token source that can rewind by index (a TokenBuffer). Entries are dropped
+# once the parse commits to a top-level declaration, or when the cache fills up.
+class PackratMemo:
+    def __init__(self, maxEntries = 100000):
+        self.maxEntries = maxEntries
+        self.results = {}
+        self.hits = {}
+        self.misses = {}
+
+    # a rule (see Parser.py) giving what parser gives at the current token
+    def parse(self, parser, tokenSource):
+        key = (parser, tokenSource.index)
+        entry = self.results.get(key)
+        if entry != None:
+            self.hits[parser] = self.hits.get(parser, 0) + 1
+            tokenSource.rewind(entry[1])
+            yield entry[0]
+            return
+
+        self.misses[parser] = self.misses.get(parser, 0) + 1
+        parsed = parser(tokenSource)
+        if isinstance(parsed, GeneratorType):
+            parsed = yield parsed
+        if len(self.results) >= self.maxEntries:
+            self.results.clear()
+        self.results[key] = (parsed, tokenSource.index)
+        yield parsed
+
+    def commit(self):
+        self.results.clear()
+
+    def report(self):
+        names = parserNames()
+        lines = ["{0:<24}{1:>10}{2:>10}".format("parser", "hits", "misses")]
+        for parser in sorted(self.misses, key = lambda parser: -self.hits.get(parser, 0)):
+            lines.append("{0:<24}{1:>10}{2:>10}".format(names.get(parser, repr(parser)), self.hits.get(parser, 0), self.misses[parser]))
+        return '\n'.join(lines)
+
+# the scope rules are lambdas, so name everything by its name in Parser
+def parserNames():
+    return dict((function, name) for (name, function) in vars(Parser).items() if name.startswith("parse") or name.startswith("tryParse"))
@@ -0,0 +1,151 @@
+import marshal
+import multiprocessing
+from array import array
+from BufferReader import StringReader
+from FastLexer import FastLexer, nameChars, infixChars
+from TokenBuffer import TokenBuffer
+from Parser import *
+from ParseCache import flatten, unflatten
+
+# Lexes or parses one large file in several processes. A line starting at
+# column 0 puts the lexer back at the outermost indentation, whatever came
+# before it - unless it is inside a multi-line string - so the text from one
+# such line to another can be lexed, and its declarations parsed, on its own.
+#
+# A quick scan picks a line starting a declaration at column 0 near each
+# chunk's share of the file. The chunks are lexed or parsed in a pool of
+# processes, which inherit the source rather than being sent it, and send back
+# their tokens as TokenBuffer columns or their declarations flattened by
+# ParseCache.py. The chunks are stitched in order into exactly the tokens or
+# whole-file scope of lexing or parsing the file in one go. A chunk that fails,
+# which a string running on past its end will, is joined to the next one and
+# done again here, until it succeeds or reaches the end of the file - where the
+# failure is the file's own.
+#
+# Each chunk's lexer starts where the last one's stopped, so every span is
+# already an offset into the whole file.
+
+minChunkBytes = 64 * 1024
+chunksPerJob = 4
+
+# characters a declaration at column 0 can start with
+declarationStartChars = frozenset(nameChars + infixChars + "{") - frozenset("|:=")
+
+# (buffer, file), set before the pool is made so that its processes inherit it
+sharedSource = None
+
+# offsets of up to chunks - 1 column 0 declarations, evenly spread
+def splitOffsets(buffer, chunks, start = 0, end = None):
+    end = len(buffer) if end == None else end
+    offsets = []
+    for i in range(1, chunks):
+        offset = max(start + (end - start) * i / chunks, offsets[-1] + 1 if len(offsets) != 0 else start)
+        while True:
+            offset = buffer.find("\n", offset, end)
+            if offset == -1 or offset + 1 >= end:
+                return offsets
+            offset += 1
+            if buffer[offset] in declarationStartChars:
+                break
+        offsets.append(offset)
+    return offsets
+
+def lexChunk(buffer, file, start, end):
+    return TokenBuffer(FastLexer(StringReader(buffer, file, start, end))).columns()
+
+def parseChunk(buffer, file, start, end):
+    return marshal.dumps(flatten(tryParseWholeFileScope(FastLexer(StringReader(buffer, file, start, end)))[1]), 2)
+
+# (True, result) or (False, error)
+def runChunkHere(piece, buffer, file):
+    (work, start, end) = piece
+    try:
+        return (True, work(buffer, file, start, end))
+    except Exception as e:
+        return (False, e)
+
+# in a pool process
+def runChunk(piece):
+    return runChunkHere(piece, *sharedSource)
+
+# the results of work on each chunk between the boundaries, in order, joining
+# any that fail to the next
+def runChunks(work, buffer, file, boundaries, jobs):
+    global sharedSource
+    pieces = [(work, boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+    if jobs <= 1 or len(pieces) <= 1:
+        results = [runChunkHere(piece, buffer, file) for piece in pieces]
+    else:
+        sharedSource = (buffer, file)
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(runChunk, pieces, chunksize = 1)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            sharedSource = None
+
+    i = 0
+    while i < len(pieces):
+        (ok, result) = results[i]
+        if ok:
+            yield (pieces[i][1], pieces[i][2], result)
+            i += 1
+            continue
+        # join the chunk to the next one and try again, or fail as the whole file would
+        if i + 1 == len(pieces):
+            raise result
+        pieces[i + 1] = (work, pieces[i][1], pieces[i + 1][2])
+        results[i + 1] = runChunkHere(pieces[i + 1], buffer, file)
+        i += 1
+
+def chunkBoundaries(buffer, jobs):
+    chunks = 1 if jobs <= 1 else max(1, min(jobs * chunksPerJob, len(buffer) / minChunkBytes))
+    return [0] + splitOffsets(buffer, chunks) + [len(buffer)]
+
+# the same tokens as FastLexer(StringReader(buffer)), in a TokenBuffer
+def parallelLex(buffer, jobs, file = "<string>", boundaries = None):
+    if boundaries == None:
+        boundaries = chunkBoundaries(buffer, jobs)
+    if len(boundaries) <= 2:
+        return TokenBuffer(FastLexer(StringReader(buffer, file)))
+    stitched = [array('b'), array('b'), array('l'), array('l'), array('b'), array('b'), array('l'), array('l')]
+    for (start, end, columns) in runChunks(lexChunk, buffer, file, boundaries, jobs):
+        (kinds, flags, starts, ends) = columns[:4]
+        first = 0 if start == 0 else 1
+        last = len(kinds)
+        if end != len(buffer):
+            # at the end of the file, the lexer closes any indented blocks and
+            # stops; at a declaration, it closes them and starts a new line,
+            # from the end of the last token - unless there was none before
+            last -= 1
+            tokenEnd = last
+            while kinds[tokenEnd - 1] == TOKEN_UNINDENT:
+                tokenEnd -= 1
+            if kinds[tokenEnd - 1] != TOKEN_FILESTART:
+                lastEnd = ends[tokenEnd - 1]
+                for i in range(tokenEnd, last):
+                    starts[i] = lastEnd
+                    ends[i] = end
+                # in place of the end of file
+                kinds[last] = TOKEN_NEWLINE
+                starts[last] = lastEnd
+                ends[last] = end
+                last += 1
+        for column in range(4):
+            stitched[column].extend(columns[column][first:last])
+        for column in range(4, 8):
+            stitched[column].extend(columns[column])
+    return TokenBuffer(FastLexer(StringReader(buffer, file)), stitched)
+
+# the same whole-file scope as tryParseWholeFileScope(FastLexer(StringReader(buffer)))
+def parallelParse(buffer, jobs, file = "<string>", boundaries = None):
+    if boundaries == None:
+        boundaries = chunkBoundaries(buffer, jobs)
+    if len(boundaries) <= 2:
+        return tryParseWholeFileScope(FastLexer(StringReader(buffer, file)))
+    declarations = []
+    for (start, end, flattened) in runChunks(parseChunk, buffer, file, boundaries, jobs):
+        declarations.extend(unflatten(marshal.loads(flattened)))
+    return ParsedScope(PARSED_SCOPE, declarations, (0, len(buffer)))
@@ -0,0 +1,162 @@
+import os
+import errno
+import hashlib
+import marshal
+import tempfile
+from BufferReader import StringReader
+from FastLexer import FastLexer
+from Parser import *
+from SymbolTable import internName
+
+# A content-addressed cache of parsed files on disk. Entries are keyed by a
+# hash of the source and PARSER_VERSION, stored as a flat marshal-friendly
+# array of nodes, written atomically (so processes can share a cache directory)
+# and evicted least-recently-used first once the directory grows past maxBytes.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+ITEM_LIST = -1
+ITEM_TUPLE = -2
+
+nodeClasses = {
+    PARSED_STRING : ParsedString,
+    PARSED_CASE : ParsedCase,
+    PARSED_NAME : ParsedName,
+    PARSED_DOLLAR : ParsedDollar,
+    PARSED_SCOPE : ParsedScope,
+    PARSED_UNION_TYPE : ParsedUnionType,
+    PARSED_APPLICATION : ParsedApplication,
+    PARSED_MEMBER_ACCESS : ParsedMemberAccess,
+    PARSED_META : ParsedMeta
+}
+
+def isLeaf(item):
+    # spans are stored as they are
+    return not isinstance(item, (list, tuple)) or (type(item) == tuple and len(item) == 2 and type(item[0]) == int)
+
+# Flattens an AST into a list of (kind, children) items in post-order, where a
+# child is either the index of an earlier item (a plain int - nothing else in
+# an AST is, once names' ids are left out) or a leaf value. Each node object
+# is stored once, so shared subtrees stay shared. A name's id only means
+# something in this process, so it is looked up again when the name is
+# rebuilt.
+def flatten(expression):
+    items = []
+    indexes = {}
+    stack = [(expression, False)]
+    while len(stack) != 0:
+        (item, childrenDone) = stack.pop()
+        if id(item) in indexes:
+            continue
+        if hasattr(item, "_fields"):
+            children = item[1:]
+        else:
+            children = item
+        if childrenDone == False:
+            stack.append((item, True))
+            stack.extend((child, False) for child in reversed(children) if isLeaf(child) == False)
+            continue
+
+        encoded = tuple(child if isLeaf(child) else indexes[id(child)] for child in children)
+        if hasattr(item, "_fields") and item[0] == PARSED_NAME:
+            encoded = encoded[:-2] + (None, encoded[-1])
+        if hasattr(item, "_fields"):
+            items.append((item[0], encoded))
+        else:
+            items.append((ITEM_LIST if isinstance(item, list) else ITEM_TUPLE, encoded))
+        indexes[id(item)] = len(items) - 1
+    return items
+
+def unflatten(items):
+    built = []
+    for (kind, children) in items:
+        values = [built[child] if type(child) == int else child for child in children]
+        if kind == ITEM_LIST:
+            item = values
+        elif kind == ITEM_TUPLE:
+            item = tuple(values)
+        else:
+            if kind == PARSED_NAME:
+                (values[0], values[-2]) = internName(values[0])
+            item = nodeClasses[kind](kind, *values)
+            # reconnect synthetic nodes to the ones the parser interned
+            if item.span == None:
+                if kind == PARSED_NAME:
+                    item = intern(item)
+                elif item == operandsScope:
+                    item = operandsScope
+        built.append(item)
+    return built[-1]
+
+def cacheKey(source):
+    key = hashlib.sha1("{0}\0".format(PARSER_VERSION))
+    key.update(source)
+    return key.hexdigest()
+
+def readEntry(entryPath):
+    try:
+        with open(entryPath, 'rb') as entryFile:
+            (version, items) = marshal.load(entryFile)
+        # mark the entry as recently used
+        os.utime(entryPath, None)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        # missing, evicted by another process, or unreadable - parse again
+        return None
+    if version != PARSER_VERSION:
+        return None
+    return unflatten(items)
+
+def writeEntry(cacheDir, entryPath, expression):
+    (handle, tempPath) = tempfile.mkstemp(dir = cacheDir, suffix = ".tmp")
+    try:
+        with os.fdopen(handle, 'wb') as tempFile:
+            marshal.dump((PARSER_VERSION, flatten(expression)), tempFile, 2)
+        # readers only ever see a complete entry
+        os.rename(tempPath, entryPath)
+    except:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+def evict(cacheDir, maxBytes):
+    entries = []
+    totalSize = 0
+    for name in os.listdir(cacheDir):
+        if name[-4:] == ".ast":
+            try:
+                stat = os.stat(os.path.join(cacheDir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            totalSize += stat.st_size
+
+    entries.sort()
+    for (mtime, size, name) in entries:
+        if totalSize <= maxBytes:
+            break
+        try:
+            os.remove(os.path.join(cacheDir, name))
+        except OSError:
+            pass
+        totalSize -= size
+
+# returns the AST of the file at path, from the cache if it has been parsed before
+def parseCached(path, cacheDir, lexerClass = FastLexer, maxBytes = DEFAULT_MAX_BYTES):
+    with open(path, 'rb') as sourceFile:
+        source = sourceFile.read()
+    return parseSourceCached(source, cacheDir, lexerClass, maxBytes, path)
+
+def parseSourceCached(source, cacheDir, lexerClass = FastLexer, maxBytes = DEFAULT_MAX_BYTES, file = "<string>"):
+    try:
+        os.makedirs(cacheDir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    entryPath = os.path.join(cacheDir, cacheKey(source) + ".ast")
+    expression = readEntry(entryPath)
+    if expression == None:
+        expression = tryParseWholeFileScope(lexerClass(StringReader(source, file)))
+        writeEntry(cacheDir, entryPath, expression)
+        evict(cacheDir, maxBytes)
+    return expression
@@ -3,54 +3,154 @@ import string
 import optparse
 import logging
 import os
+from types import GeneratorType
+from collections import namedtuple
 from Lexer import *
-
-PARSED_STRING = 0 # string contains names to match
-PARSED_CASE = 1  # expression, [branchpattern1, branchpattern2, branchexp], elseExp
-PARSED_NAME = 2  # string, hasSideEffects, isMutable, isInfix
-PARSED_DOLLAR = 3
-PARSED_SCOPE = 4  # [name or scope, declarationType, expression]
-PARSED_UNION_TYPE = 5 # [expression]
-PARSED_APPLICATION = 6 # expression1, expression2
-PARSED_MEMBER_ACCESS = 7 # expression, Name
+from SymbolTable import internName, symbolKeys
+
+# every node ends with the (start, end) source offsets it was parsed from, or
+# None for nodes synthesised when desugaring operators and lists
+PARSED_STRING = 0 # string contains names to match, span
+PARSED_CASE = 1  # expression, [branchpattern1, branchpattern2, branchexp], elseExp, span
+PARSED_NAME = 2  # string, hasSideEffects, isMutable, isInfix, nameId (see SymbolTable.py), span
+PARSED_DOLLAR = 3 # span
+PARSED_SCOPE = 4  # [name or scope, declarationType, expression], span
+PARSED_UNION_TYPE = 5 # [expression], span
+PARSED_APPLICATION = 6 # expression1, expression2, span
+PARSED_MEMBER_ACCESS = 7 # expression, Name, span
 
 # TODO
-PARSED_META = 9   # expression
-
-def tryParseOne(tokenSource, parserList):
+PARSED_META = 9   # expression, span
+
+# compact forms of the operator and list desugarings, made by Lowering.py
+# rather than by the parser
+LOWERED_OPERATOR = 11 # operator Name, left expression or None, right expression or None, span
+LOWERED_LIST = 12 # [expression], span
+
+# bump whenever the ASTs produced change, so that cached parses are not reused
+PARSER_VERSION = 2
+
+# Nodes are named tuples, so they can still be read by index, compared with
+# (and repr'd as) plain tuples, and take no more memory than a plain tuple
+def nodeType(typeName, fields):
+    nodeClass = namedtuple(typeName, "kind " + fields)
+    nodeClass.__repr__ = tuple.__repr__
+    return nodeClass
+
+ParsedString = nodeType("ParsedString", "chunks names span")
+ParsedCase = nodeType("ParsedCase", "expression branches elseBranch span")
+ParsedName = nodeType("ParsedName", "name hasSideEffects isMutable isInfix nameId span")
+ParsedDollar = nodeType("ParsedDollar", "span")
+ParsedScope = nodeType("ParsedScope", "declarations span")
+ParsedUnionType = nodeType("ParsedUnionType", "expressions span")
+ParsedApplication = nodeType("ParsedApplication", "function argument span")
+ParsedMemberAccess = nodeType("ParsedMemberAccess", "expression member span")
+ParsedMeta = nodeType("ParsedMeta", "expression span")
+LoweredOperator = nodeType("LoweredOperator", "operator left right span")
+LoweredList = nodeType("LoweredList", "items span")
+
+# hash-consing table for nodes that do not come from the source text (and so
+# have no span): structurally equal synthetic nodes are the same object, so
+# they can be compared with "is"
+internedNodes = {}
+
+def intern(node):
+    return internedNodes.setdefault(node, node)
+
+# a name that was not lexed, such as a folded constant
+def makeName(name, isInfix, span):
+    (name, nameId) = internName(name)
+    return ParsedName(PARSED_NAME, name, False, False, isInfix, nameId, span)
+
+def syntheticName(name):
+    return intern(makeName(name, False, None))
+
+# the case-folded key of a ParsedName or ResolvedName, shared by every
+# spelling of the name - their ids come just before their spans
+def nameKey(node):
+    return symbolKeys[node[-2]]
+
+lhsName = syntheticName("!lhs")
+rhsName = syntheticName("!rhs")
+resultName = syntheticName("!result")
+emptyListName = syntheticName("`empty_list")
+
+# the argument scope for every infix operator, {lhs = !lhs, rhs = !rhs}, is
+# shared between all of them - it must not be modified
+operandsScope = ParsedScope(PARSED_SCOPE, [
+    intern((syntheticName("lhs"), None, lhsName)),
+    intern((syntheticName("rhs"), None, rhsName))], None)
+
+def spanOf(node):
+    return node[-1]
+
+def spanBetween(first, last):
+    return (first[-1][0], last[-1][1])
+
+# line and column numbers are only worked out when asked for
+def lineAndColNo(tokenSource, node):
+    return tokenSource.lineAndColNoAt(spanOf(node)[0])
+
+# Each rule of the grammar is a generator. Rather than calling a sub-rule, it
+# yields the sub-rule's generator and is sent the sub-rule's result back from
+# the yield. The first thing a rule yields that is not a generator is its own
+# result, and a rule that ends without yielding one gives None. run() runs a
+# rule with a Python call for each nested rule, StackParser.run() runs the
+# same rules from a list instead, for sources nested too deeply for the call
+# stack. The rules that never nest (names, strings, $) are plain functions,
+# returning their result.
+def run(parser):
+    # most rules fail at their first token, and next() gives None for a
+    # generator that ends rather than raising StopIteration as send() does
+    request = next(parser, None)
+    while request.__class__ is GeneratorType:
+        try:
+            request = parser.send(run(request))
+        except StopIteration:
+            return None
+    return request
+
+def parseOne(tokenSource, parserList):
     for parser in parserList:
-        parsed = parser(tokenSource)
+        if tokenSource.memo != None:
+            parsed = yield tokenSource.memo.parse(parser, tokenSource)
+        else:
+            parsed = parser(tokenSource)
+            if parsed.__class__ is GeneratorType:
+                parsed = yield parsed
         if parsed != None:
-            return parsed
+            yield parsed
 
-def tryParseMeta(tokenSource):
+def parseMeta(tokenSource):
     if tokenSource.isNextToken(TOKEN_SINGLEQUOTE):
-        expression = tryParseExpression(tokenSource)
+        start = tokenSource.lastSpan[0]
+        expression = yield parseExpression(tokenSource)
         if expression == None:
             tokenSource.error("expected expression between single quotes for meta ")
 
         if tokenSource.isNextToken(TOKEN_SINGLEQUOTE) == False:
             tokenSource.error("expected closing single quote for meta")
 
-        return (PARSED_META, expression)
+        yield ParsedMeta(PARSED_META, expression, (start, tokenSource.lastSpan[1]))
 
-def tryParseGroup(tokenSource):
+def parseGroup(tokenSource):
     if tokenSource.isNextToken(TOKEN_OPEN_PARENTHESES):
-        expression = tryParseUnion(tokenSource)
+        expression = yield parseUnion(tokenSource)
         if expression == None:
             tokenSource.error("expected expression between parentheses \"()\"")
 
         if tokenSource.isNextToken(TOKEN_CLOSE_PARENTHESES) == False:
             tokenSource.error("expected closing parenthesis \")\"")
 
-        return expression
+        yield expression
 
-def tryParseCase(tokenSource):
+def parseCase(tokenSource):
     if tokenSource.isNextToken(TOKEN_CASE):
-        exp = tryParseExpression(tokenSource)
+        start = tokenSource.lastSpan[0]
+        exp = yield parseExpression(tokenSource)
         if exp == None:
             tokenSource.error("expected expression as starting point for case statement")
-        logging.debug("parsed case generator expression: {0}".format(repr(exp)))
+        logging.debug("parsed case generator expression: %r", exp)
 
         branches = []
         elseBranch = None
@@ -60,7 +160,7 @@ def tryParseCase(tokenSource):
             if elseBranch != None:
                 tokenSource.error("An else branch must be the last branch of a case statement.")
             isElse = False
-            branchPattern = tryParseOne(tokenSource, [tryParseExplicitScope, tryParseName])
+            branchPattern = yield parseOne(tokenSource, [parseExplicitScope, tryParseName])
             branchPattern_type = None
             if branchPattern == None:
                 isElse = tokenSource.isNextToken(TOKEN_ELSE)
@@ -70,15 +170,15 @@ def tryParseCase(tokenSource):
             elif branchPattern[0] == PARSED_NAME:
                 branchPattern_type = tryParseName(tokenSource)
 
-            logging.debug("parsed case branch pattern: {0}, type {1}".format(repr(branchPattern), repr(branchPattern_type)))
+            logging.debug("parsed case branch pattern: %r, type %r", branchPattern, branchPattern_type)
 
             if tokenSource.isNextToken(TOKEN_COLON) == False:
                 tokenSource.error("expected \":\" after pattern in case branch.")
 
-            branchExp = tryParseOne(tokenSource, [tryParseImplicitScope, tryParseExpression])
+            branchExp = yield parseOne(tokenSource, [parseImplicitScope, parseExpression])
             if branchExp == None:
                 tokenSource.error("expected expression for this branch of the case statement")
-            logging.debug("parsed case branch expression: {0}".format(repr(branchExp)))
+            logging.debug("parsed case branch expression: %r", branchExp)
 
             if isElse:
                 elseBranch = branchExp
@@ -93,36 +193,39 @@ def tryParseCase(tokenSource):
         if len(branches) == 0:
             tokenSource.error("case statements require at least one non-else branch (expected |)")
 
-        return (PARSED_CASE, exp, branches, elseBranch)
+        lastExp = elseBranch if elseBranch != None else branches[-1][2]
+        yield ParsedCase(PARSED_CASE, exp, branches, elseBranch, (start, spanOf(lastExp)[1]))
 
 
 
 
-def tryParseBaseExpression(tokenSource):
+def parseBaseExpression(tokenSource):
+    # each starts with a different token, so the ones that never nest, and so
+    # need no generator, go first
     mainParsers = [
-      tryParseDollar, 
-      tryParseGroup, 
-      tryParseMeta, 
-      tryParseExplicitScope, 
-      tryParseList, 
-      tryParseCase,
       tryParseName,
-      tryParseString]
+      tryParseString,
+      tryParseDollar, 
+      parseGroup, 
+      parseMeta, 
+      parseExplicitScope, 
+      parseList, 
+      parseCase]
 
-    return tryParseOne(tokenSource, mainParsers)
+    return parseOne(tokenSource, mainParsers)
 
-def tryParseMemberAccess(tokenSource):
-    expression = tryParseBaseExpression(tokenSource)
+def parseMemberAccess(tokenSource):
+    expression = yield parseBaseExpression(tokenSource)
     if expression == None:
-        return None
+        yield None
 
     while tokenSource.isNextToken(TOKEN_AT):
-        member = tryParseOne(tokenSource, [tryParseName])
+        member = yield parseOne(tokenSource, [tryParseName])
         if member == None:
             tokenSource.error("expected member name after member-access character \"@\"")
-        expression = (PARSED_MEMBER_ACCESS, expression, member)
+        expression = ParsedMemberAccess(PARSED_MEMBER_ACCESS, expression, member, spanBetween(expression, member))
 
-    return expression
+    yield expression
 
 class DoublyLinkedList():
     def __init__(self, item, isSentinel = False):
@@ -149,74 +252,65 @@ class DoublyLinkedList():
 
 opsInOrder = "^*/%+-:><=&|"
 
-def greatestPrecedence(currentBestNode, newNode):
-    if currentBestNode == None:
-        return newNode
-    
-    currentInfix = currentBestNode.item[1]
-    newInfix = newNode.item[1]
-
-    n1 = len(currentInfix)
-    n2 = len(newInfix)
-    for i in range(min(n1, n2)):
-        prec1 = opsInOrder.find(currentInfix[i])
-        prec2 = opsInOrder.find(newInfix[i])
-        if prec2 < prec1:
-            return newNode
-        if prec1 < prec2:
-            return currentBestNode
-
-    return newNode if n1 > n2 else currentBestNode 
+# precedence is decided character by character: an earlier character in
+# opsInOrder binds tighter, and a shorter operator binds tighter than a longer
+# one it is a prefix of - so the smallest key has the greatest precedence
+precedenceKeys = {}
+
+def precedenceKey(infix):
+    key = precedenceKeys.get(infix)
+    if key == None:
+        key = tuple(opsInOrder.find(char) for char in infix)
+        precedenceKeys[infix] = key
+    return key
+
+def parseApplication(tokenSource):
+    expressions = []
+    exp = yield parseMemberAccess(tokenSource)
+    while exp != None:
+        expressions.append(exp)
+        exp = yield parseMemberAccess(tokenSource)
 
-# TODO this runs in n^2 at the mo, but premature optimization, right?
-def tryParseApplication(tokenSource):
+    yield collapseApplication(expressions)
 
+# collapses a run of operands, infix operators and functions into a single
+# expression, or None if the run is empty
+def collapseApplication(expressions):
     leftSentinel = DoublyLinkedList(None, True)
     rightSentinel = DoublyLinkedList(None, True)
     rightSentinel.insertToLeft(leftSentinel)
 
-    exp = tryParseMemberAccess(tokenSource)
-    while exp != None:
+    # operator nodes grouped by operator, each group in left-to-right order
+    opNodes = {}
+
+    for exp in expressions:
         expNode = DoublyLinkedList(exp)
         rightSentinel.insertToLeft(expNode)
-        exp = tryParseMemberAccess(tokenSource)
-
-    # first collapse infix operators
-    while True:
-        nextNode = leftSentinel.right
-        highestOpNode = None
-        while nextNode.isSentinel == False:
-            if nextNode.item[0] == PARSED_NAME and nextNode.item[4]:
-                highestOpNode = greatestPrecedence(highestOpNode, nextNode)
-            nextNode = nextNode.right
-
-        if highestOpNode != None:
+        if exp[0] == PARSED_NAME and exp[4]:
+            opNodes.setdefault(exp[1], []).append(expNode)
+
+    # first collapse infix operators, greatest precedence first and
+    # left-to-right within the same operator. Each collapse only removes nodes,
+    # so this visits operators in the same order as repeatedly scanning for the
+    # highest one would, in linear time.
+    for infix in sorted(opNodes, key = precedenceKey):
+        for opNode in opNodes[infix]:
+            # skip operators already taken as an operand by another operator
+            if opNode.left == None:
+                continue
+
             leftOperand = None
             rightOperand = None
-            if highestOpNode.left.isSentinel == False:
-                leftOperand = highestOpNode.left.item
-                highestOpNode.left.remove()
-            if highestOpNode.right.isSentinel == False:
-                rightOperand = highestOpNode.right.item
-                highestOpNode.right.remove()
-            # 1+lhs => {!lhs = 1, !rhs= lhs, !result = (+) {lhs = !lhs, rhs = !rhs} }@!result
-
-            highestOpNode.item = (PARSED_MEMBER_ACCESS, 
-                (PARSED_SCOPE, [
-                    ((PARSED_NAME, "!lhs", False, False, False), None, leftOperand),
-                    ((PARSED_NAME, "!rhs", False, False, False), None, rightOperand),
-                    ((PARSED_NAME, "!result", False, False, False),None,
-                        (PARSED_APPLICATION, 
-                            highestOpNode.item,
-                            (PARSED_SCOPE, [
-                                ((PARSED_NAME, "lhs", False, False, False),None,(PARSED_NAME, "!lhs", False, False, False)),
-                                ((PARSED_NAME, "rhs", False, False, False),None,(PARSED_NAME, "!rhs", False, False, False))])
-                        )
-                     )]
-                ), 
-                (PARSED_NAME, "!result", False, False, False))
-        else:
-            break
+            span = spanOf(opNode.item)
+            if opNode.left.isSentinel == False:
+                leftOperand = opNode.left.item
+                span = (spanOf(leftOperand)[0], span[1])
+                opNode.left.remove()
+            if opNode.right.isSentinel == False:
+                rightOperand = opNode.right.item
+                span = (span[0], spanOf(rightOperand)[1])
+                opNode.right.remove()
+            opNode.item = desugarOperator(opNode.item, leftOperand, rightOperand, span)
 
     # last collapse function applications
     penultimateNode = rightSentinel.left
@@ -226,49 +320,61 @@ def tryParseApplication(tokenSource):
     while penultimateNode.left.isSentinel == False:
         function = penultimateNode.left.item
         penultimateNode.left.remove()
-        penultimateNode.item = (PARSED_APPLICATION, function, penultimateNode.item)
+        penultimateNode.item = ParsedApplication(PARSED_APPLICATION, function, penultimateNode.item, spanBetween(function, penultimateNode.item))
 
     return penultimateNode.item
 
-def tryParseExpression(tokenSource):
-    expression = tryParseApplication(tokenSource)
+# 1+lhs => {!lhs = 1, !rhs= lhs, !result = (+) {lhs = !lhs, rhs = !rhs} }@!result
+def desugarOperator(operator, leftOperand, rightOperand, span):
+    return ParsedMemberAccess(PARSED_MEMBER_ACCESS,
+        ParsedScope(PARSED_SCOPE, [
+            (lhsName, None, leftOperand),
+            (rhsName, None, rightOperand),
+            (resultName, None,
+                ParsedApplication(PARSED_APPLICATION, operator, operandsScope, span)
+             )], span
+        ),
+        resultName, span)
+
+def parseExpression(tokenSource):
+    expression = yield parseApplication(tokenSource)
     if expression == None:
-        return None
+        yield None
 
     # "as" is an inverted function application, "arguments as function"
     while tokenSource.isNextToken(TOKEN_AS):
-        function = tryParseApplication(tokenSource)
+        function = yield parseApplication(tokenSource)
         if function == None:
             tokenSource.error("expected cast after \"as\"")
-        expression = (PARSED_APPLICATION, function, expression)
+        expression = ParsedApplication(PARSED_APPLICATION, function, expression, spanBetween(expression, function))
 
-    return expression
+    yield expression
 
-def tryParseUnion(tokenSource): 
-    exp = tryParseExpression(tokenSource)
+def parseUnion(tokenSource): 
+    exp = yield parseExpression(tokenSource)
 
     if exp == None:
-        return None
+        yield None
     expressions = [exp]
 
     while tokenSource.isNextToken(TOKEN_PIPE):
-        exp = tryParseExpression(tokenSource)
+        exp = yield parseExpression(tokenSource)
         if exp == None:
             tokenSource.error("expected expression for next type in union after \"|\"")
         expressions.append(exp)
 
     if len(expressions) > 1:
-        return (PARSED_UNION_TYPE, expressions)
-    return expressions[0]
+        yield ParsedUnionType(PARSED_UNION_TYPE, expressions, spanBetween(expressions[0], expressions[-1]))
+    yield expressions[0]
 
 def tryParseString(tokenSource):
     token = tokenSource.getIfOfType(TOKEN_STRING)
     if token != None:
-        mappedNames = [(PARSED_NAME, name[1], name[2], name[3], name[0] == TOKEN_INFIX) for name in token[2]]
-        return (PARSED_STRING, token[1], mappedNames)
+        mappedNames = [ParsedName(PARSED_NAME, name[1], name[2], name[3], name[0] == TOKEN_INFIX, name[4], name[-1]) for name in token[2]]
+        return ParsedString(PARSED_STRING, token[1], mappedNames, token[-1])
 
 def tryParseDollar(tokenSource):
-    return (PARSED_DOLLAR, ) if tokenSource.isNextToken(TOKEN_DOLLAR) else None
+    return ParsedDollar(PARSED_DOLLAR, tokenSource.lastSpan) if tokenSource.isNextToken(TOKEN_DOLLAR) else None
 
 def tryParseName(tokenSource):
     token = tokenSource.getIfOfType(TOKEN_NAME)
@@ -277,15 +383,16 @@ def tryParseName(tokenSource):
         token = tokenSource.getIfOfType(TOKEN_INFIX)
         isInfix = True
 
-    return (PARSED_NAME, token[1], token[2], token[3], isInfix) if token != None else None
+    return ParsedName(PARSED_NAME, token[1], token[2], token[3], isInfix, token[4], token[-1]) if token != None else None
 
-def tryParseList(tokenSource):
+def parseList(tokenSource):
     if tokenSource.isNextToken(TOKEN_OPEN_BRACKET):
+        start = tokenSource.lastSpan[0]
         contents = []
 
         atEnd = tokenSource.isNextToken(TOKEN_CLOSE_BRACKET)
         while atEnd == False:
-            exp = tryParseUnion(tokenSource)
+            exp = yield parseUnion(tokenSource)
             if exp == None:
                 tokenSource.error('Expected expression in list definition') 
 
@@ -296,59 +403,88 @@ def tryParseList(tokenSource):
                 if atEnd == False:
                     tokenSource.error('Expected end bracket (\"]\") for list end or comma for item separation.')
 
-        # list = `empty_list | {hd, tl list}
-        # ALIASING, e.g. [hd,hd,tl] must work correctly
-        # [3,hd,4,tl] => {!0=3, !1=hd, !2=4, !3=tl, !result= {hd=!0, tl={hd=!1, tl={hd=!2, tl={hd=!3, tl=`empty_list}}}}}@!result
-        tail = (PARSED_NAME, "`empty_list", False, False, False)
-        if len(contents) == 0:
-            return tail
-        else:
-            args = [((PARSED_NAME, "!" + str(i), False, False, False), None, contents[i]) for i in range(len(contents))]
-            resultName = (PARSED_NAME, "!result", False, False, False)
-            for i in reversed(range(len(contents))):
-                tail = (PARSED_SCOPE, [
-                    ((PARSED_NAME, "hd", False, False, False),None,(PARSED_NAME, "!" + str(i), False, False, False)),
-                    ((PARSED_NAME, "tl", False, False, False),None,tail)])
-            args.append((resultName, None, tail))
-            return (PARSED_MEMBER_ACCESS, (PARSED_SCOPE, args), resultName)
-
-
-tryParseExplicitScope = lambda tokenSource: tryParseScope(tokenSource, TOKEN_OPEN_BRACE, TOKEN_COMMA, TOKEN_CLOSE_BRACE)
-tryParseImplicitScope = lambda tokenSource: tryParseScope(tokenSource, TOKEN_INDENT, TOKEN_NEWLINE, TOKEN_UNINDENT)
-tryParseWholeFileScope = lambda tokenSource: tryParseScope(tokenSource, TOKEN_FILESTART, TOKEN_NEWLINE, TOKEN_FILEEND)
-
-def tryParseScope(tokenSource, startToken, separatorToken, endToken):
+        yield desugarList(contents, (start, tokenSource.lastSpan[1]))
+
+# list = `empty_list | {hd, tl list}
+# ALIASING, e.g. [hd,hd,tl] must work correctly
+# [3,hd,4,tl] => {!0=3, !1=hd, !2=4, !3=tl, !result= {hd=!0, tl={hd=!1, tl={hd=!2, tl={hd=!3, tl=`empty_list}}}}}@!result
+def desugarList(contents, span):
+    if len(contents) == 0:
+        return makeName("`empty_list", False, span)
+    else:
+        tail = emptyListName
+        args = [(syntheticName("!" + str(i)), None, contents[i]) for i in range(len(contents))]
+        for i in reversed(range(len(contents))):
+            tail = ParsedScope(PARSED_SCOPE, [
+                intern((syntheticName("hd"), None, syntheticName("!" + str(i)))),
+                (syntheticName("tl"), None, tail)], None)
+        args.append((resultName, None, tail))
+        return ParsedMemberAccess(PARSED_MEMBER_ACCESS, ParsedScope(PARSED_SCOPE, args, span), resultName, span)
+
+
+parseExplicitScope = lambda tokenSource: parseScope(tokenSource, TOKEN_OPEN_BRACE, TOKEN_COMMA, TOKEN_CLOSE_BRACE)
+parseImplicitScope = lambda tokenSource: parseScope(tokenSource, TOKEN_INDENT, TOKEN_NEWLINE, TOKEN_UNINDENT)
+parseWholeFileScope = lambda tokenSource: parseScope(tokenSource, TOKEN_FILESTART, TOKEN_NEWLINE, TOKEN_FILEEND)
+
+def tryParseWholeFileScope(tokenSource):
+    return run(parseWholeFileScope(tokenSource))
+
+def parseScope(tokenSource, startToken, separatorToken, endToken):
     if tokenSource.isNextToken(startToken):
-        logging.debug("found scope start token: {0}".format(startToken))
+        start = tokenSource.lastSpan[0]
+        logging.debug("found scope start token: %s", startToken)
         scopeDeclarations = []
-
-        nameParsers = [tryParseExplicitScope, tryParseName]
-
         atEnd = tokenSource.isNextToken(endToken)
         while atEnd == False:
-            declaration = tryParseOne(tokenSource, nameParsers)
-            if declaration == None:
-                tokenSource.error('Expected name declaration in scope definition') 
-                
-            logging.debug("parsed declaration: {0}".format(repr(declaration)))
-            declaration_type = None
-            if declaration[0] == PARSED_NAME:
-                declaration_type = tryParseUnion(tokenSource)
-                logging.debug("parsed declaration type: {0}".format(repr(declaration_type)))
-
-            value = None
-            if tokenSource.isNextToken(TOKEN_EQUALS):
-                logging.debug("found equals sign")
-                value = tryParseOne(tokenSource, [tryParseImplicitScope, tryParseUnion])
-                logging.debug("parsed value: {0}".format(repr(value)))
-                if value == None:
-                    tokenSource.error('Expected value after equals sign in scope declaration') 
-
-            scopeDeclarations.append((declaration, declaration_type, value))
-
-            if tokenSource.isNextToken(separatorToken) == False:
-                atEnd = tokenSource.isNextToken(endToken)
-                if atEnd == False:
-                    tokenSource.error('Expected scope end or comma for member separation.')
-
-        return (PARSED_SCOPE, scopeDeclarations)
+            scopeDeclarations.append((yield parseDeclaration(tokenSource, startToken)))
+            atEnd = isScopeEnd(tokenSource, separatorToken, endToken)
+        yield ParsedScope(PARSED_SCOPE, scopeDeclarations, (start, tokenSource.lastSpan[1]))
+
+# yields each top-level declaration as soon as it has been parsed, so that a
+# file can be processed one declaration at a time without holding its AST -
+# though every distinct name in it stays in the SymbolTable
+def iterWholeFileScope(tokenSource):
+    if tokenSource.isNextToken(TOKEN_FILESTART) == False:
+        tokenSource.error("expected start of file")
+    return iterDeclarations(tokenSource)
+
+def iterDeclarations(tokenSource):
+    atEnd = tokenSource.isNextToken(TOKEN_FILEEND)
+    while atEnd == False:
+        declaration = run(parseDeclaration(tokenSource, TOKEN_FILESTART))
+        atEnd = isScopeEnd(tokenSource, TOKEN_NEWLINE, TOKEN_FILEEND)
+        yield declaration
+
+# the (declaration, type, value) of the next member of a scope
+def parseDeclaration(tokenSource, startToken):
+    declaration = yield parseOne(tokenSource, [parseExplicitScope, tryParseName])
+    if declaration == None:
+        tokenSource.error('Expected name declaration in scope definition') 
+        
+    logging.debug("parsed declaration: %r", declaration)
+    declaration_type = None
+    if declaration[0] == PARSED_NAME:
+        declaration_type = yield parseUnion(tokenSource)
+        logging.debug("parsed declaration type: %r", declaration_type)
+
+    value = None
+    if tokenSource.isNextToken(TOKEN_EQUALS):
+        logging.debug("found equals sign")
+        value = yield parseOne(tokenSource, [parseImplicitScope, parseUnion])
+        logging.debug("parsed value: %r", value)
+        if value == None:
+            tokenSource.error('Expected value after equals sign in scope declaration') 
+
+    # the parse never backtracks into an earlier top-level declaration
+    if startToken == TOKEN_FILESTART and tokenSource.memo != None:
+        tokenSource.memo.commit()
+
+    yield (declaration, declaration_type, value)
+
+# reads the separator after a member of a scope, or failing that the scope's end
+def isScopeEnd(tokenSource, separatorToken, endToken):
+    if tokenSource.isNextToken(separatorToken):
+        return False
+    if tokenSource.isNextToken(endToken) == False:
+        tokenSource.error('Expected scope end or comma for member separation.')
+    return True
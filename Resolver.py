@@ -0,0 +1,163 @@
+from Parser import *
+
+# Binds every name used in a parsed program to the scope declaring it, once,
+# so that nothing after has to search enclosing scopes by name. Each use of a
+# name becomes a ResolvedName giving how many scopes out its declaration is
+# (depth) and which slot of that scope it has, or None for both if no
+# enclosing scope declares it: a literal, a built in, or a name to be passed
+# in when applying. Names are case-insensitive.
+#
+# The scopes counted are scope literals (and the whole file) and the case
+# branches whose pattern binds names: {hd, tl} and "i int". Declaration names,
+# and member names after @, are left as they are. An infix operator's
+# desugaring is not counted: its !lhs, !rhs and !result cannot be named in a
+# program, so the operator and its operands are resolved where the operator
+# is written, and the desugaring is kept only to show what they are. The
+# compact operators and lists of Lowering.py do not desugar to scopes at all.
+#
+# Every declaration in scope is kept on a stack per name, so resolving a name is
+# a dictionary lookup however deeply it is nested, and resolving a program takes
+# time linear in its size.
+
+RESOLVED_NAME = 10 # string, depth, slot, nameId, span
+
+ResolvedName = nodeType("ResolvedName", "name depth slot nameId span")
+
+# the slots of a scope literal, in order: one per declaration, except that
+# {a, b} = value has a hidden slot for the value followed by one for each name.
+# Gives the names as written (None for a hidden slot), their keys (None for a
+# hidden slot or a name declared again later in the scope) and what each slot
+# holds: (None, value node or None) or, for the names of {a, b} = value,
+# (hidden slot, key of the member to take).
+def scopeLayout(declarations):
+    names = []
+    keys = []
+    values = []
+    for (declaration, declarationType, value) in declarations:
+        if declaration[0] == PARSED_NAME:
+            names.append(declaration[1])
+            keys.append(nameKey(declaration))
+            values.append((None, value))
+        else:
+            hidden = len(names)
+            names.append(None)
+            keys.append(None)
+            values.append((None, value))
+            for (memberName, memberType, memberValue) in declaration[1]:
+                names.append(memberName[1])
+                keys.append(nameKey(memberName))
+                values.append((hidden, nameKey(memberName)))
+
+    # a later declaration of a name hides an earlier one
+    lastSlots = dict((keys[i], i) for i in range(len(keys)))
+    keys = [keys[i] if lastSlots[keys[i]] == i else None for i in range(len(keys))]
+    return (names, keys, values)
+
+# the names a case branch's pattern binds, or None if it binds none
+def patternKeys(pattern, patternType):
+    if pattern[0] == PARSED_SCOPE:
+        return [nameKey(name) for (name, nameType, value) in pattern[1]]
+    if patternType != None:
+        return [nameKey(pattern)]
+    return None
+
+# x op y desugars to {!lhs = x, !rhs = y, !result = (op) {lhs = !lhs, rhs = !rhs}}@!result,
+# which gives (op, x, y) with None for a missing operand
+def operatorParts(node):
+    if node[2] != resultName or node[1][0] != PARSED_SCOPE or len(node[1][1]) != 3:
+        return None
+    ((lhs, lhsType, left), (rhs, rhsType, right), (result, resultType, application)) = node[1][1]
+    if lhs != lhsName or rhs != rhsName or application == None or application[0] != PARSED_APPLICATION:
+        return None
+    if application[2] != operandsScope:
+        return None
+    return (application[1], left, right)
+
+class Resolver:
+    def __init__(self):
+        # key => [(level, slot)], innermost last
+        self.bindings = {}
+        self.level = 0
+
+    def enter(self, keys):
+        self.level += 1
+        for slot in range(len(keys)):
+            if keys[slot] != None:
+                self.bindings.setdefault(keys[slot], []).append((self.level, slot))
+
+    def leave(self, keys):
+        for key in keys:
+            if key != None:
+                self.bindings[key].pop()
+        self.level -= 1
+
+    def resolve(self, node):
+        if node == None:
+            return None
+        kind = node[0]
+        if kind == PARSED_NAME:
+            declarations = self.bindings.get(nameKey(node))
+            if declarations:
+                (level, slot) = declarations[-1]
+                return ResolvedName(RESOLVED_NAME, node[1], self.level - level, slot, node[-2], node[-1])
+            return ResolvedName(RESOLVED_NAME, node[1], None, None, node[-2], node[-1])
+
+        elif kind == PARSED_SCOPE:
+            keys = scopeLayout(node[1])[1]
+            self.enter(keys)
+            declarations = [(declaration, self.resolve(declarationType), self.resolve(value)) for (declaration, declarationType, value) in node[1]]
+            self.leave(keys)
+            return ParsedScope(PARSED_SCOPE, declarations, node[-1])
+
+        elif kind == PARSED_CASE:
+            expression = self.resolve(node[1])
+            branches = []
+            for (pattern, patternType, body) in node[2]:
+                if pattern[0] == PARSED_SCOPE:
+                    # a pattern's member values are matched against, not bound
+                    resolvedPattern = ParsedScope(PARSED_SCOPE, [(name, self.resolve(nameType), self.resolve(value)) for (name, nameType, value) in pattern[1]], pattern[-1])
+                else:
+                    resolvedPattern = pattern if patternType != None else self.resolve(pattern)
+                resolvedType = self.resolve(patternType)
+                keys = patternKeys(pattern, patternType)
+                if keys != None:
+                    self.enter(keys)
+                branches.append((resolvedPattern, resolvedType, self.resolve(body)))
+                if keys != None:
+                    self.leave(keys)
+            return ParsedCase(PARSED_CASE, expression, branches, self.resolve(node[3]), node[-1])
+
+        elif kind == PARSED_STRING:
+            return ParsedString(PARSED_STRING, node[1], [self.resolve(name) for name in node[2]], node[-1])
+
+        elif kind == PARSED_UNION_TYPE:
+            return ParsedUnionType(PARSED_UNION_TYPE, [self.resolve(expression) for expression in node[1]], node[-1])
+
+        elif kind == PARSED_APPLICATION:
+            return ParsedApplication(PARSED_APPLICATION, self.resolve(node[1]), self.resolve(node[2]), node[-1])
+
+        elif kind == PARSED_MEMBER_ACCESS:
+            parts = operatorParts(node)
+            if parts != None:
+                (operator, left, right) = parts
+                (lhs, rhs, (result, resultType, application)) = node[1][1]
+                return ParsedMemberAccess(PARSED_MEMBER_ACCESS, ParsedScope(PARSED_SCOPE, [
+                    (lhsName, None, self.resolve(left)),
+                    (rhsName, None, self.resolve(right)),
+                    (resultName, None, ParsedApplication(PARSED_APPLICATION, self.resolve(operator), operandsScope, application[-1]))], node[1][-1]),
+                    resultName, node[-1])
+            return ParsedMemberAccess(PARSED_MEMBER_ACCESS, self.resolve(node[1]), node[2], node[-1])
+
+        elif kind == PARSED_META:
+            return ParsedMeta(PARSED_META, self.resolve(node[1]), node[-1])
+
+        elif kind == LOWERED_OPERATOR:
+            return LoweredOperator(LOWERED_OPERATOR, self.resolve(node[1]), self.resolve(node[2]), self.resolve(node[3]), node[-1])
+
+        elif kind == LOWERED_LIST:
+            return LoweredList(LOWERED_LIST, [self.resolve(item) for item in node[1]], node[-1])
+
+        return node
+
+def resolveNames(expression):
+    return Resolver().resolve(expression)
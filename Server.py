@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import optparse
+import threading
+import collections
+import SocketServer
+from BufferReader import StringReader
+from FastLexer import FastLexer
+from Parser import tryParseWholeFileScope
+from ParseCache import cacheKey
+import StackParser
+
+# A long-running parser, so that parsing a file doesn't pay for starting
+# Python and importing the parser every time. Requests and replies are JSON
+# objects, one per line, on a Unix socket or on stdin and stdout:
+#
+#   {"id": 1, "path": "/abs/path.minx"}     parse a file
+#   {"id": 2, "source": "a = 1\n"}          parse the source given
+#   {"id": 3, "stats": true}                counts of requests and cache hits
+#
+# and optionally "format": "repr" (the AST as implementation.py prints it, the
+# default) or "json" (nodes as nested arrays), and "stackSafe": true to parse
+# and print it as --stack-safe does. A reply has the request's id and either
+# "ast" and whether it was "cached", or "error".
+#
+# The lexer's tables and the parser's interned names stay loaded between
+# requests, and replies are kept by the hash of the source, so an unchanged
+# file is answered without parsing it again. The replies kept are limited,
+# but the names are not: SymbolTable.py keeps every name any request has
+# used, for as long as the server runs. Each connection on the socket is
+# served by its own thread, so one client never waits for another to
+# disconnect, though parsing still holds the interpreter lock.
+#
+# Python 2 has no asyncio, so this is SocketServer's threading server.
+
+DEFAULT_MAX_REPLIES = 1024
+
+class ParseServer:
+    def __init__(self, maxReplies = DEFAULT_MAX_REPLIES):
+        self.maxReplies = maxReplies
+        # (source hash, format, stack safe) => ast, least recently used first
+        self.replies = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "hits": 0, "misses": 0, "errors": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def parse(self, source, format, stackSafe):
+        key = (cacheKey(source), format, stackSafe)
+        with self.lock:
+            if key in self.replies:
+                ast = self.replies.pop(key)
+                self.replies[key] = ast
+                self.counts["hits"] += 1
+                return (ast, True)
+            self.counts["misses"] += 1
+
+        if stackSafe:
+            expression = StackParser.parseWholeFileScope(FastLexer(StringReader(source)))
+            ast = StackParser.reprTree(expression) if format == "repr" else expression
+        else:
+            expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+            ast = repr(expression) if format == "repr" else expression
+
+        with self.lock:
+            self.replies[key] = ast
+            while len(self.replies) > self.maxReplies:
+                self.replies.popitem(False)
+        return (ast, False)
+
+    # the reply to one request line, as a line
+    def handle(self, line):
+        self.count("requests")
+        reply = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request must be a JSON object")
+            reply["id"] = request.get("id")
+            format = request.get("format", "repr")
+            if format not in ["repr", "json"]:
+                raise ValueError("unknown format {0}".format(format))
+            if request.get("stats"):
+                with self.lock:
+                    reply["stats"] = dict(self.counts, cached = len(self.replies))
+            elif "source" in request:
+                (reply["ast"], reply["cached"]) = self.parse(request["source"].encode("utf-8"), format, request.get("stackSafe", False))
+            elif "path" in request:
+                with open(request["path"], 'rb') as sourceFile:
+                    source = sourceFile.read()
+                (reply["ast"], reply["cached"]) = self.parse(source, format, request.get("stackSafe", False))
+            else:
+                raise ValueError("a request needs a path, source or stats")
+        except Exception as e:
+            self.count("errors")
+            reply = {"id": reply.get("id"), "error": "{0}: {1}".format(type(e).__name__, e)}
+
+        try:
+            return json.dumps(reply)
+        except (ValueError, RuntimeError) as e:
+            # too deeply nested for JSON, or not text
+            return json.dumps({"id": reply.get("id"), "error": "{0}: {1}".format(type(e).__name__, e)})
+
+class ConnectionHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            self.wfile.write(self.server.parseServer.handle(line) + "\n")
+            self.wfile.flush()
+
+class UnixParseServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath, parseServer):
+        SocketServer.ThreadingUnixStreamServer.__init__(self, socketPath, ConnectionHandler)
+        self.parseServer = parseServer
+
+def serveStdio(parseServer, inFile, outFile):
+    for line in iter(inFile.readline, ""):
+        outFile.write(parseServer.handle(line) + "\n")
+        outFile.flush()
+
+def serveSocket(parseServer, socketPath):
+    if os.path.exists(socketPath):
+        os.remove(socketPath)
+    server = UnixParseServer(socketPath, parseServer)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socketPath)
+
+def Main():
+    oParser = optparse.OptionParser(usage='usage: %prog [options]\n')
+    oParser.add_option('-s', '--socket', help='listen on this Unix socket (otherwise read requests from stdin and reply on stdout)')
+    oParser.add_option('-m', '--max-replies', default=DEFAULT_MAX_REPLIES, type='int', help='most parsed files to keep replies for')
+    (options, args) = oParser.parse_args()
+
+    parseServer = ParseServer(options.max_replies)
+    if options.socket != None:
+        try:
+            serveSocket(parseServer, options.socket)
+        except KeyboardInterrupt:
+            pass
+    else:
+        serveStdio(parseServer, sys.stdin, sys.stdout)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,65 @@
+from types import GeneratorType
+import Parser
+
+# Runs the rules of Parser.py for sources nested too deeply for Python's call
+# stack. Parser.run() makes a Python call for each rule a rule yields; run()
+# keeps the rules' generators on a list instead, so nesting depth is only
+# limited by memory.
+
+def run(parser):
+    # the rules waiting on the one being run
+    stack = []
+    request = next(parser, None)
+    while True:
+        if request.__class__ is GeneratorType:
+            stack.append(parser)
+            parser = request
+            request = next(parser, None)
+        elif len(stack) == 0:
+            return request
+        else:
+            parser = stack.pop()
+            try:
+                request = parser.send(request)
+            except StopIteration:
+                request = None
+
+def parseWholeFileScope(tokenSource):
+    return run(Parser.parseWholeFileScope(tokenSource))
+
+# repr() and == recurse through nested tuples and lists, so these do the same
+# for ASTs of any depth
+
+def reprTree(node):
+    parts = []
+    # (True, text to output) or (False, node still to repr)
+    stack = [(False, node)]
+    while len(stack) != 0:
+        (isText, item) = stack.pop()
+        if isText:
+            parts.append(item)
+        elif isinstance(item, (tuple, list)):
+            isList = isinstance(item, list)
+            parts.append("[" if isList else "(")
+            stack.append((True, "]" if isList else (",)" if len(item) == 1 else ")")))
+            for i in reversed(range(len(item))):
+                stack.append((False, item[i]))
+                if i != 0:
+                    stack.append((True, ", "))
+        else:
+            parts.append(repr(item))
+    return "".join(parts)
+
+def treesEqual(first, second):
+    stack = [(first, second)]
+    while len(stack) != 0:
+        (a, b) = stack.pop()
+        if a is b:
+            continue
+        if isinstance(a, (tuple, list)) and isinstance(b, (tuple, list)):
+            if isinstance(a, list) != isinstance(b, list) or len(a) != len(b):
+                return False
+            stack.extend(zip(a, b))
+        elif a != b:
+            return False
+    return True
@@ -0,0 +1,211 @@
+import time
+import json
+from types import GeneratorType
+import Lexer
+import Parser
+from FileReader import FileReader
+from BufferReader import StringReader, BufferReader
+from FastLexer import FastLexer
+from TokenBuffer import TokenBuffer
+
+# Counters for where the front end spends its effort. Nothing is counted unless
+# enable() is called: it swaps counting wrappers in for the reader, lexer and
+# parser functions, and disable() puts the originals back, so the code paths
+# are untouched when stats are off.
+#
+# Time is split into stages by a stack of timers, each stage only counting the
+# time not spent in a stage nested inside it: "read" is opening and loading a
+# source, "lex" is producing tokens (including any reading the lexer does as
+# it goes) and "parse" is running the parser's rules, less the lexing they wait on.
+# Characters and tokens that are ungot and then read again are counted again.
+
+tokenNames = dict((value, name[len("TOKEN_"):]) for (name, value) in vars(Lexer).items() if name.startswith("TOKEN_"))
+
+class Stats:
+    def __init__(self):
+        self.counts = {}
+        self.tokens = {}
+        self.attempted = {}
+        self.succeeded = {}
+        self.seconds = {}
+        self.timers = []
+        self.originals = []
+        self.start = None
+        self.elapsed = 0.0
+
+    def count(self, key, n = 1):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def timed(self, stage, function, *args):
+        # [stage, start, time spent in nested stages]
+        timer = [stage, time.time(), 0.0]
+        self.timers.append(timer)
+        try:
+            return function(*args)
+        finally:
+            self.timers.pop()
+            elapsed = time.time() - timer[1]
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed - timer[2]
+            if len(self.timers) != 0:
+                self.timers[-1][2] += elapsed
+
+    # owner is a class or module defining name itself, so the plain function
+    # can be wrapped and later put back
+    def replace(self, owner, name, wrapper):
+        original = owner.__dict__[name]
+        self.originals.append((owner, name, original))
+        setattr(owner, name, wrapper(original))
+
+    def enable(self):
+        if len(self.originals) != 0:
+            return
+        self.start = time.time()
+        stats = self
+
+        def countChars(key):
+            def wrap(method):
+                def counted(reader, *args):
+                    char = method(reader, *args)
+                    if char != None and char != False:
+                        stats.count(key)
+                    return char
+                return counted
+            return wrap
+
+        def countCalls(key):
+            def wrap(method):
+                def counted(*args):
+                    stats.count(key)
+                    return method(*args)
+                return counted
+            return wrap
+
+        def timeStage(stage):
+            def wrap(method):
+                return lambda *args: stats.timed(stage, method, *args)
+            return wrap
+
+        def countSkipped(method):
+            def counted(reader, start, end):
+                stats.count("chars read", end - start)
+                return method(reader, start, end)
+            return counted
+
+        def countScanned(method):
+            def counted(lexer):
+                start = lexer.index
+                token = stats.timed("lex", method, lexer)
+                stats.count("chars read", lexer.index - start)
+                return token
+            return counted
+
+        def countSkippedLayout(method):
+            def counted(lexer, charSource):
+                method(lexer, charSource)
+                # any blank lines and comments at the very start
+                stats.count("chars read", lexer.index - charSource.index)
+            return counted
+
+        def countTokens(method):
+            def counted(lexer):
+                token = method(lexer)
+                stats.tokens[token[0]] = stats.tokens.get(token[0], 0) + 1
+                return token
+            return counted
+
+        def uncountTokens(method):
+            def counted(lexer, token):
+                # the token will be got (and counted) again
+                stats.tokens[token[0]] = stats.tokens.get(token[0], 0) - 1
+                stats.count("token ungets")
+                return method(lexer, token)
+            return counted
+
+        self.replace(FileReader, "__init__", timeStage("read"))
+        self.replace(FileReader, "get", countChars("chars read"))
+        self.replace(FileReader, "unget", countCalls("char ungets"))
+        self.replace(StringReader, "__init__", timeStage("read"))
+        self.replace(BufferReader, "__init__", timeStage("read"))
+        self.replace(StringReader, "get", countChars("chars read"))
+        self.replace(StringReader, "getIf", countChars("chars read"))
+        self.replace(StringReader, "isNextChar", countChars("chars read"))
+        self.replace(StringReader, "skipTo", countSkipped)
+        self.replace(StringReader, "unget", countCalls("char ungets"))
+        self.replace(Lexer.Lexer, "next", timeStage("lex"))
+        self.replace(Lexer.Lexer, "get", countTokens)
+        self.replace(Lexer.Lexer, "unget", uncountTokens)
+        # the table-driven lexer scans the buffer without going through the reader
+        self.replace(FastLexer, "__init__", countSkippedLayout)
+        self.replace(FastLexer, "next", countScanned)
+        self.replace(TokenBuffer, "unget", countCalls("token ungets"))
+        self.replace(TokenBuffer, "rewind", countCalls("token rewinds"))
+
+        self.replace(Parser, "run", timeStage("parse"))
+        for name in sorted(vars(Parser)):
+            if (name.startswith("parse") or name.startswith("tryParse")) and callable(getattr(Parser, name)):
+                self.replace(Parser, name, self.parserWrapper(name))
+
+    def parserWrapper(self, name):
+        stats = self
+        def countResult(parsed):
+            if parsed != None:
+                stats.succeeded[name] = stats.succeeded.get(name, 0) + 1
+
+        # a rule only has a result once the generator it gives has been run
+        def countRule(rule):
+            parsed = yield rule
+            countResult(parsed)
+            yield parsed
+
+        def wrap(parser):
+            def counted(*args):
+                stats.attempted[name] = stats.attempted.get(name, 0) + 1
+                parsed = parser(*args)
+                if isinstance(parsed, GeneratorType):
+                    return countRule(parsed)
+                countResult(parsed)
+                return parsed
+            return counted
+        return wrap
+
+    def disable(self):
+        for (owner, name, original) in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+        if self.start != None:
+            self.elapsed += time.time() - self.start
+            self.start = None
+
+    def totalSeconds(self):
+        return self.elapsed + (time.time() - self.start if self.start != None else 0.0)
+
+    def asDict(self):
+        return {
+            "counts" : dict(self.counts),
+            "tokens" : dict((tokenNames[kind], count) for (kind, count) in self.tokens.items() if count != 0),
+            "parsers" : dict((name, {"attempted" : self.attempted[name], "succeeded" : self.succeeded.get(name, 0)}) for name in self.attempted),
+            "seconds" : dict(self.seconds.items() + [("total", self.totalSeconds())])
+        }
+
+    def report(self, format = "table"):
+        stats = self.asDict()
+        if format == "json":
+            return json.dumps(stats, indent = 1, sort_keys = True)
+
+        lines = []
+        for (title, items) in [("counter", stats["counts"]), ("tokens lexed", stats["tokens"])]:
+            lines.append("{0:<28}{1:>12}".format(title, "count"))
+            for key in sorted(items):
+                lines.append("{0:<28}{1:>12}".format(key, items[key]))
+            lines.append("")
+
+        lines.append("{0:<28}{1:>12}{2:>12}".format("parser", "attempted", "succeeded"))
+        for name in sorted(stats["parsers"], key = lambda name: -stats["parsers"][name]["attempted"]):
+            lines.append("{0:<28}{1:>12}{2:>12}".format(name, stats["parsers"][name]["attempted"], stats["parsers"][name]["succeeded"]))
+        lines.append("")
+
+        lines.append("{0:<28}{1:>12}".format("stage", "seconds"))
+        for stage in ["read", "lex", "parse", "total"]:
+            if stage in stats["seconds"]:
+                lines.append("{0:<28}{1:>12.4f}".format(stage, stats["seconds"][stage]))
+        return '\n'.join(lines)
@@ -0,0 +1,64 @@
+import threading
+
+# The process-wide table of every name and infix lexed. Names are
+# case-insensitive, so each is kept once under its case-folded key, with an
+# int id and the spelling it was first lexed with. The lexers look up each
+# name's spelling as it is lexed: its token, and the ParsedName made from it,
+# carry the id and a spelling shared by every use of that spelling, so that
+# later stages can compare ids, or take the folded key shared by every
+# spelling of the name (see Parser.nameKey), rather than folding the name again.
+#
+# Ids are only meaningful in the process that gave them out. ASTs made in
+# another process are flattened (see ParseCache.py), and their names looked up
+# again here as they are rebuilt.
+#
+# Names are never removed: any AST still held, such as a reply cached by
+# Server.py or an IncrementalParse, may use any id, so there is no point at
+# which the table could be emptied. Each name costs about half a KB, so a
+# streamed parse (see Parser.iterWholeFileScope) or a long-running server has
+# its memory bounded by the distinct names it has lexed, not by the length of
+# what it has read.
+
+class SymbolTable(object):
+    __slots__ = ["ids", "keys", "spellings", "spelled", "lock"]
+    def __init__(self):
+        # case-folded key => id
+        self.ids = {}
+        # id => case-folded key, and the spelling first lexed
+        self.keys = []
+        self.spellings = []
+        # spelling => (the shared spelling, id), so that a spelling seen before
+        # is not folded again
+        self.spelled = {}
+        # names are lexed in several threads at once by Server.py, so new ones
+        # are added one at a time
+        self.lock = threading.Lock()
+
+    def add(self, spelling):
+        found = self.spelled.get(spelling)
+        if found is not None:
+            return found
+        with self.lock:
+            found = self.spelled.get(spelling)
+            if found is not None:
+                return found
+            key = intern(spelling.lower())
+            nameId = self.ids.get(key)
+            if nameId is None:
+                nameId = len(self.keys)
+                self.keys.append(key)
+                self.spellings.append(spelling)
+                self.ids[key] = nameId
+            found = self.spelled[spelling] = (intern(spelling), nameId)
+            return found
+
+    def __len__(self):
+        return len(self.keys)
+
+symbolTable = SymbolTable()
+
+# (the shared spelling, id) of a name
+internName = symbolTable.add
+
+# id => case-folded key
+symbolKeys = symbolTable.keys
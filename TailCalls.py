@@ -0,0 +1,71 @@
+from Parser import *
+from Resolver import operatorParts
+
+# Finds the applications whose result is the result of the declaration they
+# are in - calls in tail position - so that the evaluator can run them without
+# growing the call stack (see TailCall in Evaluator.py). A declaration's value
+# is in tail position, and so is each branch of a case in tail position, and
+# the else branch; an application in tail position becomes a TailApplication.
+# Nothing else is: an application's function and argument, a case's subject
+# and patterns, and the operands of an operator are all needed before the
+# expression they are in can give its value.
+#
+# Loops in Minx are recursion through case branches, like the README's item:
+#
+#   item = case list
+#       | {hd, tl} : case index
+#           | 0 : hd
+#           | else : item ({oldIndex = index} as {list = tl, index = oldIndex - 1})
+#
+# where the application of item in the else branch is a tail call.
+
+TAIL_APPLICATION = 13 # function expression, argument expression, span
+
+TailApplication = nodeType("TailApplication", "function argument span")
+
+def mark(node, isTail):
+    if node == None:
+        return None
+    kind = node[0]
+    if kind == PARSED_APPLICATION:
+        function = mark(node[1], False)
+        argument = mark(node[2], False)
+        if isTail:
+            return TailApplication(TAIL_APPLICATION, function, argument, node[-1])
+        return ParsedApplication(PARSED_APPLICATION, function, argument, node[-1])
+
+    elif kind == PARSED_CASE:
+        branches = []
+        for (pattern, patternType, body) in node[2]:
+            if pattern[0] == PARSED_SCOPE:
+                pattern = ParsedScope(PARSED_SCOPE, [(name, mark(nameType, False), mark(value, False)) for (name, nameType, value) in pattern[1]], pattern[-1])
+            branches.append((pattern, mark(patternType, False), mark(body, isTail)))
+        return ParsedCase(PARSED_CASE, mark(node[1], False), branches, mark(node[3], isTail), node[-1])
+
+    elif kind == PARSED_SCOPE:
+        return ParsedScope(PARSED_SCOPE, [(declaration, mark(declarationType, False), mark(value, True)) for (declaration, declarationType, value) in node[1]], node[-1])
+
+    elif kind == PARSED_MEMBER_ACCESS:
+        parts = operatorParts(node)
+        if parts != None:
+            # compiled just as the operator is, without its desugaring
+            return LoweredOperator(LOWERED_OPERATOR, parts[0], mark(parts[1], False), mark(parts[2], False), node[-1])
+        return ParsedMemberAccess(PARSED_MEMBER_ACCESS, mark(node[1], False), node[2], node[-1])
+
+    elif kind == LOWERED_OPERATOR:
+        return LoweredOperator(LOWERED_OPERATOR, node[1], mark(node[2], False), mark(node[3], False), node[-1])
+
+    elif kind == LOWERED_LIST:
+        return LoweredList(LOWERED_LIST, [mark(item, False) for item in node[1]], node[-1])
+
+    elif kind == PARSED_UNION_TYPE:
+        return ParsedUnionType(PARSED_UNION_TYPE, [mark(expression, False) for expression in node[1]], node[-1])
+
+    elif kind == PARSED_META:
+        return ParsedMeta(PARSED_META, mark(node[1], False), node[-1])
+
+    # names, strings and $
+    return node
+
+def markTailCalls(expression):
+    return mark(expression, False)
@@ -0,0 +1,128 @@
+from array import array
+from bisect import bisect_left
+from Lexer import *
+
+FLAG_SIDE_EFFECTS = 1
+FLAG_MUTABLE = 2
+
+# A pre-lexed token stream stored as parallel array columns (kind, flags and
+# source offsets) rather than one tuple per token. Names and string chunks are
+# only sliced out of the source buffer when a token is read (and names looked
+# up in the SymbolTable then, so that columns lexed in another process hold
+# nothing that only means something there), and tokens are
+# "ungot" by stepping back an index. The lexer must read from a buffer-backed
+# char source (StringReader or BufferReader).
+#
+# The columns can also be given, as lexed elsewhere from the same char source
+# (see Parallel.py), rather than lexed here from tokenSource.
+class TokenBuffer:
+    def __init__(self, tokenSource, columns = None):
+        self.charSource = tokenSource.charSource
+        self.buffer = self.charSource.buffer
+        self.count = 0
+        self.index = 0
+        self.lastSpan = (0, 0)
+        # set to a PackratMemo to memoize parsers by token index
+        self.memo = None
+        if columns != None:
+            (self.kinds, self.flags, self.starts, self.ends, self.innerKinds, self.innerFlags, self.innerStarts, self.innerEnds) = columns
+            self.count = len(self.kinds)
+            return
+
+        self.kinds = array('b')
+        self.flags = array('b')
+        self.starts = array('l')
+        self.ends = array('l')
+
+        # names within strings, in source order
+        self.innerKinds = array('b')
+        self.innerFlags = array('b')
+        self.innerStarts = array('l')
+        self.innerEnds = array('l')
+
+        token = tokenSource.get()
+        while True:
+            self.append(token, self.kinds, self.flags, self.starts, self.ends)
+            if token[0] == TOKEN_STRING:
+                for name in token[2]:
+                    self.append(name, self.innerKinds, self.innerFlags, self.innerStarts, self.innerEnds)
+            if token[0] == TOKEN_FILEEND:
+                break
+            token = tokenSource.get()
+        self.count = len(self.kinds)
+
+    def columns(self):
+        return (self.kinds, self.flags, self.starts, self.ends, self.innerKinds, self.innerFlags, self.innerStarts, self.innerEnds)
+
+    def append(self, token, kinds, flags, starts, ends):
+        kinds.append(token[0])
+        if token[0] == TOKEN_NAME or token[0] == TOKEN_INFIX:
+            flags.append((FLAG_SIDE_EFFECTS if token[2] else 0) | (FLAG_MUTABLE if token[3] else 0))
+        else:
+            flags.append(0)
+        starts.append(token[-1][0])
+        ends.append(token[-1][1])
+
+    def get(self):
+        token = self.tokenAt(self.index)
+        self.index += 1
+        self.lastSpan = token[-1]
+        return token
+
+    def unget(self, token):
+        self.rewind(self.index - 1)
+
+    def rewind(self, index):
+        self.index = index
+        last = min(index, self.count) - 1
+        self.lastSpan = (self.starts[last], self.ends[last]) if last >= 0 else (0, 0)
+
+    def getIfOfType(self, tokenType):
+        # check the kind column first so that unmatched tokens are never built
+        if self.kinds[min(self.index, self.count - 1)] == tokenType:
+            return self.get()
+
+    def isNextToken(self, tokenType):
+        return self.getIfOfType(tokenType) != None
+
+    def tokenAt(self, index):
+        # reading past the end keeps returning the end of file
+        index = min(index, self.count - 1)
+        kind = self.kinds[index]
+        span = (self.starts[index], self.ends[index])
+        if kind == TOKEN_NAME or kind == TOKEN_INFIX:
+            return self.nameToken(kind, self.flags[index], span)
+        elif kind == TOKEN_STRING:
+            return self.stringToken(span)
+        return (kind, span)
+
+    def nameToken(self, kind, flags, span):
+        hasSideEffects = (flags & FLAG_SIDE_EFFECTS) != 0
+        isMutable = (flags & FLAG_MUTABLE) != 0
+        # the ~ and ! suffixes are the last characters of the span
+        textEnd = span[1] - hasSideEffects - isMutable
+        (match, nameId) = internName(self.buffer[span[0]:textEnd])
+        return (kind, match, hasSideEffects, isMutable, nameId, span)
+
+    def stringToken(self, span):
+        # chunks are the raw text between the quotes and around each "{name}"
+        chunks = []
+        names = []
+        chunkStart = span[0] + 1
+        i = bisect_left(self.innerStarts, span[0])
+        while i < len(self.innerStarts) and self.innerStarts[i] < span[1]:
+            nameSpan = (self.innerStarts[i], self.innerEnds[i])
+            chunks.append(self.buffer[chunkStart:nameSpan[0] - 1])
+            names.append(self.nameToken(self.innerKinds[i], self.innerFlags[i], nameSpan))
+            chunkStart = nameSpan[1] + 1
+            i += 1
+        chunks.append(self.buffer[chunkStart:span[1] - 1])
+        return (TOKEN_STRING, chunks, names, span)
+
+    def lineAndColNoAt(self, offset):
+        return self.charSource.lineAndColNoAt(offset)
+
+    def error(self, msg):
+        nextToken = self.tokenAt(self.index)
+        lineAndColNo = self.lineAndColNoAt(nextToken[-1][0])
+        raise Exception("{0}: line: {1}, col: {2}. Next token:{3}".format(msg, lineAndColNo[0], lineAndColNo[1], repr(nextToken)))
@@ -0,0 +1,201 @@
+from Parser import *
+from Evaluator import *
+from Resolver import scopeLayout, patternKeys, operatorParts
+
+# A straightforward interpreter for the same language as Evaluator.py, to
+# check it against and to measure it against: it walks the AST every time an
+# expression is evaluated, and finds each name by searching the enclosing
+# scopes' members by name. The runtime values are Evaluator.py's.
+
+# stands in for a compiled Code in thunks and shapes
+class Walked(object):
+    __slots__ = ["node"]
+    isConstant = False
+    def __init__(self, node):
+        self.node = node
+
+    def value(self, frame, arguments):
+        return walk(self.node, frame, arguments)
+
+    def callee(self, frame, arguments, argument):
+        return walkCallee(self.node, frame, arguments, argument)
+
+# a member of a multiple assignment, {a, b} = value
+class WalkedMember(object):
+    __slots__ = ["hidden", "key"]
+    isConstant = False
+    def __init__(self, hidden, key):
+        self.hidden = hidden
+        self.key = key
+
+    def value(self, frame, arguments):
+        return member(asArgument(frame.slots[self.hidden]), self.key)
+
+    def callee(self, frame, arguments, argument):
+        return self.value(frame, (argument, arguments))
+
+def evaluateProgramWalking(expression):
+    return walk(expression, None, None)
+
+# the frame declaring a name, and its slot there
+def findDeclaration(frame, key):
+    while frame is not None:
+        if key in frame.shape.layout:
+            return (frame, frame.shape.layout[key])
+        frame = frame.parent
+    return None
+
+def walkSlot(node, frame):
+    (declaringFrame, slot) = findDeclaration(frame, nameKey(node))
+    value = declaringFrame.slots[slot]
+    if value is None:
+        raise EvaluationError("{0} has no value".format(node[1]))
+    return value
+
+def walkName(node, frame, arguments):
+    literal = literalValue(node[1])
+    if literal != None:
+        return literal
+    key = nameKey(node)
+    if findDeclaration(frame, key) != None:
+        return fromDeclaration(walkSlot(node, frame), arguments)
+    if key in builtinOperators:
+        return builtinOperators[key]
+    if key in builtinTypes:
+        return builtinTypes[key]
+    return lookupArgument(arguments, key, node[1])
+
+def walk(node, frame, arguments):
+    kind = node[0]
+    if kind == PARSED_NAME:
+        return walkName(node, frame, arguments)
+
+    elif kind == PARSED_SCOPE:
+        (names, keys, values) = scopeLayout(node[1])
+        codes = [(Walked(value) if value != None else None) if hidden == None else WalkedMember(hidden, value) for (hidden, value) in values]
+        scope = Scope(Shape(names, keys, codes), [None] * len(codes), frame, arguments)
+        for i in range(len(codes)):
+            if codes[i] != None:
+                scope.slots[i] = Thunk(codes[i], scope, arguments)
+        return scope
+
+    elif kind == PARSED_MEMBER_ACCESS:
+        parts = operatorParts(node)
+        if parts != None:
+            return walkOperator(parts, frame, arguments)
+        scope = force(walk(node[1], frame, arguments))
+        if scope.__class__ is not Scope:
+            raise EvaluationError("cannot get member {0} of {1}".format(node[2][1], show(scope)))
+        if nameKey(node[2]) not in scope.shape.layout:
+            raise EvaluationError("no member {0} in {1}".format(node[2][1], show(scope)))
+        value = scope.slots[scope.shape.layout[nameKey(node[2])]]
+        if value is None:
+            raise EvaluationError("member {0} has no value".format(node[2][1]))
+        return value
+
+    elif kind == PARSED_APPLICATION:
+        argument = asArgument(walk(node[2], frame, arguments))
+        return walkCallee(node[1], frame, arguments, argument)
+
+    elif kind == PARSED_STRING:
+        parts = [unescape(node[1][0])]
+        for i in range(len(node[2])):
+            parts.append(formatValue(force(walk(node[2][i], frame, arguments))))
+            parts.append(unescape(node[1][i + 1]))
+        return "".join(parts)
+
+    elif kind == PARSED_CASE:
+        subject = force(walk(node[1], frame, arguments))
+        for (pattern, patternType, body) in node[2]:
+            bound = walkPattern(pattern, patternType, subject, frame, arguments)
+            if bound is not None:
+                return walk(body, bound, arguments)
+        if node[3] != None:
+            return walk(node[3], frame, arguments)
+        return subject
+
+    elif kind == PARSED_DOLLAR:
+        return frame
+
+    elif kind == PARSED_UNION_TYPE:
+        return Union([walk(alternative, frame, arguments) for alternative in node[1]])
+
+    elif kind == PARSED_META:
+        raise EvaluationError("meta expressions cannot be evaluated")
+
+    elif kind == LOWERED_OPERATOR:
+        return walkOperator(node[1:4], frame, arguments)
+
+    elif kind == LOWERED_LIST:
+        # as {hd, tl} scopes, to check the compiled ListViews against
+        tail = emptyList
+        for item in reversed(node[1]):
+            tail = Scope(Shape(["hd", "tl"], ["hd", "tl"], [None, None]), [Thunk(Walked(item), frame, arguments), tail], frame, arguments)
+        return tail
+
+def walkOperator(parts, frame, arguments):
+    (operator, left, right) = parts
+    key = nameKey(operator)
+    if left == None and right == None:
+        return walkName(operator, frame, arguments)
+
+    if key in builtinOperators and findDeclaration(frame, key) == None:
+        builtin = builtinOperators[key]
+        if right == None or (left == None and builtin.unary == None):
+            raise EvaluationError("{0} is missing an operand".format(builtin.name))
+        if left == None:
+            return builtin.unary(force(walk(right, frame, arguments)))
+        return builtin.binary(force(walk(left, frame, arguments)), force(walk(right, frame, arguments)))
+
+    codes = [Walked(operand) if operand != None else None for operand in [left, right]]
+    operands = Scope(Shape(["lhs", "rhs"], ["lhs", "rhs"], codes), [None, None], frame, arguments)
+    for i in range(2):
+        if codes[i] != None:
+            operands.slots[i] = Thunk(codes[i], frame, arguments)
+    return walkCallee(operator, frame, arguments, operands)
+
+def walkCallee(node, frame, arguments, argument):
+    kind = node[0]
+    if kind == PARSED_NAME:
+        if literalValue(node[1]) == None and findDeclaration(frame, nameKey(node)) != None:
+            return applyTo(walkSlot(node, frame), argument)
+        return applyTo(walkName(node, frame, arguments), argument)
+
+    elif kind == PARSED_SCOPE or kind == PARSED_DOLLAR or kind == LOWERED_LIST:
+        return instantiate(walk(node, frame, arguments), argument)
+
+    elif kind == PARSED_MEMBER_ACCESS:
+        parts = operatorParts(node)
+        if parts == None:
+            return applyTo(walk(node, frame, arguments), argument)
+        if parts[1] == None and parts[2] == None:
+            return walkCallee(parts[0], frame, arguments, argument)
+
+    elif kind == LOWERED_OPERATOR:
+        if node[2] == None and node[3] == None:
+            return walkCallee(node[1], frame, arguments, argument)
+
+    return walk(node, frame, (argument, arguments))
+
+def walkPattern(pattern, patternType, subject, frame, arguments):
+    if pattern[0] == PARSED_SCOPE:
+        if subject.__class__ is not Scope:
+            return None
+        names = []
+        bound = []
+        for (name, nameType, value) in pattern[1]:
+            slot = subject.shape.layout.get(nameKey(name))
+            if slot == None or subject.slots[slot] is None:
+                return None
+            if value != None and valuesEqual(force(subject.slots[slot]), force(walk(value, frame, arguments))) == False:
+                return None
+            names.append(name[1])
+            bound.append(subject.slots[slot])
+        return Scope(Shape(names, patternKeys(pattern, patternType), [None] * len(names)), bound, frame, arguments)
+
+    if patternType != None:
+        if matchesType(subject, walk(patternType, frame, arguments)):
+            return Scope(Shape([pattern[1]], patternKeys(pattern, patternType), [None]), [subject], frame, arguments)
+        return None
+
+    return frame if valuesEqual(subject, force(walk(pattern, frame, arguments))) else None
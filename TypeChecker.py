@@ -0,0 +1,462 @@
+import sys
+from Parser import *
+from Resolver import resolveNames, scopeLayout, patternKeys, operatorParts, RESOLVED_NAME
+from Evaluator import Symbol, literalValue, builtinTypes
+
+# Checks a parsed program's declared types, structurally: a scope is a type
+# too, and a value has a scope type if it has all of its members, each of the
+# member's type. Checked are
+#
+#   name type = value       the value must be of the declared type
+#   function argument       (and argument as function) each member of the
+#                           argument the function declares a type for must be
+#                           of that type
+#
+# reporting each (span, message) where one is not. Types are Int, String and
+# Symbol, literals (4, `empty_list), scope types and unions (a | b); a name
+# used as a type stands for what it is declared as, so types can be recursive,
+# like the README's
+#
+#   list = `empty_list | {hd, tl list}
+#
+# A member's default value makes it of that value's type, widened from a
+# literal to Int or Symbol. What the checker cannot work out a type for - the
+# result of an operator or of a function applied to unmet dependencies, for
+# instance - is unknown, and checks against unknown pass.
+#
+# Types are hash-consed: each is a small int, made once for each distinct
+# structure, so that structurally equal types are the same int and comparing
+# them is an int comparison. Whether one type is a subtype of another is
+# memoized for each pair of ints, so the members of two wide scope types are
+# compared once however often the check comes up. A name used as a type is a
+# reference to the declaration, and is only unfolded into its definition when
+# a check needs to look inside it; recursive types are compared coinductively:
+# a pair already being compared is assumed to be a subtype, and the comparison
+# that assumed it is only remembered once the pair it assumed has been shown
+# to be one.
+
+UNKNOWN = 0   # (kind,)
+BUILTIN = 1   # (kind, builtin type name)
+LITERAL = 2   # (kind, "int" or "symbol", value)
+SCOPE = 3     # (kind, ((key, member type), ...) sorted by key)
+UNION = 4     # (kind, (alternative type, ...) sorted)
+REF = 5       # (kind, id(frame), slot)
+
+IN_PROGRESS = -1
+
+# maxShowMembers members of a type are shown in messages
+maxShowMembers = 6
+
+# A scope literal, or a case branch binding names, with the type of each slot
+# once it is worked out. Slots are as scopeLayout() lays them out, each
+# (name node, type node, value node, hidden slot, key), so that a resolved
+# name's (depth, slot) is a frame depth out and one of its slots.
+class Frame(object):
+    __slots__ = ["parent", "slots", "types"]
+    def __init__(self, parent, slots):
+        self.parent = parent
+        self.slots = slots
+        self.types = [None] * len(slots)
+
+def scopeSlots(declarations):
+    slots = []
+    for (declaration, declarationType, value) in declarations:
+        if declaration[0] == PARSED_NAME:
+            slots.append((declaration, declarationType, value, None, None))
+        else:
+            hidden = len(slots)
+            slots.append((declaration, None, value, None, None))
+            for (memberName, memberType, memberValue) in declaration[1]:
+                slots.append((memberName, memberType, None, hidden, nameKey(memberName)))
+    return slots
+
+class TypeChecker:
+    def __init__(self):
+        # type => its structure, and back
+        self.types = []
+        self.ids = {}
+        # scope type => {key: member type}
+        self.members = {}
+        # reference type => (frame, slot), and the type it stands for
+        self.refs = {}
+        self.definitions = {}
+        # (id(node), id(parent frame)) => (node, frame)
+        self.frames = {}
+        # (subtype, supertype) => whether it is one
+        self.subtypes = {}
+        # (subtype, supertype) => how many comparisons deep it is being made
+        self.pending = {}
+        # pairs shown to be subtypes if a pending pair turns out to be one
+        self.provisional = []
+        # the shallowest pending pair the current comparison assumed
+        self.lowest = sys.maxint
+        self.comparisons = 0
+        self.errors = []
+        self.unknown = self.intern((UNKNOWN,))
+        self.builtins = dict((name, self.intern((BUILTIN, name))) for name in builtinTypes)
+
+    def intern(self, structure):
+        type = self.ids.get(structure)
+        if type == None:
+            type = self.ids[structure] = len(self.types)
+            self.types.append(structure)
+            if structure[0] == SCOPE:
+                self.members[type] = dict(structure[1])
+        return type
+
+    def scopeType(self, members):
+        return self.intern((SCOPE, tuple(sorted(members))))
+
+    def unionType(self, alternatives):
+        flattened = set()
+        for alternative in alternatives:
+            structure = self.types[alternative]
+            if structure[0] == UNKNOWN:
+                return self.unknown
+            if structure[0] == UNION:
+                flattened.update(structure[1])
+            else:
+                flattened.add(alternative)
+        if len(flattened) == 1:
+            return flattened.pop()
+        return self.intern((UNION, tuple(sorted(flattened))))
+
+    def literalType(self, value):
+        if value.__class__ is Symbol:
+            return self.intern((LITERAL, "symbol", value.name.lower()))
+        return self.intern((LITERAL, "int", value))
+
+    # the builtin type of a literal, for defaults
+    def widen(self, type):
+        structure = self.types[type]
+        if structure[0] == LITERAL:
+            return self.builtins[structure[1]]
+        if structure[0] == UNION:
+            return self.unionType([self.widen(alternative) for alternative in structure[1]])
+        return type
+
+    def refType(self, frame, slot):
+        type = self.intern((REF, id(frame), slot))
+        self.refs[type] = (frame, slot)
+        return type
+
+    # what a reference type stands for
+    def unfold(self, type):
+        definition = self.definitions.get(type)
+        if definition != None:
+            return definition
+        # a name declared as itself, through any number of others, is unknown
+        self.definitions[type] = self.unknown
+        (frame, slot) = self.refs[type]
+        value = frame.slots[slot][2]
+        definition = self.asType(value, frame) if value != None else self.unknown
+        if self.types[definition][0] == REF:
+            definition = self.unfold(definition)
+        self.definitions[type] = definition
+        return definition
+
+    def unfolded(self, type):
+        return self.unfold(type) if self.types[type][0] == REF else type
+
+    def frameOf(self, node, parent, slots):
+        key = (id(node), id(parent))
+        found = self.frames.get(key)
+        if found == None:
+            found = self.frames[key] = (node, Frame(parent, slots(node)))
+        return found[1]
+
+    def scopeFrame(self, node, parent):
+        return self.frameOf(node, parent, lambda node: scopeSlots(node[1]))
+
+    # the frame a case branch's body is in
+    def branchFrame(self, pattern, patternType, frame):
+        if patternKeys(pattern, patternType) == None:
+            return frame
+        if pattern[0] == PARSED_SCOPE:
+            bound = [(name, nameType) for (name, nameType, value) in pattern[1]]
+        else:
+            bound = [(pattern, patternType)]
+        branch = self.frameOf(pattern, frame, lambda pattern: [(name, None, None, None, None) for (name, nameType) in bound])
+        for (slot, (name, nameType)) in enumerate(bound):
+            if branch.types[slot] == None:
+                branch.types[slot] = self.asType(nameType, frame) if nameType != None else self.unknown
+        return branch
+
+    def slotType(self, frame, slot):
+        type = frame.types[slot]
+        if type == IN_PROGRESS:
+            # used in working out its own type
+            return self.unknown
+        if type != None:
+            return type
+        frame.types[slot] = IN_PROGRESS
+        (name, typeNode, value, hidden, key) = frame.slots[slot]
+        if typeNode != None:
+            type = self.asType(typeNode, frame)
+        elif hidden != None:
+            type = self.memberType(self.slotType(frame, hidden), key)
+        elif value != None:
+            type = self.typeOf(value, frame)
+        else:
+            type = self.unknown
+        frame.types[slot] = type
+        return type
+
+    def memberType(self, type, key):
+        members = self.members.get(self.unfolded(type))
+        if members == None:
+            return self.unknown
+        return members.get(key, self.unknown)
+
+    def declared(self, node, frame):
+        for i in xrange(node[2]):
+            frame = frame.parent
+        return frame
+
+    def scopeTypeOf(self, node, frame, widened):
+        scope = self.scopeFrame(node, frame)
+        members = []
+        for (slot, key) in enumerate(scopeLayout(node[1])[1]):
+            if key != None:
+                type = self.slotType(scope, slot)
+                members.append((key, self.widen(type) if widened and scope.slots[slot][1] == None else type))
+        return self.scopeType(members)
+
+    # the type of the value of an expression
+    def typeOf(self, node, frame):
+        kind = node[0]
+        if kind == RESOLVED_NAME:
+            literal = literalValue(node[1])
+            if literal != None:
+                return self.literalType(literal)
+            if node[2] == None:
+                return self.unknown
+            return self.slotType(self.declared(node, frame), node[3])
+        elif kind == PARSED_STRING:
+            return self.builtins["string"]
+        elif kind == PARSED_SCOPE:
+            return self.scopeTypeOf(node, frame, False)
+        elif kind == PARSED_MEMBER_ACCESS:
+            if operatorParts(node) != None:
+                return self.unknown
+            return self.memberType(self.typeOf(node[1], frame), nameKey(node[2]))
+        elif kind == PARSED_APPLICATION:
+            return self.applicationType(node, frame)
+        elif kind == PARSED_CASE:
+            types = [self.typeOf(body, self.branchFrame(pattern, patternType, frame)) for (pattern, patternType, body) in node[2]]
+            types.append(self.typeOf(node[3] if node[3] != None else node[1], frame))
+            return self.unionType(types)
+        elif kind == LOWERED_LIST:
+            type = self.literalType(literalValue(emptyListName[1]))
+            for item in reversed(node[1]):
+                type = self.scopeType([("hd", self.typeOf(item, frame)), ("tl", type)])
+            return type
+        # operators, unions (which are types), $ and meta expressions
+        return self.unknown
+
+    # the type an expression stands for, written as a type
+    def asType(self, node, frame):
+        kind = node[0]
+        if kind == RESOLVED_NAME:
+            literal = literalValue(node[1])
+            if literal != None:
+                return self.literalType(literal)
+            if node[2] == None:
+                return self.builtins.get(nameKey(node), self.unknown)
+            return self.refType(self.declared(node, frame), node[3])
+        elif kind == PARSED_UNION_TYPE:
+            return self.unionType([self.asType(alternative, frame) for alternative in node[1]])
+        elif kind == PARSED_SCOPE:
+            return self.scopeTypeOf(node, frame, True)
+        elif kind in (PARSED_APPLICATION, PARSED_MEMBER_ACCESS, PARSED_CASE, LOWERED_LIST):
+            return self.widen(self.typeOf(node, frame))
+        return self.unknown
+
+    # a scope applied to another scope has the members of the first, with the
+    # values of the second's where it has them
+    def applicationType(self, node, frame):
+        functionMembers = self.members.get(self.unfolded(self.typeOf(node[1], frame)))
+        argumentMembers = self.members.get(self.unfolded(self.typeOf(node[2], frame)))
+        if functionMembers == None or argumentMembers == None:
+            return self.unknown
+        return self.scopeType([(key, argumentMembers.get(key, type)) for (key, type) in functionMembers.items()])
+
+    # key => (frame, slot) of the members a function declares types for, if
+    # it is a scope literal or a name declared as one
+    def declaredMembers(self, node, frame):
+        seen = set()
+        while node[0] == RESOLVED_NAME and node[2] != None and (id(node), id(frame)) not in seen:
+            seen.add((id(node), id(frame)))
+            frame = self.declared(node, frame)
+            (name, typeNode, value, hidden, key) = frame.slots[node[3]]
+            if typeNode != None or value == None:
+                return {}
+            node = value
+        if node[0] != PARSED_SCOPE:
+            return {}
+        scope = self.scopeFrame(node, frame)
+        return dict((key, (scope, slot)) for (slot, key) in enumerate(scopeLayout(node[1])[1]) if key != None and scope.slots[slot][1] != None)
+
+    def isSubtype(self, subtype, supertype):
+        if subtype == supertype or subtype == self.unknown or supertype == self.unknown:
+            return True
+        pair = (subtype, supertype)
+        known = self.subtypes.get(pair)
+        if known != None:
+            return known
+        depth = self.pending.get(pair)
+        if depth != None:
+            # coinductively, until shown otherwise
+            self.lowest = min(self.lowest, depth)
+            return True
+
+        self.comparisons += 1
+        depth = self.pending[pair] = len(self.pending)
+        (outerLowest, self.lowest) = (self.lowest, depth)
+        mark = len(self.provisional)
+        result = self.compare(subtype, supertype)
+        del self.pending[pair]
+        if not result:
+            # false whatever was assumed; what was shown assuming this is not
+            self.subtypes[pair] = False
+            del self.provisional[mark:]
+        elif self.lowest >= depth:
+            # true, and so is everything shown assuming it
+            self.subtypes[pair] = True
+            for provisional in self.provisional[mark:]:
+                self.subtypes[provisional] = True
+            del self.provisional[mark:]
+        else:
+            self.provisional.append(pair)
+        self.lowest = min(outerLowest, self.lowest)
+        return result
+
+    def compare(self, subtype, supertype):
+        structure = self.types[subtype]
+        superStructure = self.types[supertype]
+        if structure[0] == REF:
+            return self.isSubtype(self.unfold(subtype), supertype)
+        if superStructure[0] == REF:
+            return self.isSubtype(subtype, self.unfold(supertype))
+        if structure[0] == UNION:
+            return all(self.isSubtype(alternative, supertype) for alternative in structure[1])
+        if superStructure[0] == UNION:
+            return any(self.isSubtype(subtype, alternative) for alternative in superStructure[1])
+        if superStructure[0] == BUILTIN:
+            return structure[0] == LITERAL and structure[1] == superStructure[1]
+        if superStructure[0] == SCOPE:
+            if structure[0] != SCOPE:
+                return False
+            members = self.members[subtype]
+            for (key, memberType) in superStructure[1]:
+                if key not in members or not self.isSubtype(members[key], memberType):
+                    return False
+            return True
+        return False
+
+    def showType(self, type, depth = 0):
+        structure = self.types[type]
+        kind = structure[0]
+        if kind == UNKNOWN:
+            return "?"
+        elif kind == BUILTIN:
+            return structure[1].capitalize()
+        elif kind == LITERAL:
+            return str(structure[2])
+        elif kind == REF:
+            (frame, slot) = self.refs[type]
+            return frame.slots[slot][0][1]
+        elif kind == UNION:
+            return " | ".join(self.showType(alternative, depth + 1) for alternative in structure[1])
+        if depth > 2:
+            return "{...}"
+        members = []
+        for (key, member) in structure[1][:maxShowMembers]:
+            shown = self.showType(member, depth + 1)
+            members.append(key if shown == "?" else "{0} ({1})".format(key, shown) if self.types[member][0] == UNION else "{0} {1}".format(key, shown))
+        if len(structure[1]) > maxShowMembers:
+            members.append("...")
+        return "{" + ", ".join(members) + "}"
+
+    # why subtype is not a subtype of supertype, for a message
+    def explain(self, subtype, supertype):
+        (subtype, supertype) = (self.unfolded(subtype), self.unfolded(supertype))
+        if self.types[subtype][0] == SCOPE and self.types[supertype][0] == SCOPE:
+            members = self.members[subtype]
+            missing = [key for (key, type) in self.types[supertype][1] if key not in members]
+            if len(missing) != 0:
+                return "it has no {0}".format(", ".join(missing))
+            for (key, type) in self.types[supertype][1]:
+                if not self.isSubtype(members[key], type):
+                    return "its {0} is {1}, not {2}".format(key, self.showType(members[key]), self.showType(type))
+        return "{0} is not {1}".format(self.showType(subtype), self.showType(supertype))
+
+    def expect(self, subtype, supertype, span, what):
+        if not self.isSubtype(subtype, supertype):
+            self.errors.append((span, "{0} is not of type {1}: {2}".format(what, self.showType(supertype), self.explain(subtype, supertype))))
+
+    def checkApplication(self, node, frame):
+        declared = self.declaredMembers(node[1], frame)
+        if len(declared) == 0:
+            return
+        argumentMembers = self.members.get(self.unfolded(self.typeOf(node[2], frame)))
+        if argumentMembers == None:
+            return
+        for (key, (scope, slot)) in sorted(declared.items()):
+            if key in argumentMembers:
+                self.expect(argumentMembers[key], self.slotType(scope, slot), node[-1], "argument {0}".format(scope.slots[slot][0][1]))
+
+    def check(self, node, frame):
+        if node == None:
+            return
+        kind = node[0]
+        if kind == PARSED_SCOPE:
+            scope = self.scopeFrame(node, frame)
+            for (slot, (name, typeNode, value, hidden, key)) in enumerate(scope.slots):
+                self.check(typeNode, scope)
+                self.check(value, scope)
+                if typeNode != None and (value != None or hidden != None):
+                    valueType = self.typeOf(value, scope) if value != None else self.memberType(self.slotType(scope, hidden), key)
+                    self.expect(valueType, self.slotType(scope, slot), name[-1], name[1])
+
+        elif kind == PARSED_CASE:
+            self.check(node[1], frame)
+            for (pattern, patternType, body) in node[2]:
+                if pattern[0] == PARSED_SCOPE:
+                    for (name, nameType, value) in pattern[1]:
+                        self.check(nameType, frame)
+                        self.check(value, frame)
+                self.check(patternType, frame)
+                self.check(body, self.branchFrame(pattern, patternType, frame))
+            self.check(node[3], frame)
+
+        elif kind == PARSED_APPLICATION:
+            self.check(node[1], frame)
+            self.check(node[2], frame)
+            self.checkApplication(node, frame)
+
+        elif kind == PARSED_MEMBER_ACCESS:
+            parts = operatorParts(node)
+            if parts != None:
+                self.check(parts[1], frame)
+                self.check(parts[2], frame)
+            else:
+                self.check(node[1], frame)
+
+        elif kind == PARSED_UNION_TYPE:
+            for alternative in node[1]:
+                self.check(alternative, frame)
+
+        elif kind == LOWERED_OPERATOR:
+            self.check(node[2], frame)
+            self.check(node[3], frame)
+
+        elif kind == LOWERED_LIST:
+            for item in node[1]:
+                self.check(item, frame)
+
+# [(span, message)] for each value not of its declared type, in source order
+def checkTypes(expression):
+    checker = TypeChecker()
+    checker.check(resolveNames(expression), None)
+    return sorted(checker.errors)
@@ -3,14 +3,710 @@ import string
 import optparse
 import logging
 import os
+import time
+import multiprocessing
+import tempfile
+import shutil
+import json
 from FileReader import FileReader
-from Lexer import Lexer
-from Parser import tryParseWholeFileScope
+from BufferReader import StringReader, BufferReader, StreamReader
+from Lexer import *
+from FastLexer import FastLexer
+from TokenBuffer import TokenBuffer
+from Packrat import PackratMemo
+from Incremental import IncrementalParse
+from Batch import findSources, parseFiles
+from ParseCache import parseCached
+from Stats import Stats
+import Parser
+from Parser import tryParseWholeFileScope, iterWholeFileScope, PARSED_SCOPE, PARSED_MEMBER_ACCESS, PARSED_CASE, PARSED_NAME
+import StackParser
+import Evaluator
+from Resolver import resolveNames, RESOLVED_NAME
+from TreeWalker import evaluateProgramWalking
+from Lowering import lower, expand
+from TailCalls import markTailCalls, TailApplication
+from Server import ParseServer, UnixParseServer
+from Client import ParseClient
+from Parallel import parallelLex, parallelParse, splitOffsets
+from Modules import ModuleLoader, ModuleError, RuleTrie, allowsLinear, parsePattern
+import random
+from TypeChecker import TypeChecker, checkTypes
+import CaseReport
+import SymbolTable
+import threading
+
+def lexAll(tokenSource):
+    tokens = []
+    token = tokenSource.get()
+    while token[0] != TOKEN_FILEEND:
+        tokens.append(token)
+        token = tokenSource.get()
+    return tokens
+
+def makeTokenSource(path, options):
+    lexerClass = FastLexer if options.fast_lexer else Lexer
+    tokenSource = lexerClass(BufferReader(path, options.mmap))
+    if options.token_buffer or options.packrat:
+        tokenSource = TokenBuffer(tokenSource)
+    if options.packrat:
+        tokenSource.memo = PackratMemo()
+    return tokenSource
+
+def fullParse(source):
+    try:
+        return IncrementalParse(source).expression
+    except Exception:
+        return None
+
+def incrementalParse(incremental, start, end, text):
+    try:
+        incremental.edit(start, end, text)
+        return incremental.absoluteExpression()
+    except Exception:
+        return None
+
+# every edit must leave the same parse (or failure) as parsing the edited text from scratch
+def testIncremental(path):
+    source = open(path, 'rb').read()
+    edits = []
+    for offset in range(0, len(source), 5):
+        edits += [(offset, offset, " "), (offset, offset, "\n"), (offset, offset + 1, ""), (offset, offset, "x = 1\n")]
+
+    for (start, end, text) in edits:
+        edited = source[:start] + text + source[end:]
+        if incrementalParse(IncrementalParse(source), start, end, text) != fullParse(edited):
+            raise Exception("incremental parse differs for {0} after replacing {1}:{2} with {3}".format(path, start, end, repr(text)))
+
+    # and a run of edits on the same parse, including ones that leave it invalid
+    # for a while - leaving the scopes it returned before as they were
+    incremental = IncrementalParse(source)
+    returned = [(incremental.expression, list(incremental.expression[1]))]
+    for (start, end, text) in edits[::7]:
+        source = source[:start] + text + source[end:]
+        if incrementalParse(incremental, start, end, text) != fullParse(source):
+            raise Exception("incremental parse differs for {0} after a run of edits".format(path))
+        if incremental.expression != None:
+            returned.append((incremental.expression, list(incremental.expression[1])))
+    for (expression, declarations) in returned:
+        if expression[1] != declarations:
+            raise Exception("an edit changed a scope returned earlier for {0}".format(path))
+
+def parseMany(args, options):
+    jobs = options.jobs if options.jobs != None else 1
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+
+    paths = findSources(args)
+    failures = 0
+    totalSize = 0
+    start = time.time()
+    for (path, error, elapsed, size, expression) in parseFiles(paths, jobs, options.fast_lexer, options.ast, options.cache_dir):
+        totalSize += size
+        if error != None:
+            failures += 1
+            print "{0}: FAILED in {1:.3f}s: {2}".format(path, elapsed, error)
+        else:
+            print "{0}: ok in {1:.3f}s".format(path, elapsed)
+            if options.ast:
+                print repr(expression)
+    elapsed = time.time() - start
+
+    print "{0} files, {1} failed, {2} bytes in {3:.3f}s ({4:.0f} bytes/s, {5:.1f} files/s) with {6} jobs".format(
+        len(paths), failures, totalSize, elapsed, totalSize / elapsed, len(paths) / elapsed, jobs)
+    return 1 if failures != 0 else 0
+
+# a cached parse must load back exactly as it was parsed, sharing the interned nodes
+def testParseCache(path, expression):
+    cacheDir = tempfile.mkdtemp()
+    try:
+        for attempt in ["fresh", "cached"]:
+            cached = parseCached(path, cacheDir)
+            if cached != expression:
+                raise Exception("{0} parse from the cache differs for {1}".format(attempt, path))
+        if len(os.listdir(cacheDir)) != 1:
+            raise Exception("expected exactly one cache entry for {0}".format(path))
+
+        # an entry that fits, but not with a second one
+        parseCached(path, cacheDir, maxBytes = os.path.getsize(os.path.join(cacheDir, os.listdir(cacheDir)[0])))
+        if len(os.listdir(cacheDir)) != 1:
+            raise Exception("cache entry for {0} should not have been evicted".format(path))
+    finally:
+        shutil.rmtree(cacheDir)
+
+# streaming declarations must give the same declarations, however the file is split into chunks
+def testStreaming(path, expression):
+    for chunkSize in [1, 2, 3, 7, 65536]:
+        if list(iterWholeFileScope(Lexer(StreamReader(path, chunkSize)))) != expression[1]:
+            raise Exception("streamed declarations differ for {0} read in chunks of {1}".format(path, chunkSize))
+
+        # ...and know the line and column of the current position, for errors
+        streamLexer = Lexer(StreamReader(path, chunkSize))
+        bufferLexer = Lexer(BufferReader(path))
+        while True:
+            token = streamLexer.get()
+            if token != bufferLexer.get() or streamLexer.charSource.lineAndColNo() != bufferLexer.charSource.lineAndColNo():
+                raise Exception("streamed tokens differ for {0} read in chunks of {1}".format(path, chunkSize))
+            if token[0] == TOKEN_FILEEND:
+                break
+
+# nesting far deeper than the call stack allows must parse without recursion,
+# to the same AST as the recursive parser gives for shallower nesting
+def testDeepNesting(depth):
+    # the nested source for a depth, the kind of each nested node and where its child is
+    shapes = [
+        (lambda n: "(" * n + "1" + ")" * n, None, None),
+        (lambda n: "{a = " * n + "1" + "}" * n, PARSED_SCOPE, [1, 0, 2]),
+        (lambda n: "[" * n + "1" + "]" * n, PARSED_MEMBER_ACCESS, [1, 1, 0, 2]),
+        (lambda n: "case a | b : " * n + "1", PARSED_CASE, [2, 0, 2])]
+    for (nested, kind, childPath) in shapes:
+        shallow = "x = " + nested(20) + "\n"
+        expression = StackParser.parseWholeFileScope(FastLexer(StringReader(shallow)))
+        if not StackParser.treesEqual(expression, tryParseWholeFileScope(FastLexer(StringReader(shallow)))) or StackParser.reprTree(expression) != repr(expression):
+            raise Exception("stack-safe parse differs for {0}".format(repr(shallow)))
+
+        # past the recursion limit, too deep for == as well as for the recursive
+        # parser, so compared with the stack-safe parse of the original lexer's tokens
+        past = "x = " + nested(sys.getrecursionlimit() + 100) + "\n"
+        expression = StackParser.parseWholeFileScope(FastLexer(StringReader(past)))
+        if not StackParser.treesEqual(expression, StackParser.parseWholeFileScope(TokenBuffer(Lexer(StringReader(past))))):
+            raise Exception("stack-safe parses of {0} differ between lexers".format(repr(nested(2))))
+        if StackParser.treesEqual(expression, StackParser.parseWholeFileScope(FastLexer(StringReader(past.replace("1", "2"))))):
+            raise Exception("stack-safe parses of {0} with different innermost names compared equal".format(repr(nested(2))))
+
+        node = StackParser.parseWholeFileScope(FastLexer(StringReader("x = " + nested(depth) + "\n")))[1][0][2]
+        for i in range(depth if kind != None else 0):
+            if node[0] != kind:
+                raise Exception("expected {0} levels of nesting in {1}".format(depth, repr(nested(2))))
+            for index in childPath:
+                node = node[index]
+        if node[0] != PARSED_NAME or node[1] != "1":
+            raise Exception("expected 1 innermost in {0}".format(repr(nested(2))))
+
+    # implicit scopes take depth squared characters to nest, so go just past
+    # the recursion limit - every level is closed by a single unindent
+    implicitDepth = sys.getrecursionlimit() + 100
+    source = "".join(" " * i + "a =\n" for i in range(implicitDepth)) + " " * implicitDepth + "b = 1\nc = 2\n"
+    for lexer in [Lexer(StringReader(source)), FastLexer(StringReader(source))]:
+        expression = StackParser.parseWholeFileScope(lexer)
+        node = expression
+        for i in range(implicitDepth):
+            node = node[1][0][2]
+        if node[1][0][0][1] != "b" or expression[1][1][0][1] != "c":
+            raise Exception("implicit scopes nested {0} deep parsed wrongly".format(implicitDepth))
+
+# counting must not change the parse, and must be undone afterwards
+def testStats(path, expression):
+    originals = (Lexer.get, FastLexer.next, BufferReader.__init__, Parser.parseScope, Parser.run)
+    stats = Stats()
+    stats.enable()
+    try:
+        counted = tryParseWholeFileScope(FastLexer(BufferReader(path)))
+        countedFromBuffer = tryParseWholeFileScope(TokenBuffer(Lexer(BufferReader(path))))
+    finally:
+        stats.disable()
+    if counted != expression or countedFromBuffer != expression:
+        raise Exception("parse with stats enabled differs for {0}".format(path))
+    if (Lexer.get, FastLexer.next, BufferReader.__init__, Parser.parseScope, Parser.run) != originals:
+        raise Exception("disabling stats did not restore the original functions")
+    if stats.counts["chars read"] != 2 * os.path.getsize(path) or stats.succeeded["parseScope"] == 0 or stats.seconds["parse"] == 0:
+        raise Exception("stats did not count parsing {0}".format(path))
+
+# the compiled evaluator must agree with the tree-walking one
+def testEvaluator(path, expression):
+    compiled = Evaluator.showMembers(Evaluator.evaluateProgram(expression))
+    if compiled != Evaluator.showMembers(evaluateProgramWalking(expression)):
+        raise Exception("compiled and tree-walking evaluations differ for {0}".format(path))
+    if compiled != Evaluator.showMembers(Evaluator.evaluateProgram(expression, True)):
+        raise Exception("trampolined and plain compiled evaluations differ for {0}".format(path))
+
+    # comparing a string with anything but a string is an error, whichever side it is on
+    mixed = tryParseWholeFileScope(FastLexer(StringReader('a = "a" < `b\nb = `b > "a"\nc = "a" <= 1\nd = "a" < "b"\n')))
+    for evaluate in [Evaluator.evaluateProgram, evaluateProgramWalking, lambda expression: Evaluator.evaluateProgram(lower(expression))]:
+        shown = [value for (name, value) in Evaluator.showMembers(evaluate(mixed))]
+        if [value[:8] for value in shown[:3]] != ["<error: "] * 3 or shown[3] != "`true":
+            raise Exception("mixed comparisons evaluated to {0}".format(shown))
+
+# lowering without folding must be undone exactly by expanding, and a lowered
+# program must evaluate just as the original does
+def testLowering(path, expression):
+    if expand(lower(expression, False)) != expression:
+        raise Exception("expanding the lowered AST differs for {0}".format(path))
+    if Evaluator.showMembers(Evaluator.evaluateProgram(lower(expression))) != Evaluator.showMembers(evaluateProgramWalking(expression)):
+        raise Exception("lowered and tree-walking evaluations differ for {0}".format(path))
+
+# built in operators on constants fold, declared ones and errors do not
+def testFolding():
+    source = "a = 1 + 2 * 3\nb = 2 - 5\nc = 3 <= 4\nd = 1 / 0\ne = x + 1\nf =\n    + = 1\n    g = 1 + 2\n"
+    lowered = lower(tryParseWholeFileScope(FastLexer(StringReader(source))))
+    folded = [value for (name, nameType, value) in lowered[1]]
+    if folded[0][:2] != (PARSED_NAME, "7") or folded[2][:2] != (PARSED_NAME, "`true"):
+        raise Exception("constants were not folded: {0}".format(folded))
+    if folded[1][0] != Parser.LOWERED_OPERATOR or folded[1][2] != None or folded[1][3][1] != "3":
+        raise Exception("negative constant folded to {0}".format(folded[1]))
+    if folded[3][0] != Parser.LOWERED_OPERATOR or folded[4][0] != Parser.LOWERED_OPERATOR or folded[5][1][1][2][0] != Parser.LOWERED_OPERATOR:
+        raise Exception("folded what cannot be: {0}".format(folded))
+
+# the server must reply with the AST the command line prints, answer again
+# from its cache, and serve clients at the same time
+def testServer(paths):
+    parseServer = ParseServer()
+    for path in paths:
+        expected = repr(tryParseWholeFileScope(Lexer(BufferReader(path))))
+        for cached in [False, True]:
+            reply = json.loads(parseServer.handle(json.dumps({"id": path, "path": path})))
+            if reply != {"id": path, "ast": expected, "cached": cached}:
+                raise Exception("server replied {0} for {1}".format(reply, path))
+    for request in ['{"source": "a = (1"}', '{"path": "./no-such-file.minx"}', 'not json', '[1]', '{"id": 3}']:
+        if "error" not in json.loads(parseServer.handle(request)):
+            raise Exception("server did not report an error for {0}".format(request))
+
+    socketDir = tempfile.mkdtemp()
+    server = UnixParseServer(os.path.join(socketDir, "server"), parseServer)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.start()
+    try:
+        clients = [ParseClient(os.path.join(socketDir, "server")) for i in range(2)]
+        # each client's requests go between the other's, on connections open at once
+        for path in paths:
+            for client in clients:
+                if client.parse(path).get("cached") != True:
+                    raise Exception("server did not reply from its cache for {0}".format(path))
+        stats = clients[0].request({"stats": True})["stats"]
+        # and one miss for the source that failed to parse
+        if (stats["hits"], stats["misses"]) != (3 * len(paths), len(paths) + 1):
+            raise Exception("server counted {0}".format(stats))
+        for client in clients:
+            client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        shutil.rmtree(socketDir)
+
+# lexing and parsing in chunks must give exactly what doing it in one go does,
+# including when a chunk starts inside a string or holds only comments, and
+# fail just as it does
+def testParallel(paths):
+    programs = [open(path).read() for path in paths]
+    source = "# comments only\n\n" + "\n".join(programs * 3) + 'text = "two\nlines = 2\n"\nafter = 1\n'
+    boundaries = sorted(set([0, source.index("\n\n") + 2, source.index("lines = 2")] + splitOffsets(source, 40) + [len(source)]))
+    expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+    for jobs in [1, 2]:
+        if lexAll(parallelLex(source, jobs, boundaries = boundaries)) != lexAll(FastLexer(StringReader(source))):
+            raise Exception("parallel lexing with {0} jobs differs".format(jobs))
+        if tryParseWholeFileScope(parallelLex(source, jobs, boundaries = boundaries)) != expression:
+            raise Exception("parsing parallel lexed tokens with {0} jobs differs".format(jobs))
+        if parallelParse(source, jobs, boundaries = boundaries) != expression:
+            raise Exception("parallel parsing with {0} jobs differs".format(jobs))
+
+    broken = source + "broken = (1\nlast = 2\n"
+    errors = []
+    for parse in [lambda: tryParseWholeFileScope(FastLexer(StringReader(broken))), lambda: parallelParse(broken, 2, boundaries = boundaries + [len(broken)])]:
+        try:
+            parse()
+        except Exception as e:
+            errors.append(str(e))
+    if len(errors) != 2 or errors[0] != errors[1]:
+        raise Exception("parallel parsing failed with {0}".format(errors))
+
+# a program's modules must load in dependency order, be parsed once while
+# unchanged, and keep to the import rules, which the trie must apply just as
+# testing them one at a time does
+def testModules():
+    sources = {
+        "main.minx": 'import = [{library = "Standard", rules = [{import = "*"}, {exclude = "System.Uri"}]}]\n'
+            + 'exclude = [{namespaces = ["*"], rules = [{exclude = "MyApp.*"}]}, {namespaces = ["Main"], rules = [{import = "MyApp.UI.*"}]}, {namespaces = ["MyApp.UI.*"], rules = [{import = "myapp.logic.*"}]}]\n'
+            + 'shown = MyApp.UI.View.render\n',
+        "MyApp/UI/View.minx": 'render = "{MyApp.Logic.Rules.total} {System.Text.upper}"\n',
+        "MyApp/Logic/Rules.minx": 'total = System.Text.length + 1\n',
+        "Standard/System/Text.minx": 'upper = 1\nlength = 2\n',
+        "Standard/System/Uri.minx": 'escape = 1\n',
+        "Unused/Thing.minx": 'thing = 1\n'}
+    projectDir = tempfile.mkdtemp()
+    def write(path, source):
+        if not os.path.isdir(os.path.dirname(os.path.join(projectDir, path))):
+            os.makedirs(os.path.dirname(os.path.join(projectDir, path)))
+        with open(os.path.join(projectDir, path), 'w') as sourceFile:
+            sourceFile.write(source)
+    try:
+        for (path, source) in sources.items():
+            write(path, source)
+        for jobs in [1, 2]:
+            loader = ModuleLoader(jobs)
+            for (hits, misses) in [(0, 4), (4, 4)]:
+                program = loader.load(os.path.join(projectDir, "main.minx"))
+                order = [(module.name, sorted(module.dependencies)) for module in program.order()]
+                if order != [("System.Text", []), ("MyApp.Logic.Rules", ["system.text"]), ("MyApp.UI.View", ["myapp.logic.rules", "system.text"]), ("main", ["myapp.ui.view"])]:
+                    raise Exception("modules loaded as {0}".format(order))
+                if (loader.hits, loader.misses) != (hits, misses):
+                    raise Exception("module cache counted {0} hits and {1} misses".format(loader.hits, loader.misses))
+                if program.modules["system.text"].expression != tryParseWholeFileScope(Lexer(BufferReader(os.path.join(projectDir, "Standard/System/Text.minx")))):
+                    raise Exception("module System.Text parsed wrongly")
+            if program.dependents("system.text") != ["myapp.logic.rules", "myapp.ui.view"]:
+                raise Exception("System.Text used by {0}".format(program.dependents("system.text")))
+        write("MyApp/Logic/Rules.minx", 'total = System.Text.length + 2 * 3\n')
+        loader.load(os.path.join(projectDir, "main.minx"))
+        if (loader.hits, loader.misses) != (7, 5):
+            raise Exception("an edited module was not parsed again")
+
+        # each of these breaks the rules
+        for (path, source) in [
+                ("MyApp/Logic/Rules.minx", 'total = MyApp.UI.View.render\n'),
+                ("MyApp/UI/View.minx", 'render = System.Uri.escape\n'),
+                ("main.minx", sources["main.minx"].replace('{import = "*"}, {exclude = "System.Uri"}', '{exclude = "System.Uri"}, {import = "*"}')),
+                ("main.minx", sources["main.minx"].replace('"MyApp.UI.*"]', '"*"]')),
+                ("main.minx", sources["main.minx"].replace('"System.Uri"', '"System.*.Uri"'))]:
+            write(path, source)
+            try:
+                ModuleLoader().load(os.path.join(projectDir, "main.minx"))
+                raise Exception("{0} should not load".format(source))
+            except ModuleError:
+                pass
+            write(path, sources[path])
+    finally:
+        shutil.rmtree(projectDir)
+
+    generator = random.Random(0)
+    parts = ["a", "b", "c"]
+    def randomName():
+        return [generator.choice(parts) for i in range(generator.randint(1, 4))]
+    for attempt in range(50):
+        rules = [(rank, parsePattern(generator.choice(["*", ".".join(randomName()), ".".join(randomName()) + ".*"])), generator.random() < 0.5) for rank in range(generator.randint(0, 8))]
+        trie = RuleTrie(rules)
+        for i in range(50):
+            name = randomName()
+            if trie.allows(name) != allowsLinear(rules, name):
+                raise Exception("rule trie and linear rules differ for {0} with {1}".format(name, rules))
+
+# values not of their declared types must be found, and nothing else; and
+# comparing recursive types with the memo of earlier comparisons must give
+# what comparing them afresh does
+def testTypes(paths):
+    for path in paths:
+        errors = checkTypes(tryParseWholeFileScope(Lexer(BufferReader(path))))
+        if len(errors) != 0:
+            raise Exception("type errors in {0}: {1}".format(path, errors))
+
+    source = "\n".join([
+        "list = `empty_list | {hd, tl list}",
+        "otherList = `empty_list | {hd, tl otherList}",
+        "ints = `empty_list | {hd Int, tl ints}",
+        "person = {firstName String, surname String}",
+        'me person = {firstName = "Tom", surname = "Carver"}',
+        'notMe person = {firstName = "Tom"}',
+        'wrong person = {firstName = 4, surname = "Carver"}',
+        "numbers list = [1, 2, 3]",
+        "moreNumbers ints = [1, 2, 3]",
+        'notNumbers ints = [1, "two", 3]',
+        "notList list = {hd = 1}",
+        "count Int = 4",
+        'notCount Int = "four"',
+        "yes Symbol = `yes",
+        'fields = {a Int, b String = "b"}',
+        "applied = fields {a = 1}",
+        'notApplied = fields {a = "one"}',
+        'notCast = {a = "one"} as fields',
+        "aliased otherList = numbers",
+        "chosen Int = case count",
+        "    | 4 : 1",
+        "    | else : 2",
+        "notChosen Int = case count",
+        "    | 4 : 1",
+        "    | else : `two",
+        # whether secondLoop is a fourthLoop is first worked out assuming that
+        # firstLoop is a thirdLoop, which it is not
+        "firstLoop = {next secondLoop, tag Int}",
+        "secondLoop = {next firstLoop}",
+        "thirdLoop = {next fourthLoop, tag String}",
+        "fourthLoop = {next thirdLoop}",
+        "first firstLoop = {next = second, tag = 1}",
+        "second secondLoop = {next = first}",
+        "notThird thirdLoop = first",
+        "notFourth fourthLoop = second"]) + "\n"
+    expected = ["notMe", "wrong", "notNumbers", "notList", "notCount", "notApplied", "notCast", "notChosen", "notThird", "notFourth"]
+    found = [source[source.rindex("\n", 0, span[0]) + 1:].split()[0] for (span, message) in checkTypes(tryParseWholeFileScope(Lexer(StringReader(source))))]
+    if found != expected:
+        raise Exception("type errors found in {0}, expected in {1}".format(found, expected))
+
+    generator = random.Random(0)
+    count = 6
+    def randomType(depth):
+        choice = generator.randrange(5 if depth < 2 else 3)
+        if choice == 0:
+            return generator.choice(["Int", "String", "1", "`a"])
+        elif choice < 3:
+            return "t{0}".format(generator.randrange(count))
+        elif choice == 3:
+            return "({0} | {1})".format(randomType(depth + 1), randomType(depth + 1))
+        return "{" + ", ".join("{0} {1}".format(generator.choice("abc"), randomType(depth + 1)) for i in range(generator.randint(1, 3))) + "}"
+    for attempt in range(20):
+        source = "\n".join("t{0} = {1}".format(i, randomType(0)) for i in range(count)) + "\n"
+        expression = resolveNames(tryParseWholeFileScope(Lexer(StringReader(source))))
+        def declaredTypes(checker):
+            frame = checker.scopeFrame(expression, None)
+            return [checker.refType(frame, slot) for slot in range(count)]
+        shared = TypeChecker()
+        sharedTypes = declaredTypes(shared)
+        for (i, j) in [(i, j) for i in range(count) for j in range(count)]:
+            fresh = TypeChecker()
+            freshTypes = declaredTypes(fresh)
+            if shared.isSubtype(sharedTypes[i], sharedTypes[j]) != fresh.isSubtype(freshTypes[i], freshTypes[j]):
+                raise Exception("memoized subtype check of t{0} and t{1} differs in {2}".format(i, j, source))
+
+# names must resolve to the scope declaring them, counting out from where
+# they are used - through the scopes lists desugar to, but not operators'
+def testResolver():
+    source = "a = 1\nb =\n    c = a + 2\n    d = [a, c]\n    e = case d\n        | {hd, tl} : tl@hd\n        | else : f\n"
+    addresses = []
+    stack = [resolveNames(tryParseWholeFileScope(FastLexer(StringReader(source))))]
+    while len(stack) != 0:
+        item = stack.pop()
+        if isinstance(item, tuple) and len(item) != 0 and item[0] == RESOLVED_NAME:
+            addresses.append((item[1], item[2], item[3]))
+        elif isinstance(item, (tuple, list)):
+            stack.extend(reversed(item))
+    expected = [("1", None, None), ("a", 1, 0), ("2", None, None), ("+", None, None),
+        ("a", 2, 0), ("c", 1, 0), ("!0", 1, 0), ("!1", 2, 1), ("`empty_list", None, None),
+        ("d", 0, 1), ("tl", 0, 1), ("f", None, None)]
+    if addresses != expected:
+        raise Exception("resolved {0}, expected {1}".format(addresses, expected))
+
+# only calls whose result is their declaration's are tail calls, and running
+# them trampolined takes no more stack however long a list they recurse along
+def testTailCalls(length):
+    source = """count = case n
+    | 0 : `empty_list
+    | else : {hd = n, tl = count ({m = n} as {n = m - 1})}
+item = case list
+    | {hd, tl} : case index
+        | 0 : hd
+        | else : item ({oldIndex = index} as {list = tl, index = oldIndex - 1})
+    | else : `invalid_index
+total = case list
+    | {hd, tl} : case sum
+        | s int : total ({oldSum = s} as {list = tl, sum = oldSum + hd})
+    | else : sum
+numbers = count {n = {0}}
+last = item {list = numbers, index = {1}}
+summed = total {list = numbers, sum = 0}
+""".replace("{0}", str(length)).replace("{1}", str(length - 1))
+    expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+    tails = []
+    stack = [markTailCalls(resolveNames(expression))]
+    while len(stack) != 0:
+        item = stack.pop()
+        if isinstance(item, TailApplication):
+            tails.append(item[1][1])
+        if isinstance(item, (tuple, list)):
+            stack.extend(reversed(item))
+    if tails != ["count", "item", "total", "count", "item", "total"]:
+        raise Exception("tail calls found to {0}".format(tails))
+    shown = dict(Evaluator.showMembers(Evaluator.evaluateProgram(expression, True)))
+    if (shown["last"], shown["summed"]) != ("1", str(length * (length + 1) / 2)):
+        raise Exception("trampolined evaluation gave last = {0}, summed = {1}".format(shown["last"], shown["summed"]))
+
+# a case compiled into a decision tree must take the branch, and bind the
+# members, that testing each pattern in turn does - whatever literals repeat,
+# and whatever scope patterns compare - and its report must find the branches
+# never taken and those missing
+def testCaseTrees():
+    generator = random.Random(0)
+    choices = ["0", "1", "2", "`a", "`b", "`c", "known", "i Int", "s Symbol", "t String",
+        "{kind = `a, v}", "{kind = `b, v}", "{kind = `a}", "{kind = `c, w = 3}", "{kind = 1, v = `a}",
+        "{v}", "{kind, v = 1}", "{v = known}", "{hd = 1, tl}", "{hd, tl}"]
+    subjects = '[0, 1, 2, 5, `a, `b, `d, "a", "b", {kind = `a, v = 1}, {kind = `b}, {v = 2}, {kind = 1, v = `a}, {kind = `c, v = `a, w = 3}, {v = `a, kind = `b, w = 4}, {kind = `a, v = 1, x = 2}, [1, 2], [3]]'
+    for attempt in range(100):
+        branches = [generator.choice(choices) for i in range(generator.randint(1, 12))]
+        source = "known = `a\nsubjects = {0}\nc = case `a\n".format(subjects) + "".join("    | {0} : {1}\n".format(branch, i) for (i, branch) in enumerate(branches))
+        expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+        patterns = [(pattern, patternType) for (pattern, patternType, body) in resolveNames(expression)[1][2][2][2]]
+        (tree, sequential) = (Evaluator.compileMatcher(patterns), Evaluator.compileSequentialMatcher(patterns))
+        for program in [expression, lower(expression)]:
+            top = Evaluator.evaluateProgram(program)
+            for subject in Evaluator.listItems(Evaluator.force(top.slots[1])) * 2:
+                found = [match(Evaluator.force(subject), top, None) for match in [tree, sequential]]
+                bound = [(index, bound is top or (bound.shape.names, bound.slots)) for (index, bound) in [each for each in found if each != None]]
+                if found.count(None) == 1 or (len(bound) == 2 and bound[0] != bound[1]):
+                    raise Exception("decision tree found {0}, testing in turn {1}, for {2} in {3}".format(found[0], found[1], Evaluator.show(subject), branches))
+
+    source = "\n".join([
+        "shape = `circle | `square | {width, height}",
+        "s shape = `circle",
+        "area = case s",
+        "    | `circle : 1",
+        "    | `square : 2",
+        "    | {width, height} : 3",
+        "partial = case s",
+        "    | `circle : 1",
+        "    | `circle : 2",
+        "    | {width} : 3",
+        "    | {width, height} : 4",
+        "n Int = 4",
+        "numbers = case n",
+        "    | 0 : `zero",
+        "    | i Int : `other",
+        "    | 5 : `five",
+        "anything = case other",
+        "    | 1 : 1",
+        "    | else : 2",
+        # patterns typed by scopes, unions and names cover what is of their type
+        "list = `empty_list | {hd, tl list}",
+        "l list = `empty_list",
+        "lists = case l",
+        "    | `empty_list : 0",
+        "    | xs list : 1",
+        "person = {name}",
+        "p person = {name = 1}",
+        "people = case p",
+        "    | q person : 1",
+        "again = case l",
+        "    | xs list : 1",
+        "    | `empty_list : 0",
+        "    | ys list : 2",
+        "notPerson = case l",
+        "    | q person : 1"]) + "\n"
+    reports = [(report.branches, report.literals, report.scopeShapes, report.unreachable, report.missing, report.exhaustive()) for report in CaseReport.caseReports(tryParseWholeFileScope(Lexer(StringReader(source))))]
+    if reports != [(3, 2, 1, [], [], True), (4, 1, 2, [1, 3], ["`square"], False), (3, 2, 0, [2], [], True), (1, 1, 0, [], [], True),
+            (2, 1, 0, [], [], True), (1, 0, 0, [], [], True), (3, 1, 0, [1, 2], [], True), (1, 0, 0, [], ["`empty_list", "{hd, tl list}"], False)]:
+        raise Exception("case reports {0}".format(reports))
+
+# names must be interned as they are lexed: every spelling of a name sharing
+# its id and case-folded key, and every use of a spelling the one string -
+# including names first seen in other processes, whose ids must be this one's
+def testSymbolTable():
+    source = "Total = 1\ntotal2 = TOTAL + total\nshown = \"{total} {+}\"\n"
+    for lexer in [Lexer(StringReader(source)), FastLexer(StringReader(source)), TokenBuffer(FastLexer(StringReader(source)))]:
+        names = [token for token in lexAll(lexer) if token[0] in [TOKEN_NAME, TOKEN_INFIX]]
+        names += [name for token in lexAll(TokenBuffer(FastLexer(StringReader(source)))) if token[0] == TOKEN_STRING for name in token[2]]
+        totals = [name for name in names if name[1].lower() == "total"]
+        if len(totals) != 4 or len(set(name[4] for name in totals)) != 1 or totals[2][1] is not totals[3][1] or totals[0][1] == totals[1][1]:
+            raise Exception("names lexed as {0}".format(names))
+        if SymbolTable.symbolKeys[totals[0][4]] != "total" or SymbolTable.internName("tOtAl")[1] != totals[0][4]:
+            raise Exception("total folded to {0}".format(SymbolTable.symbolKeys[totals[0][4]]))
+    expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+    if Parser.nameKey(expression[1][0][0]) is not Parser.nameKey(resolveNames(expression)[1][2][2][2][0]):
+        raise Exception("declared and used names have different keys")
+
+    # names no process has seen yet, parsed in other processes first
+    fresh = "".join("unseen{0}{1} = Unseen{0}{1} + {2}\n".format(os.getpid(), i, i) for i in range(20000))
+    parsed = parallelParse(fresh, 2, boundaries = [0] + splitOffsets(fresh, 4) + [len(fresh)])
+    if parsed != tryParseWholeFileScope(FastLexer(StringReader(fresh))):
+        raise Exception("names parsed in other processes have other ids")
+    sourceDir = tempfile.mkdtemp()
+    try:
+        for i in range(4):
+            with open(os.path.join(sourceDir, "{0}.minx".format(i)), 'w') as sourceFile:
+                sourceFile.write("elsewhere{0}{1} = Elsewhere{0}{1}\n".format(os.getpid(), i))
+        paths = findSources([sourceDir])
+        batched = [expression for (path, error, elapsed, size, expression) in parseFiles(paths, 2, keepAst = True)]
+        if batched != [tryParseWholeFileScope(FastLexer(BufferReader(path))) for path in paths]:
+            raise Exception("names parsed in worker processes have other ids")
+    finally:
+        shutil.rmtree(sourceDir)
+
+# names added in several threads at once must each get one id, with their key
+def testSymbolTableThreads():
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    def addNames(thread):
+        for i in range(2000):
+            SymbolTable.internName("threaded{0}Name{1}".format(os.getpid(), i) if i % 2 == 0 else "threaded{0}Thread{1}Name{2}".format(os.getpid(), thread, i))
+    threads = [threading.Thread(target = addNames, args = (thread,)) for thread in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setcheckinterval(interval)
+    table = SymbolTable.symbolTable
+    if len(table.keys) != len(table.ids) or any(table.keys[nameId] != key for (key, nameId) in table.ids.items()):
+        raise Exception("names added in threads were given ids of other names")
+    if any(table.keys[nameId] != spelling.lower() for (spelling, nameId) in table.spelled.values()):
+        raise Exception("spellings added in threads have the ids of other names")
+
+def testEvaluation():
+    source = """item = case list
+    | {hd, tl} : case index
+        | 0 : hd
+        | else : item ({oldIndex = index} as {list = tl, index = oldIndex - 1})
+    | else : `invalid_index
+numbers = [10, 11, 12, 13]
+third = item {list = numbers, index = 3}
+missing = item {list = numbers, index = 9}
+kind = case "text"
+    | n int : `number
+    | s string : `string
+greeting = "hello {who}"
+greetTom = greeting {who = "Tom"}
+{first, second} = {first = 1, second = 2, third = 3}
+self = {a = 1, b = $@a + 1}
+defaults = {a = 2} as {a, b = a * 10}
+arithmetic = [-6 * 2, 7 / 2, 7 % 2, 2 ^ 10, 3 <= 4]
+plus = +
+viaPlus = plus {lhs = 2, rhs = 3}
+unmatched = case 5
+    | 4 : `four
+divideByZero = 1 / 0
+pair = {hd, tl}
+firstOf = hd * 2
+listMembers = [numbers@hd, numbers@tl@tl@hd, [1]@tl]
+listMatches = case numbers
+    | {hd = 10, tl} : case tl
+        | p pair : p@hd
+listUses = [numbers {hd = 0}, firstOf numbers, numbers@tl == numbers@tl, {hd = 9, tl = numbers}]
+"""
+    expected = [
+        ("item", "<function of list>"),
+        ("numbers", "[10, 11, 12, 13]"),
+        ("third", "13"),
+        ("missing", "`invalid_index"),
+        ("kind", "`string"),
+        ("greeting", "<function of who>"),
+        ("greetTom", '"hello Tom"'),
+        ("first", "1"),
+        ("second", "2"),
+        ("self", "{a = 1, b = 2}"),
+        ("defaults", "{a = 2, b = 20}"),
+        ("arithmetic", "[-12, 3, 1, 1024, `true]"),
+        ("plus", "(+)"),
+        ("viaPlus", "5"),
+        ("unmatched", "5"),
+        ("divideByZero", "<error: division by zero>"),
+        ("pair", "{hd, tl}"),
+        ("firstOf", "<function of hd>"),
+        ("listMembers", "[10, 12, `empty_list]"),
+        ("listMatches", "11"),
+        ("listUses", "[[0, 11, 12, 13], 20, `true, [9, 10, 11, 12, 13]]")]
+    expression = tryParseWholeFileScope(FastLexer(StringReader(source)))
+    for evaluate in [Evaluator.evaluateProgram, evaluateProgramWalking, lambda expression: Evaluator.evaluateProgram(lower(expression)), lambda expression: Evaluator.evaluateProgram(expression, True)]:
+        shown = Evaluator.showMembers(evaluate(expression))
+        if shown != expected:
+            raise Exception("evaluated {0}, expected {1}".format(shown, expected))
 
 def Main():
-    oParser = optparse.OptionParser(usage='usage: %prog [options] minx-source-file\n')
+    oParser = optparse.OptionParser(usage='usage: %prog [options] minx-source-file\n       %prog [options] minx-source-files-or-directories...\n')
     oParser.add_option('-l', '--loglevel', default="WARNING", help='set the logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
     oParser.add_option('-t', '--test', action='store_true', default=False, help='run the tests')
+    oParser.add_option('-m', '--mmap', action='store_true', default=False, help='memory-map the source file instead of reading it')
+    oParser.add_option('-f', '--fast-lexer', action='store_true', default=False, help='use the table-driven lexer')
+    oParser.add_option('-b', '--token-buffer', action='store_true', default=False, help='lex the whole file into a compact token buffer before parsing')
+    oParser.add_option('-p', '--packrat', action='store_true', default=False, help='memoize parsers by token position (implies --token-buffer) and report hits and misses')
+    oParser.add_option('-j', '--jobs', type='int', help='parse many files in this many processes (0 for one per cpu)')
+    oParser.add_option('--parallel', type='int', help='lex and parse one large file in chunks in this many processes (0 for one per cpu)')
+    oParser.add_option('--modules', action='store_true', default=False, help='load the modules the file refers to, following its import rules (in --jobs processes), and print them in dependency order (the AST of each with --ast)')
+    oParser.add_option('-c', '--cache-dir', help='reuse parses cached in this directory (keyed by file contents)')
+    oParser.add_option('-s', '--stats', action='store_true', default=False, help='count characters, tokens, ungets and parser alternatives, and time each stage')
+    oParser.add_option('--stats-format', default="table", choices=["table", "json"], help='print the stats as a table or as JSON (table, json)')
+    oParser.add_option('--stack-safe', action='store_true', default=False, help='parse without recursion, for sources nested too deeply for the call stack')
+    oParser.add_option('--stream', action='store_true', default=False, help='read the file a chunk at a time and print each top-level declaration as soon as it is parsed')
+    oParser.add_option('-e', '--evaluate', action='store_true', default=False, help='evaluate the file and print each top-level member')
+    oParser.add_option('--trampoline', action='store_true', default=False, help='evaluate calls in tail position without growing the stack, for deep recursion')
+    oParser.add_option('--lower', action='store_true', default=False, help='lower infix operators and lists to compact nodes, folding constants, before printing or evaluating')
+    oParser.add_option('--check', action='store_true', default=False, help='check the declared types and print each value not of its type, instead of printing the AST')
+    oParser.add_option('--case-report', action='store_true', default=False, help='print how each case is matched, the branches never taken and whether it is exhaustive, instead of printing the AST')
+    oParser.add_option('-a', '--ast', action='store_true', default=False, help='print the AST of each file when parsing many files')
     (options, args) = oParser.parse_args()
 
     numeric_log_level = getattr(logging, options.loglevel.upper(), None)
@@ -22,19 +718,137 @@ def Main():
         testPath = "./test-valid-programs/"
         for path in os.listdir(testPath):
             if path[-5:] == ".minx":
-                logging.debug("running test: {0}".format(path))
-                tokenSource = Lexer(FileReader(testPath + path))
+                logging.debug("running test: %s", path)
+                tokenSource = makeTokenSource(testPath + path, options)
                 expression = tryParseWholeFileScope(tokenSource)
+
+                # the buffered reader must lex exactly as the original one-byte reader
+                if lexAll(Lexer(FileReader(testPath + path))) != lexAll(Lexer(BufferReader(testPath + path, options.mmap))):
+                    raise Exception("BufferReader and FileReader token streams differ for {0}".format(path))
+
+                # ...and the table-driven lexer exactly as the original lexer
+                if lexAll(FastLexer(BufferReader(testPath + path))) != lexAll(Lexer(BufferReader(testPath + path))):
+                    raise Exception("FastLexer and Lexer token streams differ for {0}".format(path))
+
+                # ...and the token buffer must give back exactly the tokens it was built from
+                if lexAll(TokenBuffer(Lexer(BufferReader(testPath + path)))) != lexAll(Lexer(BufferReader(testPath + path))):
+                    raise Exception("TokenBuffer and Lexer token streams differ for {0}".format(path))
+                if tryParseWholeFileScope(TokenBuffer(Lexer(BufferReader(testPath + path)))) != tryParseWholeFileScope(Lexer(BufferReader(testPath + path))):
+                    raise Exception("parsing from a TokenBuffer differs for {0}".format(path))
+
+                packratSource = TokenBuffer(Lexer(BufferReader(testPath + path)))
+                packratSource.memo = PackratMemo(maxEntries = 8)
+                if tryParseWholeFileScope(packratSource) != tryParseWholeFileScope(Lexer(BufferReader(testPath + path))):
+                    raise Exception("packrat parsing differs for {0}".format(path))
+
+                testIncremental(testPath + path)
+                testParseCache(testPath + path, expression)
+                testStats(testPath + path, expression)
+                testStreaming(testPath + path, expression)
+                if StackParser.parseWholeFileScope(FastLexer(BufferReader(testPath + path))) != expression:
+                    raise Exception("stack-safe parse differs for {0}".format(path))
+                packratSource = TokenBuffer(Lexer(BufferReader(testPath + path)))
+                packratSource.memo = PackratMemo(maxEntries = 8)
+                if StackParser.parseWholeFileScope(packratSource) != expression:
+                    raise Exception("stack-safe packrat parse differs for {0}".format(path))
+                testEvaluator(path, expression)
+                testLowering(path, expression)
+        testServer([testPath + path for path in sorted(os.listdir(testPath)) if path[-5:] == ".minx"])
+        testModules()
+        testTypes([testPath + path for path in sorted(os.listdir(testPath)) if path[-5:] == ".minx"])
+        testParallel([testPath + path for path in sorted(os.listdir(testPath)) if path[-5:] == ".minx"])
+        testDeepNesting(100000)
+        testResolver()
+        testFolding()
+        testTailCalls(20000)
+        testCaseTrees()
+        testSymbolTable()
+        testSymbolTableThreads()
+        testEvaluation()
         print "tests all passed"
+        return
  	
-    elif len(args) != 1:
+    elif len(args) == 0:
         oParser.print_help()
+        return
+
+    stats = None
+    if options.stats:
+        if options.jobs not in [None, 1]:
+            oParser.error("--stats can only count what is parsed in this process (--jobs 1)")
+        stats = Stats()
+        stats.enable()
+
+    try:
+        if options.modules:
+            return loadModules(args[0], options)
+        if len(args) > 1 or os.path.isdir(args[0]) or options.jobs != None:
+            return parseMany(args, options)
+        return parseOne(args[0], options)
+    finally:
+        if stats != None:
+            stats.disable()
+            print >> sys.stderr, stats.report(options.stats_format)
+
+def loadModules(path, options):
+    jobs = options.jobs if options.jobs != None else 1
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    try:
+        program = ModuleLoader(jobs).load(path)
+    except ModuleError as e:
+        print >> sys.stderr, e
+        return 1
+    for module in program.order():
+        print "{0} ({1}): {2}".format(module.name, module.path, ", ".join(program.modules[key].name for key in sorted(module.dependencies)))
+        if options.ast:
+            print repr(module.expression)
+    return 0
+
+def parseOne(path, options):
+    if options.stream:
+        for declaration in iterWholeFileScope(Lexer(StreamReader(path))):
+            print repr(declaration)
+        return
+
+    if options.stack_safe:
+        lexerClass = FastLexer if options.fast_lexer else Lexer
+        print StackParser.reprTree(StackParser.parseWholeFileScope(lexerClass(BufferReader(path, options.mmap))))
+        return
+
+    if options.parallel != None:
+        tokenSource = None
+        with open(path, 'rb') as sourceFile:
+            expression = parallelParse(sourceFile.read(), options.parallel or multiprocessing.cpu_count(), path)
+    elif options.cache_dir != None:
+        tokenSource = None
+        expression = parseCached(path, options.cache_dir, FastLexer if options.fast_lexer else Lexer)
     else:
-        tokenSource = Lexer(FileReader(args[0]))
-            
+        tokenSource = makeTokenSource(path, options)
         expression = tryParseWholeFileScope(tokenSource)
+    if options.lower:
+        expression = lower(expression)
+    if options.check:
+        errors = checkTypes(expression)
+        charSource = BufferReader(path)
+        for (span, message) in errors:
+            (line, column) = charSource.lineAndColNoAt(span[0])
+            print "{0}: line: {1}, col: {2}: {3}".format(path, line, column, message)
+        return 1 if len(errors) != 0 else 0
+    if options.case_report:
+        charSource = BufferReader(path)
+        for report in CaseReport.caseReports(expression):
+            (line, column) = charSource.lineAndColNoAt(report.span[0])
+            print "{0}: line: {1}, col: {2}: {3}".format(path, line, column, report.describe())
+        return
+    if options.evaluate:
+        for (name, shown) in Evaluator.showMembers(Evaluator.evaluateProgram(expression, options.trampoline)):
+            print name if shown == None else "{0} = {1}".format(name, shown)
+    else:
         print repr(expression)
+    if options.packrat and tokenSource != None:
+        print >> sys.stderr, tokenSource.memo.report()
 
 if __name__ == '__main__':
-    Main()
+    sys.exit(Main())
 